@@ -1,191 +1,754 @@
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional
+import itertools
+import json
+from datetime import date
+from email.utils import format_datetime, parsedate_to_datetime
+from urllib.parse import urlencode
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import func, case
+from typing import List, Optional, Callable, Any
 
-from app.database import get_db
-from app.models import FinancialPeriod, AccountDetail
+from app.database import CompanyNotFound, CompanyRequired, SessionLocal, company_router
+from app.money import minor, to_units
+from app.models import (
+    FinancialPeriod,
+    Account,
+    AccountCategory,
+    AccountClosure,
+    AccountDetail,
+    Anomaly,
+    CanonicalPeriod,
+    Company,
+    DateDimension,
+    PeriodVariance,
+    QuarterlySummary,
+    date_key
+)
 from app.schemas.financial import (
     FinancialPeriodResponse,
     FinancialSummary,
     NaturalLanguageQuery,
-    QueryResponse
+    QueryResponse,
+    QueryError,
+    BatchQueryRequest,
+    BatchQueryItem,
+    BatchQueryResponse,
+    JobRequest,
+    JobStatus
 )
-from app.services.ai_service import AIService
+from app.services.ai_service import AIService, get_ai_service
+from app.services.data_processor import ingestion_progress
+from app.services.analytics_service import AnalyticsService, AnalyticsError, NoAnalyticsData
+from app.services.forecast_service import ForecastService
+from app.services.export_service import ExportService, ExportFormatError, EXPORT_FORMATS
+from app.services.query_governor import QueryRejected
+from app.services.cache_service import get_generation, make_etag, response_cache
+from app.services.profiling import profiler, tracked
+from app.services.job_queue import job_queue, JobQueueFull, SUCCEEDED, FAILED
 
 
-ai_service = AIService()
+export_service = ExportService.from_env()
+analytics_service = AnalyticsService()
+forecast_service = ForecastService.from_env()
 router = APIRouter()
 
+
+def _not_modified(request: Request, etag: str, updated_at) -> bool:
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and updated_at:
+        try:
+            return updated_at <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    
+    return False
+
+
+async def _run_query(db: Session, call: Callable[[], Any]) -> Any:
+    
+    # Sessions from get_read_db on the async engine run their queries inside
+    # run_sync, on the event loop; any other session's call goes to the
+    # threadpool, as a sync endpoint would.
+    if company_router.async_reads:
+        from sqlalchemy.ext.asyncio import async_session
+        wrapper = async_session(db)
+        if wrapper is not None:
+            return await wrapper.run_sync(lambda _: call())
+    return await run_in_threadpool(tracked(call))
+
+
+async def _cached_json(request: Request, db: Session, build: Callable[[], Any]) -> Response:
+    
+    # Read endpoints only change when DataProcessor.process_all bumps the
+    # data generation, so the generation alone validates the response. The
+    # company is part of the key even when it was resolved by default.
+    generation, updated_at = await _run_query(db, lambda: get_generation(db))
+    company_id = db.info.get("company_id")
+    query = urlencode(sorted(request.query_params.multi_items()))
+    etag = make_etag(generation, request.url.path, f"{company_id}&{query}")
+    
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if updated_at:
+        headers["Last-Modified"] = format_datetime(updated_at, usegmt=True)
+    
+    if _not_modified(request, etag, updated_at):
+        return Response(status_code=304, headers=headers)
+    
+    key = (request.url.path, query, company_id, generation)
+    body = response_cache.get(key)
+    if body is None:
+        body = json.dumps(
+            jsonable_encoder(await _run_query(db, build)),
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":")
+        ).encode("utf-8")
+        response_cache.set(key, body)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def require_profiling_admin(x_admin_token: Optional[str] = Header(None)):
+    
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled; set PROFILING_TOKEN to enable it")
+    if not profiler.authorized(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Admin-Token")
+
+
+def resolve_company(
+    company_id: Optional[int] = Query(None, description="Company (Rootfi company id); optional while only one is loaded")
+) -> Optional[int]:
+    
+    try:
+        return company_router.resolve(company_id)
+    except CompanyNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except CompanyRequired as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def get_company_db(company_id: Optional[int] = Depends(resolve_company)):
+    
+    # Only this company's rows are visible, on whichever engine holds them.
+    db = company_router.session(company_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_read_db(company_id: Optional[int] = Depends(resolve_company)):
+    
+    # For the cached read endpoints. Yields a sync session either way, so
+    # their queries are written once; with async reads it is the one the
+    # AsyncSession wraps and is only used through _run_query.
+    if company_router.async_reads:
+        async with company_router.async_session(company_id) as db:
+            yield db.sync_session
+        return
+    
+    db = company_router.session(company_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def require_ai_service() -> AIService:
+    
+    try:
+        return get_ai_service()
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=f"AI service unavailable: {e}")
+
+
 @router.get("/health")
 def health_check():
     return {"status": "healthy", "message": "Kudwa Financial AI is running!"}
 
 
+@router.get("/ready")
+def readiness_check(response: Response):
+    
+    status = ingestion_progress.snapshot()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+
+@router.get("/companies")
+def list_companies():
+    
+    with SessionLocal() as db:
+        companies = db.query(Company).order_by(Company.id).all()
+    return {
+        "companies": [
+            {"company_id": c.id, "periods": c.periods, "loaded_at": c.loaded_at}
+            for c in companies
+        ],
+        "sharded": company_router.sharded,
+        "default_company_id": company_router.default_company_id
+    }
+
+
 @router.get("/periods", response_model=List[FinancialPeriodResponse])
-def get_all_periods(
+async def get_all_periods(
+    request: Request,
     source: Optional[str] = Query(None, description="Filter by source: quickbooks or rootfi"),
     year: Optional[int] = Query(None, description="Filter by year"),
     quarter: Optional[int] = Query(None, description="Filter by quarter (1-4)"),
-    db: Session = Depends(get_db)
+    fiscal_year: Optional[int] = Query(None, description="Filter by fiscal year (named after the year it ends in)"),
+    fiscal_quarter: Optional[int] = Query(None, ge=1, le=4, description="Filter by fiscal quarter (1-4)"),
+    start_date: Optional[date] = Query(None, description="Periods starting on or after this date"),
+    end_date: Optional[date] = Query(None, description="Periods ending on or before this date"),
+    db: Session = Depends(get_read_db)
 ):
-    query = db.query(FinancialPeriod)
-    
-    if source:
-        query = query.filter(FinancialPeriod.source == source)
-    if year:
-        query = query.filter(FinancialPeriod.year == year)
-    if quarter:
-        query = query.filter(FinancialPeriod.quarter == quarter)
+    def build():
+        query = db.query(FinancialPeriod)
+        
+        if source:
+            query = query.filter(FinancialPeriod.source == source)
+        if year:
+            query = query.filter(FinancialPeriod.year == year)
+        if quarter:
+            query = query.filter(FinancialPeriod.quarter == quarter)
+        if fiscal_year or fiscal_quarter:
+            query = query.join(DateDimension, FinancialPeriod.start_date_key == DateDimension.date_key)
+            if fiscal_year:
+                query = query.filter(DateDimension.fiscal_year == fiscal_year)
+            if fiscal_quarter:
+                query = query.filter(DateDimension.fiscal_quarter == fiscal_quarter)
+        if start_date:
+            query = query.filter(FinancialPeriod.start_date_key >= date_key(start_date))
+        if end_date:
+            query = query.filter(FinancialPeriod.end_date_key <= date_key(end_date))
+        
+        periods = query.order_by(FinancialPeriod.year, FinancialPeriod.month).all()
+        return [FinancialPeriodResponse.model_validate(p) for p in periods]
     
-    return query.order_by(FinancialPeriod.year, FinancialPeriod.month).all()
+    return await _cached_json(request, db, build)
 
 
 @router.get("/periods/{period_id}", response_model=FinancialPeriodResponse)
-def get_period(period_id: int, db: Session = Depends(get_db)):
+async def get_period(period_id: int, request: Request, db: Session = Depends(get_read_db)):
+    
+    def build():
+        period = db.query(FinancialPeriod).filter(FinancialPeriod.id == period_id).first()
+        if not period:
+            raise HTTPException(status_code=404, detail="Period not found")
+        return FinancialPeriodResponse.model_validate(period)
     
-    period = db.query(FinancialPeriod).filter(FinancialPeriod.id == period_id).first()
-    if not period:
-        raise HTTPException(status_code=404, detail="Period not found")
-    return period
+    return await _cached_json(request, db, build)
 
 
 @router.get("/summary", response_model=FinancialSummary)
-def get_financial_summary(
+async def get_financial_summary(
+    request: Request,
     source: Optional[str] = Query(None, description="Filter by source"),
     year: Optional[int] = Query(None, description="Filter by year"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    query = db.query(FinancialPeriod)
-    
-    if source:
-        query = query.filter(FinancialPeriod.source == source)
-    if year:
-        query = query.filter(FinancialPeriod.year == year)
-    
-    periods = query.all()
-    
-    if not periods:
-        raise HTTPException(status_code=404, detail="No data found")
-    
-    total_revenue = sum(p.total_revenue for p in periods)
-    total_expenses = sum(p.total_operating_expenses + p.total_cogs for p in periods)
-    net_income = sum(p.net_income for p in periods)
+    def build():
+        # Without a source, each month is counted once from the
+        # reconciled canonical periods.
+        model = FinancialPeriod if source else CanonicalPeriod
+        query = db.query(
+            func.count(model.id),
+            func.sum(model.total_revenue),
+            func.sum(model.total_operating_expenses + model.total_cogs),
+            func.sum(model.net_income)
+        )
+        
+        if source:
+            query = query.filter(FinancialPeriod.source == source)
+        if year:
+            query = query.filter(model.year == year)
+        
+        period_count, total_revenue, total_expenses, net_income = query.one()
+        
+        if not period_count:
+            raise HTTPException(status_code=404, detail="No data found")
+        
+        return FinancialSummary(
+            total_revenue=total_revenue,
+            total_expenses=total_expenses,
+            net_income=net_income,
+            period_count=period_count,
+            source=source
+        )
     
-    return FinancialSummary(
-        total_revenue=total_revenue,
-        total_expenses=total_expenses,
-        net_income=net_income,
-        period_count=len(periods),
-        source=source
-    )
+    return await _cached_json(request, db, build)
 
 
 @router.get("/quarterly/{year}")
-def get_quarterly_analysis(year: int, db: Session = Depends(get_db)):
-    
-    periods = db.query(FinancialPeriod).filter(
-        FinancialPeriod.year == year
-    ).all()
-    
-    if not periods:
-        raise HTTPException(status_code=404, detail=f"No data found for year {year}")
-    
-    quarters = {}
-    for q in [1, 2, 3, 4]:
-        q_periods = [p for p in periods if p.quarter == q]
-        if q_periods:
-            quarters[f"Q{q}"] = {
-                "revenue": sum(p.total_revenue for p in q_periods),
-                "expenses": sum(p.total_operating_expenses for p in q_periods),
-                "gross_profit": sum(p.gross_profit for p in q_periods),
-                "net_income": sum(p.net_income for p in q_periods),
-                "months": len(q_periods)
+async def get_quarterly_analysis(
+    year: int,
+    request: Request,
+    source: Optional[str] = Query(None, description="Filter by source; reconciled data across sources when omitted"),
+    fiscal: bool = Query(False, description="Treat year and quarters as fiscal (FISCAL_YEAR_START_MONTH)"),
+    db: Session = Depends(get_read_db)
+):
+    def build():
+        if fiscal:
+            # Fiscal quarters come from the date dimension the period starts on.
+            model = FinancialPeriod if source else CanonicalPeriod
+            query = db.query(
+                DateDimension.fiscal_quarter,
+                func.sum(model.total_revenue),
+                func.sum(model.total_operating_expenses),
+                func.sum(model.gross_profit),
+                func.sum(model.net_income),
+                func.count(model.id)
+            ).join(
+                DateDimension, model.start_date_key == DateDimension.date_key
+            ).filter(DateDimension.fiscal_year == year)
+            if source:
+                query = query.filter(FinancialPeriod.source == source)
+            rows = query.group_by(DateDimension.fiscal_quarter).all()
+        elif source:
+            # Per-source quarter totals are precomputed at ingestion time.
+            rows = db.query(
+                QuarterlySummary.quarter,
+                QuarterlySummary.total_revenue,
+                QuarterlySummary.total_operating_expenses,
+                QuarterlySummary.gross_profit,
+                QuarterlySummary.net_income,
+                QuarterlySummary.months
+            ).filter(
+                QuarterlySummary.year == year,
+                QuarterlySummary.source == source
+            ).all()
+        else:
+            rows = db.query(
+                CanonicalPeriod.quarter,
+                func.sum(CanonicalPeriod.total_revenue),
+                func.sum(CanonicalPeriod.total_operating_expenses),
+                func.sum(CanonicalPeriod.gross_profit),
+                func.sum(CanonicalPeriod.net_income),
+                func.count(CanonicalPeriod.id)
+            ).filter(
+                CanonicalPeriod.year == year
+            ).group_by(CanonicalPeriod.quarter).all()
+        
+        if not rows:
+            raise HTTPException(status_code=404, detail=f"No data found for year {year}")
+        
+        quarters = {}
+        for quarter, revenue, expenses, gross_profit, net_income, months in sorted(rows):
+            quarters[f"Q{quarter}"] = {
+                "revenue": revenue,
+                "expenses": expenses,
+                "gross_profit": gross_profit,
+                "net_income": net_income,
+                "months": months
             }
+        
+        return {
+            "year": year,
+            "fiscal": fiscal,
+            "quarters": quarters,
+            "total_periods": sum(row[-1] for row in rows)
+        }
     
-    return {
-        "year": year,
-        "quarters": quarters,
-        "total_periods": len(periods)
-    }
+    return await _cached_json(request, db, build)
+
+
+@router.get("/reconciliation/variances")
+async def get_source_variances(
+    request: Request,
+    year: Optional[int] = Query(None, description="Filter by year"),
+    metric: Optional[str] = Query(None, description="Filter by metric, e.g. total_revenue"),
+    min_difference_pct: Optional[float] = Query(None, ge=0, description="Only months where the sources differ by at least this percentage"),
+    db: Session = Depends(get_read_db)
+):
+    def build():
+        query = db.query(PeriodVariance)
+        
+        if year:
+            query = query.filter(PeriodVariance.year == year)
+        if metric:
+            query = query.filter(PeriodVariance.metric == metric)
+        if min_difference_pct is not None:
+            query = query.filter(func.abs(PeriodVariance.difference_pct) >= min_difference_pct)
+        
+        variances = query.order_by(PeriodVariance.year, PeriodVariance.month, PeriodVariance.metric).all()
+        
+        return {
+            "variances": [
+                {
+                    "year": v.year,
+                    "month": v.month,
+                    "metric": v.metric,
+                    "primary_source": v.primary_source,
+                    "secondary_source": v.secondary_source,
+                    "primary_value": v.primary_value,
+                    "secondary_value": v.secondary_value,
+                    "difference": v.difference,
+                    "difference_pct": v.difference_pct
+                }
+                for v in variances
+            ],
+            "total": len(variances)
+        }
+    
+    return await _cached_json(request, db, build)
+
+
+@router.get("/anomalies")
+async def get_anomalies(
+    request: Request,
+    scope: Optional[str] = Query(None, description="period (statement metrics) or account"),
+    source: Optional[str] = Query(None),
+    year: Optional[int] = Query(None, description="Filter by year"),
+    metric: Optional[str] = Query(None, description="Filter by metric, e.g. total_revenue"),
+    account: Optional[str] = Query(None, description="Filter by account name"),
+    min_severity: Optional[float] = Query(None, ge=0, description="Only points at least this many robust standard deviations out"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_read_db)
+):
+    if scope and scope not in ("period", "account"):
+        raise HTTPException(status_code=400, detail="scope must be 'period' or 'account'")
+    
+    def build():
+        query = db.query(Anomaly, Account.name).outerjoin(Account, Account.id == Anomaly.account_id)
+        
+        if scope:
+            query = query.filter(Anomaly.scope == scope)
+        if source:
+            query = query.filter(Anomaly.source == source)
+        if year:
+            query = query.filter(Anomaly.year == year)
+        if metric:
+            query = query.filter(Anomaly.metric == metric)
+        if account:
+            query = query.filter(Account.name == account)
+        if min_severity is not None:
+            query = query.filter(Anomaly.severity >= min_severity)
+        
+        total = query.count()
+        anomalies = query.order_by(Anomaly.severity.desc(), Anomaly.year, Anomaly.month).limit(limit).all()
+        
+        return {
+            "anomalies": [
+                {
+                    "scope": a.scope,
+                    "source": a.source,
+                    "metric": a.metric,
+                    "account_name": account_name,
+                    "year": a.year,
+                    "month": a.month,
+                    "value": a.value,
+                    "expected": a.expected,
+                    "robust_z": a.robust_z,
+                    "seasonal_z": a.seasonal_z,
+                    "method": a.method,
+                    "direction": a.direction,
+                    "severity": a.severity
+                }
+                for a, account_name in anomalies
+            ],
+            "total": total
+        }
+    
+    return await _cached_json(request, db, build)
 
 
 @router.get("/trends/revenue")
-def get_revenue_trends(
+async def get_revenue_trends(
+    request: Request,
     year: Optional[int] = Query(None),
     source: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    query = db.query(FinancialPeriod)
+    def build():
+        query = db.query(FinancialPeriod)
+        
+        if year:
+            query = query.filter(FinancialPeriod.year == year)
+        if source:
+            query = query.filter(FinancialPeriod.source == source)
+        
+        periods = query.order_by(FinancialPeriod.year, FinancialPeriod.month).all()
+        
+        return {
+            "trends": [
+                {
+                    "year": p.year,
+                    "month": p.month,
+                    "revenue": p.total_revenue,
+                    "source": p.source
+                }
+                for p in periods
+            ],
+            "total_periods": len(periods)
+        }
     
-    if year:
-        query = query.filter(FinancialPeriod.year == year)
-    if source:
-        query = query.filter(FinancialPeriod.source == source)
+    return await _cached_json(request, db, build)
+
+
+async def _analytics_response(request: Request, db: Session, compute: Callable[[], Any]) -> Response:
     
-    periods = query.order_by(FinancialPeriod.year, FinancialPeriod.month).all()
+    # The pandas work would block the event loop inside run_sync, so these
+    # endpoints take a sync session (get_company_db) and build in the
+    # threadpool.
+    def build():
+        try:
+            return compute()
+        except NoAnalyticsData as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except AnalyticsError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     
-    return {
-        "trends": [
-            {
-                "year": p.year,
-                "month": p.month,
-                "revenue": p.total_revenue,
-                "source": p.source
-            }
-            for p in periods
-        ],
-        "total_periods": len(periods)
-    }
+    return await _cached_json(request, db, build)
 
 
-@router.get("/expenses/breakdown")
-def get_expense_breakdown(
-    year: Optional[int] = Query(None),
-    month: Optional[int] = Query(None),
-    db: Session = Depends(get_db)
+@router.get("/analytics/growth")
+async def get_growth(
+    request: Request,
+    granularity: str = Query("month", description="month, quarter or year"),
+    metric: Optional[str] = Query(None, description="One metric column; all metrics when omitted"),
+    source: Optional[str] = Query(None, description="Filter by source; reconciled data across sources when omitted"),
+    year: Optional[int] = Query(None, description="Only return periods of this year"),
+    db: Session = Depends(get_company_db)
+):
+    # Period-over-period (MoM / QoQ / YoY) change and year-over-year change.
+    return await _analytics_response(request, db, lambda: analytics_service.growth(db, granularity, source, metric, year))
+
+
+@router.get("/analytics/rolling")
+async def get_rolling(
+    request: Request,
+    window: int = Query(3, ge=2, le=36, description="Window size in periods"),
+    granularity: str = Query("month", description="month, quarter or year"),
+    metric: Optional[str] = Query(None, description="One metric column; all metrics when omitted"),
+    source: Optional[str] = Query(None, description="Filter by source; reconciled data across sources when omitted"),
+    year: Optional[int] = Query(None, description="Only return periods of this year"),
+    db: Session = Depends(get_company_db)
+):
+    return await _analytics_response(
+        request, db, lambda: analytics_service.rolling(db, window, granularity, source, metric, year)
+    )
+
+
+@router.get("/analytics/ytd")
+async def get_year_to_date(
+    request: Request,
+    metric: Optional[str] = Query(None, description="One metric column; all metrics when omitted"),
+    source: Optional[str] = Query(None, description="Filter by source; reconciled data across sources when omitted"),
+    year: Optional[int] = Query(None, description="Only return periods of this year"),
+    db: Session = Depends(get_company_db)
 ):
-    query = db.query(AccountDetail).filter(AccountDetail.category == "expense")
+    return await _analytics_response(request, db, lambda: analytics_service.year_to_date(db, source, metric, year))
+
+
+@router.get("/analytics/margins")
+async def get_margins(
+    request: Request,
+    granularity: str = Query("month", description="month, quarter or year"),
+    source: Optional[str] = Query(None, description="Filter by source; reconciled data across sources when omitted"),
+    year: Optional[int] = Query(None, description="Only return periods of this year"),
+    db: Session = Depends(get_company_db)
+):
+    return await _analytics_response(request, db, lambda: analytics_service.margins(db, granularity, source, year))
+
+
+@router.get("/analytics/cagr")
+async def get_cagr(
+    request: Request,
+    metric: Optional[str] = Query(None, description="One metric column; all metrics when omitted"),
+    source: Optional[str] = Query(None, description="Filter by source; reconciled data across sources when omitted"),
+    start_year: Optional[int] = Query(None, description="First complete year to compound from"),
+    end_year: Optional[int] = Query(None, description="Last complete year to compound to"),
+    db: Session = Depends(get_company_db)
+):
+    return await _analytics_response(
+        request, db, lambda: analytics_service.cagr(db, source, metric, start_year, end_year)
+    )
+
+
+@router.get("/forecast")
+async def get_forecast(
+    request: Request,
+    metric: Optional[str] = Query(None, description="One metric column; all metrics when omitted"),
+    source: Optional[str] = Query(None, description="Forecast one source; reconciled data across sources when omitted"),
+    horizon: int = Query(12, ge=1, le=36, description="Months ahead of the last actual month"),
+    granularity: str = Query("month", description="month or quarter"),
+    level: int = Query(80, description="Prediction interval in percent: 80 or 95"),
+    db: Session = Depends(get_company_db)
+):
+    # Uses the models fitted at ingestion; nothing is refitted per request.
+    return await _analytics_response(
+        request, db, lambda: forecast_service.forecast(db, source, metric, horizon, granularity, level)
+    )
+
+
+def _filter_period(query, year: Optional[int], month: Optional[int]):
     
     if year or month:
-        period_query = db.query(FinancialPeriod.id)
+        query = query.join(FinancialPeriod, AccountDetail.period_id == FinancialPeriod.id)
         if year:
-            period_query = period_query.filter(FinancialPeriod.year == year)
+            query = query.filter(FinancialPeriod.year == year)
         if month:
-            period_query = period_query.filter(FinancialPeriod.month == month)
-        period_ids = [p[0] for p in period_query.all()]
-        query = query.filter(AccountDetail.period_id.in_(period_ids))
+            query = query.filter(FinancialPeriod.month == month)
+    return query
+
+
+@router.get("/expenses/breakdown")
+async def get_expense_breakdown(
+    request: Request,
+    year: Optional[int] = Query(None),
+    month: Optional[int] = Query(None),
+    category: str = Query("expense", description="Account category: expense, income or cogs"),
+    level: Optional[int] = Query(None, ge=0, description="Roll sub-accounts up to this depth (0 = top-level accounts)"),
+    rollup: Optional[str] = Query(None, description="Only accounts under this account, totalled across all levels"),
+    db: Session = Depends(get_read_db)
+):
+    try:
+        category_id = AccountCategory.from_label(category)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="category must be one of: expense, income, cogs")
     
-    expenses = query.all()
+    def build():
+        if level is None and rollup is None:
+            # Group on the integer account id; names are only looked up for
+            # the aggregated rows.
+            query = db.query(
+                AccountDetail.account_id,
+                minor(func.sum(AccountDetail.amount))
+            ).filter(AccountDetail.category_id == category_id)
+            
+            totals = _filter_period(query, year, month).group_by(AccountDetail.account_id).all()
+            extra = {}
+        else:
+            totals, extra = _rolled_up_totals(db, category_id, year, month, level, rollup)
+        
+        # By id rather than by category: a detail row's category need not
+        # be its account's. An id with no account keeps a name of its own
+        # instead of being merged into another.
+        names = dict(db.query(Account.id, Account.name).filter(
+            Account.id.in_([account_id for account_id, _ in totals])
+        ).all())
+        
+        # Totals stay in stored units (exact cents with MONEY_STORAGE=cents)
+        # until they are returned.
+        breakdown = {}
+        for account_id, amount in totals:
+            name = names.get(account_id, f"Account {account_id}")
+            breakdown[name] = breakdown.get(name, 0) + amount
+        
+        sorted_breakdown = {
+            name: to_units(amount) for name, amount in sorted(breakdown.items(), key=lambda x: x[1], reverse=True)
+        }
+        
+        return {
+            "breakdown": sorted_breakdown,
+            "total": to_units(sum(breakdown.values())),
+            "categories_count": len(breakdown),
+            **extra
+        }
     
-    breakdown = {}
-    for exp in expenses:
-        name = exp.account_name
-        if name not in breakdown:
-            breakdown[name] = 0
-        breakdown[name] += exp.amount
+    return await _cached_json(request, db, build)
+
+
+def _rolled_up_totals(db: Session, category_id: int, year: Optional[int], month: Optional[int],
+                      level: Optional[int], rollup: Optional[str]):
     
-    sorted_breakdown = dict(sorted(breakdown.items(), key=lambda x: x[1], reverse=True))
+    # Each fact row's own_amount is credited to its ancestor at the target
+    # depth (or to itself when it sits higher up), found through the closure
+    # table, so every subtree total is a single join with no double-counting.
+    descendant = aliased(Account)
+    ancestor = aliased(Account)
+    target = level or 0
     
-    return {
-        "breakdown": sorted_breakdown,
-        "total": sum(breakdown.values()),
-        "categories_count": len(breakdown)
-    }
+    roots = []
+    if rollup:
+        roots = db.query(Account.id, Account.level).filter(
+            Account.category_id == category_id,
+            Account.name == rollup
+        ).all()
+        if not roots:
+            raise HTTPException(status_code=404, detail=f"Account '{rollup}' not found")
+        deepest_root = max(root_level for _, root_level in roots)
+        target = deepest_root if level is None else max(level, deepest_root)
     
-
-@router.post("/ai/query", response_model=QueryResponse)
-def ai_query(query: NaturalLanguageQuery):
+    query = db.query(
+        ancestor.id,
+        minor(func.sum(AccountDetail.own_amount))
+    ).join(
+        descendant, AccountDetail.account_id == descendant.id
+    ).join(
+        AccountClosure, AccountClosure.descendant_id == AccountDetail.account_id
+    ).join(
+        ancestor, AccountClosure.ancestor_id == ancestor.id
+    ).filter(
+        AccountDetail.category_id == category_id,
+        ancestor.level == case((descendant.level < target, descendant.level), else_=target)
+    )
     
-    result = ai_service.query(query.question)
+    if roots:
+        subtree = aliased(AccountClosure)
+        query = query.join(subtree, subtree.descendant_id == AccountDetail.account_id).filter(
+            subtree.ancestor_id.in_([root_id for root_id, _ in roots])
+        )
     
-    return QueryResponse(
+    totals = _filter_period(query, year, month).group_by(ancestor.id).all()
+    return totals, {"level": target, "rollup": rollup}
+
+
+def _query_response_fields(result: dict) -> dict:
+    
+    return dict(
         question=result["question"],
         answer=result.get("answer", "Could not generate answer"),
         sql_query=result.get("sql_query"),
         data=result.get("data"),
-        confidence=1.0 if result["success"] else 0.0
+        confidence=1.0 if result["success"] else 0.0,
+        truncated=result.get("truncated", False),
+        error=None if result["success"] else QueryError(
+            code=result.get("error_code", "internal_error"),
+            message=result.get("error", "Query failed")
+        )
+    )
+
+
+@router.post("/ai/query", response_model=QueryResponse)
+def ai_query(
+    query: NaturalLanguageQuery,
+    company_id: Optional[int] = Depends(resolve_company),
+    ai_service: AIService = Depends(require_ai_service)
+):
+    result = ai_service.query(query.question, company_id)
+    
+    return QueryResponse(**_query_response_fields(result))
+
+
+@router.post("/ai/query/batch", response_model=BatchQueryResponse)
+def ai_query_batch(
+    batch: BatchQueryRequest,
+    company_id: Optional[int] = Depends(resolve_company),
+    ai_service: AIService = Depends(require_ai_service)
+):
+    results = ai_service.query_batch(batch.questions, company_id)
+    items = [BatchQueryItem(success=r["success"], **_query_response_fields(r)) for r in results]
+    succeeded = sum(1 for item in items if item.success)
+    
+    return BatchQueryResponse(
+        results=items,
+        total=len(items),
+        unique_questions=len({" ".join(q.split()) for q in batch.questions}),
+        succeeded=succeeded,
+        failed=len(items) - succeeded
     )
 
 
@@ -193,14 +756,16 @@ def ai_query(query: NaturalLanguageQuery):
 def get_sample_questions():
     
     return {
-        "sample_questions": ai_service.get_sample_questions()
+        "sample_questions": AIService.get_sample_questions()
     }
     
     
 @router.post("/ai/clear-history")
-def clear_conversation_history():
-   
-    ai_service.clear_history()
+def clear_conversation_history(
+    company_id: Optional[int] = Depends(resolve_company),
+    ai_service: AIService = Depends(require_ai_service)
+):
+    ai_service.clear_history(company_id)
     return {
         "success": True,
         "message": "Conversation history cleared. You can start a new conversation."
@@ -208,22 +773,196 @@ def clear_conversation_history():
 
 
 @router.get("/ai/history")
-def get_conversation_history():
-   
+def get_conversation_history(
+    company_id: Optional[int] = Depends(resolve_company),
+    ai_service: AIService = Depends(require_ai_service)
+):
+    history = ai_service.get_history(company_id)
     return {
-        "history": ai_service.conversation_history,
-        "total_messages": len(ai_service.conversation_history)
+        "history": history,
+        "total_messages": len(history)
     }
     
 @router.get("/ai/compare")
 def compare_periods(
     period1: str = Query(..., description="First period (e.g., Q1 or 2023)"),
     period2: str = Query(..., description="Second period (e.g., Q2 or 2024)"),
-    year: Optional[int] = Query(None, description="Year for quarterly comparison")
+    year: Optional[int] = Query(None, description="Year for quarterly comparison"),
+    company_id: Optional[int] = Depends(resolve_company),
+    ai_service: AIService = Depends(require_ai_service)
 ):
-    result = ai_service.comparative_analysis(period1, period2, year)
+    result = ai_service.comparative_analysis(period1, period2, year, company_id)
     
     if not result["success"]:
         raise HTTPException(status_code=400, detail=result.get("error", "Comparison failed"))
     
-    return result
\ No newline at end of file
+    return result
+
+
+def _job_params(job: JobRequest) -> dict:
+    
+    if job.kind == "insight":
+        if not job.question:
+            raise HTTPException(status_code=400, detail="Insight jobs need a question")
+        return {"question": " ".join(job.question.split())}
+    
+    if job.kind == "compare":
+        if not job.period1 or not job.period2:
+            raise HTTPException(status_code=400, detail="Compare jobs need period1 and period2")
+        return {"period1": job.period1, "period2": job.period2, "year": job.year}
+    
+    if job.kind == "batch":
+        if not job.questions:
+            raise HTTPException(status_code=400, detail="Batch jobs need questions")
+        return {"questions": job.questions}
+    
+    raise HTTPException(status_code=400, detail=f"Unknown job kind '{job.kind}'. Use insight, compare or batch")
+
+
+@router.post("/jobs", response_model=JobStatus, status_code=202)
+def submit_job(
+    job: JobRequest,
+    company_id: Optional[int] = Depends(resolve_company),
+    ai_service: AIService = Depends(require_ai_service)
+):
+    try:
+        return job_queue.submit(job.kind, {**_job_params(job), "company_id": company_id}, job.priority)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+def get_job(job_id: str):
+    
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str, response: Response):
+    
+    job = job_queue.get(job_id, include_result=True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job["status"] not in (SUCCEEDED, FAILED):
+        response.status_code = 202
+        response.headers["Retry-After"] = "2"
+        return {"job_id": job_id, "status": job["status"]}
+    
+    return {"job_id": job_id, "status": job["status"], "error": job["error"], "result": job["result"]}
+
+
+def _export_response(statement, fmt: str, filename: str, company_id: Optional[int],
+                     guard=None) -> StreamingResponse:
+    
+    try:
+        content = export_service.stream(statement, fmt, company_id, guard=guard)
+    except ExportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if guard is not None:
+        # The first chunk runs the statement, so a timeout there is still
+        # answered with a 400 rather than a cut-off download.
+        try:
+            first = next(content)
+        except QueryRejected as e:
+            raise HTTPException(status_code=400, detail=e.to_dict())
+        content = itertools.chain([first], content)
+    
+    media_type, extension = EXPORT_FORMATS[fmt]
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'}
+    )
+
+
+@router.get("/export/periods")
+def export_periods(
+    format: str = Query("csv", description="Export format: csv, arrow or parquet"),
+    source: Optional[str] = Query(None, description="Filter by source: quickbooks or rootfi"),
+    year: Optional[int] = Query(None, description="Filter by year"),
+    quarter: Optional[int] = Query(None, description="Filter by quarter (1-4)"),
+    company_id: Optional[int] = Depends(resolve_company)
+):
+    statement = export_service.periods_statement(source, year, quarter, company_id)
+    return _export_response(statement, format, "financial_periods", company_id)
+
+
+@router.get("/export/accounts")
+def export_account_details(
+    format: str = Query("csv", description="Export format: csv, arrow or parquet"),
+    source: Optional[str] = Query(None, description="Filter by source: quickbooks or rootfi"),
+    year: Optional[int] = Query(None, description="Filter by year"),
+    quarter: Optional[int] = Query(None, description="Filter by quarter (1-4)"),
+    category: Optional[str] = Query(None, description="Filter by category: income, expense or cogs"),
+    company_id: Optional[int] = Depends(resolve_company)
+):
+    statement = export_service.accounts_statement(source, year, quarter, category, company_id)
+    return _export_response(statement, format, "account_details", company_id)
+
+
+@router.post("/export/ai-query")
+def export_ai_query(
+    query: NaturalLanguageQuery,
+    format: str = Query("csv", description="Export format: csv, arrow or parquet"),
+    company_id: Optional[int] = Depends(resolve_company),
+    ai_service: AIService = Depends(require_ai_service)
+):
+    sql = ai_service.generate_sql(query.question, company_id=company_id)
+    
+    if not sql:
+        raise HTTPException(status_code=400, detail="Failed to generate SQL query")
+    
+    # Exported as rewritten, so it only reads the company's rows, and
+    # no more than EXPORT_MAX_ROWS of them.
+    db = company_router.session(company_id)
+    try:
+        sql = ai_service.validator.rewrite(sql, limit=export_service.max_sql_rows, company_id=company_id)
+        ai_service.governor.check_plan(sql, db)
+    except QueryRejected as e:
+        raise HTTPException(status_code=400, detail=e.to_dict())
+    finally:
+        db.close()
+    
+    return _export_response(export_service.sql_statement(sql), format, "ai_query", company_id,
+                            guard=ai_service.governor.deadline)
+
+
+@router.get("/admin/profiles", dependencies=[Depends(require_profiling_admin)])
+def list_profiles(limit: int = Query(20, ge=1, le=200, description="Most recent profiles to list")):
+    return {"profiles": profiler.list(limit)}
+
+
+@router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_profiling_admin)])
+def get_profile(profile_id: str):
+    
+    summary = profiler.get(profile_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return summary
+
+
+@router.get("/admin/profiles/{profile_id}/speedscope", dependencies=[Depends(require_profiling_admin)])
+def get_profile_speedscope(profile_id: str):
+    
+    document = profiler.speedscope(profile_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        content=json.dumps(document),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'}
+    )
+
+
+@router.get("/admin/profiles/{profile_id}/folded", dependencies=[Depends(require_profiling_admin)])
+def get_profile_folded(profile_id: str):
+    
+    folded = profiler.folded(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(folded)
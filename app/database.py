@@ -1,24 +1,156 @@
 
-from sqlalchemy import create_engine
+from sqlalchemy import Column, Integer, create_engine, event, insert, make_url, text
+from sqlalchemy.exc import DisconnectionError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, with_loader_criteria
 import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
 from dotenv import load_dotenv
+from app.logging_config import get_logger
+from app.money import CENTS, Money
 
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./kudwa_financial.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _engine_options(url) -> dict:
+    
+    # SQLite connections are shared across the threadpool. Server databases
+    # get a bounded pool; pre-ping drops connections the server has closed.
+    if make_url(url).get_backend_name() == "sqlite":
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True
+    }
+
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+
+
+def sqlite_file_path(bind=None) -> Optional[str]:
+    
+    # Path of the live SQLite file, or None for other backends and in-memory databases.
+    bind = bind or engine
+    if bind.url.get_backend_name() != "sqlite":
+        return None
+    database = bind.url.database
+    if not database or database == ":memory:" or database.startswith("file:"):
+        return None
+    return os.path.abspath(database)
+
+
+def reopen_after_swap(bind):
+    
+    # A snapshot ingestion in any worker process replaces the data file
+    # with os.replace. Pooled connections elsewhere still read the old,
+    # unlinked file, so each connection remembers the file it opened and is
+    # dropped at checkout once the path names another one; the pool then
+    # opens a fresh connection to the new file. One stat per checkout.
+    path = sqlite_file_path(bind)
+    if path is None:
+        return
+    
+    def file_id():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+    
+    @event.listens_for(bind, "connect")
+    def _opened(dbapi_connection, connection_record):
+        connection_record.info["file_id"] = file_id()
+    
+    @event.listens_for(bind, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.get("file_id") != file_id():
+            raise DisconnectionError("Database file was replaced")
+
+
+reopen_after_swap(engine)
+
+
+def _create_state_engine():
+    
+    # Jobs and the company registry are written at any time, also while a
+    # snapshot ingestion rebuilds the data file, so next to a file-backed
+    # SQLite database they get a file of their own that is never swapped.
+    # Elsewhere nothing is swapped and they stay in the main database.
+    url = os.getenv("STATE_DATABASE_URL")
+    if not url:
+        live_path = sqlite_file_path(engine)
+        if live_path is None:
+            return engine
+        url = f"sqlite:///{os.path.splitext(live_path)[0]}_state.db"
+    return create_engine(url, **_engine_options(url))
+
+
+state_engine = _create_state_engine()
+
+
+def _create_async_engine():
+    
+    # Read endpoints on PostgreSQL run their queries through asyncpg, so a
+    # slow query holds a pooled connection rather than a threadpool worker.
+    # ASYNC_READS=false keeps them on the sync engine.
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() != "postgresql" or os.getenv("ASYNC_READS", "true").lower() not in ("1", "true", "yes"):
+        return None
+    
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+    except ImportError as e:
+        raise ImportError("Async reads need greenlet and asyncpg: pip install 'sqlalchemy[asyncio]' asyncpg") from e
+    
+    # Only libpq options that asyncpg also understands carry over.
+    url = url.set(drivername="postgresql+asyncpg", query={})
+    return create_async_engine(url, **_engine_options(DATABASE_URL))
+
+
+async_engine = _create_async_engine()
 
 Base = declarative_base()
 
+# Tables in state_engine: the job queue and the company registry.
+StateBase = declarative_base()
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, binds={StateBase: state_engine})
+
+logger = get_logger("database")
+
+
+class CompanyScoped:
+    
+    # Mixed into every table that holds one company's data. company_id leads
+    # each of their indexes, so one company's rows are a single index range
+    # however many companies share the file.
+    company_id = Column(Integer, nullable=False)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _scope_to_company(state):
+    
+    # A session opened for a company only reads, updates and deletes that
+    # company's rows, joins and aliases included. Inserts set company_id
+    # themselves; all_companies=True opts a statement out.
+    company_id = state.session.info.get("company_id")
+    if company_id is None or state.execution_options.get("all_companies"):
+        return
+    if state.is_select and (state.is_column_load or state.is_relationship_load):
+        return
+    if state.is_select or state.is_update or state.is_delete:
+        state.statement = state.statement.options(with_loader_criteria(
+            CompanyScoped, lambda cls: cls.company_id == company_id, include_aliases=True
+        ))
+
+
 def get_db():
     
     db = SessionLocal()
@@ -28,7 +160,305 @@ def get_db():
         db.close()
 
 
-def init_db():
+def begin_read_snapshot(db: Session):
+    
+    # Every statement the session runs from here on reads one snapshot.
+    # The sqlite3 driver only opens a transaction before writes, so each
+    # SELECT would read its own; an explicit BEGIN holds one from the first
+    # read on. PostgreSQL's READ COMMITTED snapshots each statement too,
+    # REPEATABLE READ the whole transaction.
+    if db.get_bind().dialect.name == "sqlite":
+        db.connection().exec_driver_sql("BEGIN")
+    else:
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+
+def bulk_insert(db: Session, model, rows: List[dict]):
+    
+    # COPY on PostgreSQL with psycopg 3, one executemany INSERT elsewhere.
+    # Every row has the same keys; column defaults fill in the rest.
+    if not rows:
+        return
+    
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql" or bind.dialect.driver != "psycopg":
+        db.execute(insert(model), rows)
+        return
+    
+    table = model.__table__
+    defaults = {
+        column.name: column.default.arg for column in table.columns
+        if column.name not in rows[0] and column.default is not None and column.default.is_scalar
+    }
+    columns = [*rows[0], *defaults]
+    
+    # COPY skips the column types, so values and defaults go through their
+    # bind processors here, as an INSERT would send them (Money -> cents).
+    processors = [
+        table.columns[name].type.dialect_impl(bind.dialect).bind_processor(bind.dialect) for name in columns
+    ]
+    defaults = [defaults.get(name) for name in columns]
+    
+    cursor = db.connection().connection.driver_connection.cursor()
+    try:
+        with cursor.copy(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                values = [row.get(name, default) for name, default in zip(columns, defaults)]
+                copy.write_row([
+                    process(value) if process else value for process, value in zip(processors, values)
+                ])
+    finally:
+        cursor.close()
     
-    Base.metadata.create_all(bind=engine)
-    print("Database initialized successfully!")
\ No newline at end of file
+    # COPY bypasses the id sequence, so move it past explicit ids.
+    if "id" in rows[0]:
+        db.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), (SELECT MAX(id) FROM {table.name}))"
+        ))
+
+
+def init_db(bind=None):
+    
+    Base.metadata.create_all(bind=bind or engine)
+    if bind is None:
+        # Jobs and the registry are not rebuilt by an ingestion, so an
+        # outdated layout is replaced right away.
+        stale = stale_tables(state_engine, StateBase.metadata)
+        if stale:
+            logger.warning("Recreating state tables with an outdated layout", extra={"tables": [t.name for t in stale]})
+            StateBase.metadata.drop_all(bind=state_engine, tables=stale)
+        StateBase.metadata.create_all(bind=state_engine)
+    logger.info("Database initialized successfully")
+
+
+def stale_tables(bind=None, metadata=None) -> list:
+    
+    # Tables whose live columns no longer match the models. There are no
+    # migrations; data tables are rebuilt by the next ingestion instead.
+    from sqlalchemy import inspect
+    
+    inspector = inspect(bind or engine)
+    existing = set(inspector.get_table_names())
+    stale = []
+    for table in (metadata or Base.metadata).sorted_tables:
+        if table.name not in existing:
+            continue
+        live_columns = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+        if set(live_columns) != {column.name for column in table.columns}:
+            stale.append(table)
+        elif any(isinstance(live_columns[column.name], Integer) != CENTS
+                 for column in table.columns if isinstance(column.type, Money)):
+            # Stored under the other MONEY_STORAGE mode.
+            stale.append(table)
+    return stale
+
+
+def create_bulk_load_engine(path: str):
+    
+    # The shadow file is thrown away if the build fails, so it needs no
+    # journal and no fsync while loading.
+    bulk_engine = create_engine(f"sqlite:///{path}")
+    
+    @event.listens_for(bulk_engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=OFF")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.close()
+    
+    return bulk_engine
+
+
+def swap_database_file(new_path: str, bind=None):
+    
+    # os.replace is atomic on POSIX. Connections already checked out keep
+    # reading the old file until they are returned; dispose() drops the idle
+    # ones so every new checkout opens the new file. Other processes notice
+    # the new file at their next checkout (reopen_after_swap).
+    bind = bind or engine
+    live_path = sqlite_file_path(bind)
+    if live_path is None:
+        raise RuntimeError("Snapshot swap needs a file-backed SQLite database")
+    
+    os.replace(new_path, live_path)
+    bind.dispose()
+    logger.info("Database file swapped", extra={"path": live_path})
+
+
+try:
+    import fcntl
+    
+    def _lock_file(handle):
+        fcntl.flock(handle, fcntl.LOCK_EX)
+    
+    def _unlock_file(handle):
+        fcntl.flock(handle, fcntl.LOCK_UN)
+except ImportError:
+    import msvcrt
+    
+    def _lock_file(handle):
+        # LK_LOCK gives up after about ten seconds; keep waiting.
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    
+    def _unlock_file(handle):
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def ingestion_lock():
+    
+    # Every worker process may start an ingestion (the lifespan loads an
+    # empty database), so ingestions are serialised across processes: a
+    # lock file next to a SQLite database, an advisory lock on PostgreSQL.
+    live_path = sqlite_file_path()
+    if live_path is not None:
+        with open(f"{live_path}.lock", "a+b") as handle:
+            _lock_file(handle)
+            try:
+                yield
+            finally:
+                _unlock_file(handle)
+        return
+    
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    
+    with engine.connect() as conn:
+        conn.exec_driver_sql("SELECT pg_advisory_lock(hashtext('kudwa_ingestion'))")
+        try:
+            yield
+        finally:
+            conn.exec_driver_sql("SELECT pg_advisory_unlock(hashtext('kudwa_ingestion'))")
+
+
+class CompanyNotFound(LookupError):
+    pass
+
+
+class CompanyRequired(ValueError):
+    pass
+
+
+class CompanyRouter:
+    
+    # Maps a company to the engine holding its rows. Without sharding every
+    # company lives in the main database and is told apart by company_id;
+    # with it each company gets its own SQLite file under shard_dir, and the
+    # main database keeps the generation the job queue deduplicates on.
+    
+    def __init__(self, sharded: bool = False, shard_dir: Optional[str] = None,
+                 default_company_id: Optional[int] = None):
+        self.sharded = sharded
+        self.shard_dir = shard_dir or os.path.dirname(sqlite_file_path() or os.path.abspath("kudwa_financial.db"))
+        self.default_company_id = default_company_id
+        self._engines: Dict[int, object] = {}
+        self._instrumentation: List[Callable] = []
+        self._lock = threading.Lock()
+        if sharded and sqlite_file_path() is None:
+            raise ValueError("SHARD_BY_COMPANY needs a file-backed SQLite DATABASE_URL")
+    
+    @classmethod
+    def from_env(cls) -> "CompanyRouter":
+        default = os.getenv("DEFAULT_COMPANY_ID")
+        return cls(
+            sharded=os.getenv("SHARD_BY_COMPANY", "false").lower() in ("1", "true", "yes"),
+            shard_dir=os.getenv("SHARD_DIR") or None,
+            default_company_id=int(default) if default else None
+        )
+    
+    def shard_path(self, company_id: int) -> str:
+        return os.path.join(self.shard_dir, f"company_{company_id}.db")
+    
+    def instrument(self, callback: Callable):
+        
+        # callback(engine) runs on the main engine now and on every shard
+        # engine, including the ones opened later.
+        with self._lock:
+            self._instrumentation.append(callback)
+            engines = [engine, *self._engines.values()]
+        if state_engine is not engine:
+            engines.append(state_engine)
+        if async_engine is not None:
+            engines.append(async_engine.sync_engine)
+        for bind in engines:
+            callback(bind)
+    
+    def engine_for(self, company_id: Optional[int]):
+        
+        if not self.sharded or company_id is None:
+            return engine
+        
+        with self._lock:
+            shard = self._engines.get(company_id)
+            if shard is None:
+                os.makedirs(self.shard_dir, exist_ok=True)
+                shard = create_engine(
+                    f"sqlite:///{self.shard_path(company_id)}",
+                    connect_args={"check_same_thread": False}
+                )
+                reopen_after_swap(shard)
+                for callback in self._instrumentation:
+                    callback(shard)
+                self._engines[company_id] = shard
+            return shard
+    
+    def company_ids(self) -> List[int]:
+        
+        from sqlalchemy import select
+        from sqlalchemy.exc import OperationalError
+        from app.models import Company
+        
+        with SessionLocal() as db:
+            try:
+                return list(db.execute(select(Company.id).order_by(Company.id)).scalars())
+            except OperationalError:
+                # Registry not created yet.
+                return []
+    
+    def resolve(self, company_id: Optional[int]) -> Optional[int]:
+        
+        # None only while nothing has been loaded, so requests see the same
+        # empty database they did before any company was registered.
+        known = self.company_ids()
+        if company_id is not None:
+            if company_id not in known:
+                raise CompanyNotFound(f"Company {company_id} not found")
+            return company_id
+        if not known:
+            return None
+        if len(known) == 1:
+            return known[0]
+        if self.default_company_id in known:
+            return self.default_company_id
+        raise CompanyRequired(
+            f"{len(known)} companies are loaded; pass company_id (one of {', '.join(map(str, known))})"
+        )
+    
+    def session(self, company_id: Optional[int]) -> Session:
+        
+        # company_id must already be resolved.
+        return SessionLocal(bind=self.engine_for(company_id), info={"company_id": company_id})
+    
+    @property
+    def async_reads(self) -> bool:
+        return async_engine is not None
+    
+    def async_session(self, company_id: Optional[int]):
+        
+        # Same scoping as session(): the company filter hooks into the sync
+        # session the async one wraps. Sharding is SQLite-only, so there is
+        # a single async engine.
+        from sqlalchemy.ext.asyncio import AsyncSession
+        
+        return AsyncSession(async_engine, autoflush=False, info={"company_id": company_id})
+
+
+company_router = CompanyRouter.from_env()
@@ -0,0 +1,172 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+_lock = threading.Lock()
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"kudwa.{name}")
+
+
+class RequestIdFilter(logging.Filter):
+
+    # Runs on the calling thread (before the queue), so the context
+    # variable of the request that produced the record is captured.
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+
+    # High-volume messages pass extra={"sample_every": N}; only every Nth
+    # record per (logger, message template) is kept. WARNING and above are
+    # never sampled.
+
+    def __init__(self):
+        super().__init__()
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+
+        every = getattr(record, "sample_every", None)
+        if not every or every <= 1 or record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % every == 0
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+
+    # The stock prepare() formats the message and copies the record on the
+    # calling thread. Records never leave the process here, so hand them
+    # over untouched and let the listener thread do all the formatting.
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key not in payload and key not in ("request_id", "sample_every"):
+                payload[key] = value
+
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(payload, default=str)
+
+
+class TextFormatter(logging.Formatter):
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(request_id)s] %(name)s: %(message)s")
+
+
+def configure_logging(level: str = None, fmt: str = None):
+
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            return
+
+        level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+        fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+        # The request path only enqueues records; formatting and the write
+        # to stdout happen on the listener thread.
+        log_queue = queue.SimpleQueue()
+        queue_handler = _QueueHandler(log_queue)
+        queue_handler.addFilter(RequestIdFilter())
+        queue_handler.addFilter(SamplingFilter())
+
+        logger = logging.getLogger("kudwa")
+        logger.setLevel(level)
+        logger.handlers = [queue_handler]
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+
+    global _listener
+
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+
+    def __init__(self, app, header: str = "x-request-id"):
+        self.app = app
+        self.header = header
+        self._raw_header = header.encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == self._raw_header:
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        token = request_id_var.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((self._raw_header, request_id.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
@@ -1,46 +1,68 @@
+import threading
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from app.database import init_db, SessionLocal
+from app.logging_config import configure_logging, get_logger, RequestIdMiddleware
+from app.database import init_db, stale_tables, company_router, async_engine
 from app.api.routes import router
-from app.models import FinancialPeriod
-from app.services.data_processor import DataProcessor
+from app.services.data_processor import DataProcessor, ingestion_progress
+from app.services.job_queue import job_queue
+from app.services import metrics
+from app.services.profiling import ProfilingMiddleware, profiler
+
+
+configure_logging()
+logger = get_logger("main")
+
+
+def _load_data():
+    
+    # Every worker starts this; the first one loads, the others wait for
+    # it and skip.
+    result = DataProcessor().process_all(if_missing=True)
+    logger.info("Data loaded", extra={"result": result})
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     
-    print("\n" + "=" * 50)
-    print("Kudwa Financial AI Starting...")
-    print("=" * 50)
+    logger.info("Kudwa Financial AI starting")
     
     init_db()
     
-    db = SessionLocal()
     try:
-        count = db.query(FinancialPeriod).count()
-        if count == 0:
-            print("Database is empty. Loading data...")
-            processor = DataProcessor()
-            result = processor.process_all()
-            print(f"Data loaded: {result}")
+        stale = stale_tables()
+        companies = [] if stale else company_router.company_ids()
+        if not companies:
+            # Load in the background so /health answers right away; /ready
+            # reports progress until the data is in.
+            if stale:
+                logger.info("Database layout is outdated. Reloading data in the background...",
+                            extra={"tables": [t.name for t in stale]})
+            else:
+                logger.info("Database is empty. Loading data in the background...")
+            ingestion_progress.start()
+            threading.Thread(target=_load_data, name="ingestion", daemon=True).start()
         else:
-            print(f"Database already has {count} records")
+            logger.info("Database already has records", extra={"companies": companies})
+            for company_id in companies:
+                with company_router.session(company_id) as db:
+                    DataProcessor().backfill_derived_tables(db, company_id)
     except Exception as e:
-        print(f"Error checking/loading data: {e}")
-    finally:
-        db.close()
+        logger.exception("Error checking/loading data")
     
-    print("Ready to serve requests!")
-    print("Docs: http://localhost:8000/docs")
-    print("=" * 50 + "\n")
+    job_queue.start()
+    
+    logger.info("Ready to serve requests", extra={"docs": "/docs"})
     
     yield  
     
-    print("\n" + "=" * 50)
-    print("Kudwa Financial AI Shutting down...")
-    print("=" * 50 + "\n")
+    job_queue.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+    logger.info("Kudwa Financial AI shutting down")
 
 
 app = FastAPI(
@@ -62,6 +84,16 @@ app.add_middleware(
 )
 
 
+if profiler.enabled:
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+company_router.instrument(metrics.instrument_engine)
+
+
+if profiler.enabled:
+    profiler.instrument(router)
+    company_router.instrument(profiler.instrument_engine)
 app.include_router(router, prefix="/api/v1", tags=["Financial Data"])
 
 
@@ -73,4 +105,12 @@ def root():
         "status": "running",
         "docs": "/docs",
         "api": "/api/v1"
-    }
\ No newline at end of file
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
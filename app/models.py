@@ -1,10 +1,51 @@
 
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+from enum import IntEnum
+
+from sqlalchemy import (
+    Column, Integer, SmallInteger, String, Float, Boolean, Date, DateTime, Text, ForeignKey, Index,
+    PrimaryKeyConstraint
+)
 from sqlalchemy.orm import relationship
-from app.database import Base
+from app.database import Base, CompanyScoped, StateBase
+from app.money import Money
+
+
+def date_key(value) -> int:
+    
+    # Integer surrogate for a calendar date, e.g. 2024-03-31 -> 20240331.
+    return value.year * 10000 + value.month * 100 + value.day
+
+
+class DateDimension(Base):
+    
+    __tablename__ = "date_dim"
 
+    date_key = Column(Integer, primary_key=True, autoincrement=False)
+    date = Column(Date, nullable=False, unique=True)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    day = Column(Integer, nullable=False)
+    quarter = Column(Integer, nullable=False)
+    month_name = Column(String, nullable=False)
+    day_of_week = Column(Integer, nullable=False)
+    month_end = Column(Date, nullable=False)
+    is_month_end = Column(Boolean, nullable=False)
+    fiscal_year = Column(Integer, nullable=False)
+    fiscal_quarter = Column(Integer, nullable=False)
+    fiscal_month = Column(Integer, nullable=False)
+    iso_year = Column(Integer, nullable=False)
+    iso_week = Column(Integer, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_date_dim_fiscal", "fiscal_year", "fiscal_quarter"),
+        Index("ix_date_dim_iso_week", "iso_year", "iso_week"),
+    )
 
-class FinancialPeriod(Base):
+    def __repr__(self):
+        return f"<DateDimension {self.date}>"
+
+
+class FinancialPeriod(CompanyScoped, Base):
     
     __tablename__ = "financial_periods"
 
@@ -15,21 +56,153 @@ class FinancialPeriod(Base):
     year = Column(Integer, nullable=False)
     month = Column(Integer, nullable=False)
     quarter = Column(Integer, nullable=False) 
-    total_revenue = Column(Float, default=0.0)
-    total_cogs = Column(Float, default=0.0) 
-    gross_profit = Column(Float, default=0.0)
-    total_operating_expenses = Column(Float, default=0.0)
-    other_income = Column(Float, default=0.0)
-    other_expenses = Column(Float, default=0.0)
-    net_income = Column(Float, default=0.0)
+    # Join keys into date_dim. No foreign key: the dimension is built from
+    # the loaded periods, after them.
+    start_date_key = Column(Integer, nullable=False)
+    end_date_key = Column(Integer, nullable=False)
+    total_revenue = Column(Money, default=0.0)
+    total_cogs = Column(Money, default=0.0) 
+    gross_profit = Column(Money, default=0.0)
+    total_operating_expenses = Column(Money, default=0.0)
+    other_income = Column(Money, default=0.0)
+    other_expenses = Column(Money, default=0.0)
+    net_income = Column(Money, default=0.0)
     
     account_details = relationship("AccountDetail", back_populates="period")
+    
+    __table_args__ = (
+        Index("ix_financial_periods_start_date_key", "company_id", "start_date_key"),
+        Index("ix_financial_periods_source_year_month", "company_id", "source", "year", "month"),
+        Index("ix_financial_periods_year_quarter", "company_id", "year", "quarter"),
+    )
 
     def __repr__(self):
         return f"<FinancialPeriod {self.source} {self.year}-{self.month}>"
 
 
-class AccountDetail(Base):
+class CanonicalPeriod(CompanyScoped, Base):
+    
+    __tablename__ = "canonical_periods"
+
+    # One row per calendar month: the financial_periods row of the
+    # highest-precedence source that reported it.
+    id = Column(Integer, primary_key=True)
+    period_id = Column(Integer, ForeignKey("financial_periods.id"), nullable=False)
+    source = Column(String, nullable=False)
+    period_start = Column(Date, nullable=False)
+    period_end = Column(Date, nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    quarter = Column(Integer, nullable=False)
+    start_date_key = Column(Integer, nullable=False)
+    end_date_key = Column(Integer, nullable=False)
+    total_revenue = Column(Money, default=0.0)
+    total_cogs = Column(Money, default=0.0)
+    gross_profit = Column(Money, default=0.0)
+    total_operating_expenses = Column(Money, default=0.0)
+    other_income = Column(Money, default=0.0)
+    other_expenses = Column(Money, default=0.0)
+    net_income = Column(Money, default=0.0)
+    source_count = Column(Integer, nullable=False, default=1)
+    
+    __table_args__ = (
+        Index("ix_canonical_periods_year_month", "company_id", "year", "month", unique=True),
+        Index("ix_canonical_periods_year_quarter", "company_id", "year", "quarter"),
+        Index("ix_canonical_periods_start_date_key", "company_id", "start_date_key"),
+    )
+
+    def __repr__(self):
+        return f"<CanonicalPeriod {self.year}-{self.month} from {self.source}>"
+
+
+class PeriodVariance(CompanyScoped, Base):
+    
+    __tablename__ = "period_variances"
+
+    # How far another source's figure for a month is from the canonical one.
+    id = Column(Integer, primary_key=True)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    metric = Column(String, nullable=False)
+    primary_source = Column(String, nullable=False)
+    secondary_source = Column(String, nullable=False)
+    primary_value = Column(Money, default=0.0)
+    secondary_value = Column(Money, default=0.0)
+    difference = Column(Money, default=0.0)
+    difference_pct = Column(Float, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_period_variances_year_month", "company_id", "year", "month"),
+    )
+
+    def __repr__(self):
+        return f"<PeriodVariance {self.year}-{self.month} {self.metric}: {self.difference}>"
+
+
+class AccountCategory(IntEnum):
+    
+    INCOME = 1
+    COGS = 2
+    EXPENSE = 3
+    
+    @property
+    def label(self) -> str:
+        return self.name.lower()
+    
+    @classmethod
+    def from_label(cls, label: str) -> "AccountCategory":
+        return cls[label.upper()]
+
+
+class Account(CompanyScoped, Base):
+    
+    __tablename__ = "accounts"
+
+    id = Column(Integer, primary_key=True)
+    # Source account id when the source has one, otherwise a hash of
+    # category, parent and name, so the key is stable across reloads.
+    account_key = Column(String, nullable=False)
+    external_id = Column(String, nullable=True)
+    name = Column(String, nullable=False)
+    parent_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)
+    level = Column(SmallInteger, nullable=False, default=0)
+    category_id = Column(SmallInteger, nullable=False)
+    
+    parent = relationship("Account", remote_side=[id])
+    
+    __table_args__ = (
+        Index("ix_accounts_account_key", "company_id", "account_key", unique=True),
+        Index("ix_accounts_category_level", "company_id", "category_id", "level"),
+    )
+
+    @property
+    def category(self) -> str:
+        return AccountCategory(self.category_id).label
+
+    def __repr__(self):
+        return f"<Account {self.name} ({self.category})>"
+
+
+class AccountClosure(CompanyScoped, Base):
+    
+    __tablename__ = "account_closure"
+
+    # One row per (ancestor, descendant) pair, including each account with
+    # itself at depth 0.
+    ancestor_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    descendant_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    depth = Column(SmallInteger, nullable=False)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint("company_id", "ancestor_id", "descendant_id"),
+        Index("ix_account_closure_descendant", "company_id", "descendant_id", "ancestor_id"),
+    )
+
+    def __repr__(self):
+        return f"<AccountClosure {self.ancestor_id} -> {self.descendant_id} ({self.depth})>"
+
+
+class AccountDetail(CompanyScoped, Base):
     
     __tablename__ = "account_details"
 
@@ -38,12 +211,188 @@ class AccountDetail(Base):
     period_id = Column(Integer, ForeignKey("financial_periods.id"), nullable=False)
     period = relationship("FinancialPeriod", back_populates="account_details")
     
-    category = Column(String, nullable=False) 
-    account_name = Column(String, nullable=False)
-    parent_account = Column(String, nullable=True) 
-    amount = Column(Float, default=0.0)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    account = relationship("Account")
     
-    account_id = Column(String, nullable=True) 
+    category_id = Column(SmallInteger, nullable=False)
+    # amount is the figure reported for the account, which includes its
+    # sub-accounts; own_amount excludes them, so summing own_amount over a
+    # subtree never double-counts.
+    amount = Column(Money, default=0.0)
+    own_amount = Column(Money, default=0.0)
+    
+    __table_args__ = (
+        Index("ix_account_details_period_category", "company_id", "period_id", "category_id"),
+        # Covers the per-account GROUP BY without touching the table rows.
+        Index("ix_account_details_category_account",
+              "company_id", "category_id", "account_id", "amount", "own_amount"),
+    )
+
+    @property
+    def category(self) -> str:
+        return AccountCategory(self.category_id).label
+
+    @property
+    def account_name(self) -> str:
+        return self.account.name
+
+    @property
+    def parent_account(self):
+        return self.account.parent.name if self.account.parent_id else None
+
+    def __repr__(self):
+        return f"<AccountDetail {self.account_id}: {self.amount}>"
+
+
+class QuarterlySummary(CompanyScoped, Base):
+    
+    __tablename__ = "quarterly_summary"
+
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)
+    year = Column(Integer, nullable=False)
+    quarter = Column(Integer, nullable=False)
+    total_revenue = Column(Money, default=0.0)
+    total_cogs = Column(Money, default=0.0)
+    gross_profit = Column(Money, default=0.0)
+    total_operating_expenses = Column(Money, default=0.0)
+    net_income = Column(Money, default=0.0)
+    months = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index("ix_quarterly_summary_year_quarter", "company_id", "year", "quarter"),
+    )
+
+    def __repr__(self):
+        return f"<QuarterlySummary {self.source} {self.year}-Q{self.quarter}>"
+
+
+class Anomaly(CompanyScoped, Base):
+    
+    __tablename__ = "anomalies"
+
+    id = Column(Integer, primary_key=True)
+    scope = Column(String, nullable=False)  # 'period' or 'account'
+    source = Column(String, nullable=False)
+    metric = Column(String, nullable=False)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    value = Column(Float, nullable=False)
+    expected = Column(Float, nullable=True)
+    robust_z = Column(Float, nullable=True)
+    seasonal_z = Column(Float, nullable=True)
+    method = Column(String, nullable=False)  # 'rolling_mad', 'seasonal' or 'both'
+    direction = Column(String, nullable=False)  # 'spike' or 'drop'
+    severity = Column(Float, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_anomalies_year_month", "company_id", "year", "month"),
+        Index("ix_anomalies_scope_severity", "company_id", "scope", "severity"),
+        Index("ix_anomalies_account", "company_id", "account_id"),
+    )
+
+    def __repr__(self):
+        return f"<Anomaly {self.scope} {self.metric} {self.year}-{self.month}: {self.severity:.1f}>"
+
+
+class ForecastModel(CompanyScoped, Base):
+    
+    __tablename__ = "forecast_models"
+
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)  # 'quickbooks', 'rootfi' or 'canonical'
+    metric = Column(String, nullable=False)
+    method = Column(String, nullable=False)  # 'holt_winters' or 'seasonal_naive'
+    alpha = Column(Float, nullable=True)
+    beta = Column(Float, nullable=True)
+    gamma = Column(Float, nullable=True)
+    phi = Column(Float, nullable=True)
+    level = Column(Float, nullable=True)
+    trend = Column(Float, nullable=True)
+    seasonal = Column(Text, nullable=False)  # JSON list of 12 values, January first
+    sigma = Column(Float, nullable=False)  # one-step residual standard deviation
+    last_year = Column(Integer, nullable=False)
+    last_month = Column(Integer, nullable=False)
+    observations = Column(Integer, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_forecast_models_source_metric", "company_id", "source", "metric", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<ForecastModel {self.source} {self.metric}: {self.method}>"
+
+
+class Forecast(CompanyScoped, Base):
+    
+    __tablename__ = "forecasts"
+
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)
+    metric = Column(String, nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    quarter = Column(Integer, nullable=False)
+    forecast = Column(Float, nullable=False)
+    lower_80 = Column(Float, nullable=False)
+    upper_80 = Column(Float, nullable=False)
+    lower_95 = Column(Float, nullable=False)
+    upper_95 = Column(Float, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_forecasts_source_metric_year_month", "company_id", "source", "metric", "year", "month"),
+    )
+
+    def __repr__(self):
+        return f"<Forecast {self.source} {self.metric} {self.year}-{self.month}: {self.forecast}>"
+
+
+class Company(StateBase):
+    
+    __tablename__ = "companies"
+
+    # Registry of loaded companies, keyed on the Rootfi company id. It lives
+    # in the state database, which snapshot ingestion and sharding leave alone.
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    periods = Column(Integer, nullable=False, default=0)
+    loaded_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<Company {self.id}>"
+
+
+class DataGeneration(Base):
+    
+    __tablename__ = "data_generation"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<DataGeneration {self.generation}>"
+
+
+class AIJob(StateBase):
+    
+    __tablename__ = "ai_jobs"
+
+    id = Column(String, primary_key=True)
+    kind = Column(String, nullable=False)
+    request_key = Column(String, nullable=False, index=True)
+    params = Column(Text, nullable=False)
+    priority = Column(Integer, nullable=False, default=5)
+    status = Column(String, nullable=False, index=True)
+    generation = Column(Integer, nullable=False, default=0)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # host:pid of the process running the job, and when it last renewed its lease.
+    owner = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
 
     def __repr__(self):
-        return f"<AccountDetail {self.account_name}: {self.amount}>"
\ No newline at end of file
+        return f"<AIJob {self.kind} {self.id} {self.status}>"
@@ -0,0 +1,151 @@
+import math
+import os
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any
+
+from sqlalchemy import BigInteger, Float, type_coerce
+from sqlalchemy.types import TypeDecorator
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# float stores amounts as they were reported; cents stores whole minor units
+# in a 64-bit integer, so sums are exact at any size. Switching modes makes
+# the money tables stale, and the next ingestion rebuilds them.
+MONEY_STORAGE = os.getenv("MONEY_STORAGE", "float").lower()
+if MONEY_STORAGE not in ("float", "cents"):
+    raise ValueError("MONEY_STORAGE must be 'float' or 'cents'")
+
+CENTS = MONEY_STORAGE == "cents"
+MINOR_UNITS = 100
+
+
+def parse_float(value: Any) -> float:
+
+    if value is None or value == "" or value == " ":
+        return 0.0
+    try:
+        return float(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def parse_cents(value: Any) -> int:
+
+    # Source amounts are JSON numbers or strings like "1,234.56". With at
+    # most two decimals and 13 digits before the point, float() is exact to
+    # the cent (the product stays well inside 2**53) and it is the fastest
+    # parser Python has. Anything else goes through _parse_cents_text.
+    if type(value) is str:
+        text = value.replace(",", "") if "," in value else value
+        point = text.find(".")
+        whole = point if point >= 0 else len(text)
+        if whole <= 13 and len(text) - whole <= 3:
+            try:
+                return round(float(text) * MINOR_UNITS)
+            except (ValueError, OverflowError):
+                pass
+        return _parse_cents_text(text)
+    if value is None:
+        return 0
+    if type(value) is int:
+        return value * MINOR_UNITS
+    if type(value) is float:
+        return round(value * MINOR_UNITS) if value == value and abs(value) != float("inf") else 0
+    return _parse_cents_text(str(value))
+
+
+def _parse_cents_text(text: str) -> int:
+
+    # Split at the point and read both sides with int(), so long amounts
+    # stay exact; a third decimal rounds half away from zero. What int()
+    # cannot take goes through float, and what float cannot take is 0, as
+    # in parse_float.
+    text = text.strip().replace(",", "")
+    whole, _, fraction = text.partition(".")
+    try:
+        cents = int(whole + (fraction + "00")[:2])
+    except ValueError:
+        return parse_cents(parse_float(text))
+    if len(fraction) > 2:
+        if not fraction[2:].isdigit():
+            return parse_cents(parse_float(text))
+        if fraction[2] >= "5":
+            cents += -1 if whole.startswith("-") else 1
+    return cents
+
+
+def parse_amount(value: Any):
+
+    # What a money column stores: whole cents or a float. Pass the result,
+    # or sums and differences of results, to a Money column via stored().
+    return parse_cents(value) if CENTS else parse_float(value)
+
+
+class Cents(int):
+
+    # An amount already in whole minor units. Money stores it as it is;
+    # every other number bound to a Money column is an amount in units.
+    __slots__ = ()
+
+
+def stored(value):
+
+    # Marks a value in storage units (parse_amount and arithmetic on its
+    # results) for a Money column.
+    return Cents(value) if CENTS else value
+
+
+def to_cents(value: Any) -> int:
+
+    # Amount in units -> whole cents, through Decimal so that 0.1 is 10 and
+    # half a cent rounds away from zero. Text goes through parse_cents.
+    if isinstance(value, str):
+        return parse_cents(value)
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            raise ValueError(f"Cannot store {value} as cents")
+        value = Decimal(repr(value))
+    amount = Decimal(value) * MINOR_UNITS
+    return int(amount.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def minor(expression):
+
+    # The stored value of a money column or aggregate without the result
+    # conversion: cents as int in the cents mode, the float otherwise.
+    return type_coerce(expression, BigInteger) if CENTS else expression
+
+
+def to_units(value):
+
+    # Stored value -> amount, for values read through minor().
+    if not CENTS or value is None:
+        return value
+    return float(value) / MINOR_UNITS
+
+
+class Money(TypeDecorator):
+
+    # Float or BIGINT cents depending on MONEY_STORAGE. Reads, SUM and
+    # column arithmetic included, come back as float amounts; an integer
+    # sum is divided once, so it is the float nearest its exact cents.
+    # Writes take amounts in units, ints included, except Cents, which are
+    # stored as they are. AVG and CAST lose the type and return stored
+    # values.
+    impl = Float
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(BigInteger() if CENTS else Float())
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, Cents):
+            return int(value) if CENTS else value / MINOR_UNITS
+        return to_cents(value) if CENTS else value
+
+    def process_result_value(self, value, dialect):
+        return to_units(value)
@@ -1,6 +1,6 @@
 
-from pydantic import BaseModel
-from datetime import date
+from pydantic import BaseModel, Field
+from datetime import date, datetime
 from typing import Optional, List
 
 
@@ -34,7 +34,7 @@ class AccountDetailBase(BaseModel):
     account_name: str
     parent_account: Optional[str] = None
     amount: float = 0.0
-    account_id: Optional[str] = None
+    account_id: int
 
 class AccountDetailResponse(AccountDetailBase):
     
@@ -48,6 +48,11 @@ class NaturalLanguageQuery(BaseModel):
 
     question: str
 
+class QueryError(BaseModel):
+
+    code: str
+    message: str
+
 class QueryResponse(BaseModel):
    
     question: str
@@ -55,6 +60,8 @@ class QueryResponse(BaseModel):
     sql_query: Optional[str] = None
     data: Optional[List[dict]] = None
     confidence: Optional[float] = None
+    truncated: bool = False
+    error: Optional[QueryError] = None
 
 class FinancialSummary(BaseModel):
 
@@ -62,4 +69,43 @@ class FinancialSummary(BaseModel):
     total_expenses: float
     net_income: float
     period_count: int
-    source: Optional[str] = None
\ No newline at end of file
+    source: Optional[str] = None
+
+class BatchQueryRequest(BaseModel):
+
+    questions: List[str] = Field(..., min_length=1, max_length=50)
+
+class BatchQueryItem(QueryResponse):
+
+    success: bool
+
+class BatchQueryResponse(BaseModel):
+
+    results: List[BatchQueryItem]
+    total: int
+    unique_questions: int
+    succeeded: int
+    failed: int
+
+class JobRequest(BaseModel):
+
+    kind: str = Field(..., description="Job kind: insight, compare or batch")
+    question: Optional[str] = None
+    questions: Optional[List[str]] = Field(None, min_length=1, max_length=50)
+    period1: Optional[str] = None
+    period2: Optional[str] = None
+    year: Optional[int] = None
+    priority: Optional[int] = Field(None, ge=0, le=9, description="Lower runs first")
+
+class JobStatus(BaseModel):
+
+    job_id: str
+    kind: str
+    status: str
+    priority: int
+    generation: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    reused: bool = False
@@ -1,15 +1,30 @@
 
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Any, List
-from groq import Groq
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
-from app.database import SessionLocal
+from app.database import begin_read_snapshot, company_router, engine
+from app.services import metrics, profiling
+from app.services.query_governor import QueryGovernor, QueryRejected, QueryResult
+from app.services.cache_service import get_generation, make_cache
+from app.services.sql_validator import SQLValidator
+from app.services.result_compactor import ResultCompactor
+from app.models import Base
+from app.logging_config import get_logger, configure_logging
 from datetime import datetime
 
 
+logger = get_logger("ai_service")
+
+# Engine dialect -> (sqlglot dialect, name the prompt uses).
+SQL_DIALECTS = {
+    "sqlite": ("sqlite", "SQLite"),
+    "postgresql": ("postgres", "PostgreSQL"),
+}
 
 
 class AIService:
@@ -17,16 +32,29 @@ class AIService:
     def __init__(self):
      api_key = os.environ.get("GROQ_API_KEY") 
     
-     print(f"DEBUG: API Key exists: {api_key is not None}")
-     print(f"DEBUG: API Key length: {len(api_key) if api_key else 0}")
+     logger.debug("Groq API key configured", extra={"api_key_set": api_key is not None})
     
      if not api_key:
         raise ValueError("GROQ_API_KEY is not set!")
     
+     # Imported here so the app can start (and serve /health) without
+     # paying for the groq client import up front.
+     from groq import Groq
+    
      self.client = Groq(api_key=api_key)  
      self.model = "llama-3.3-70b-versatile"
     
-     self.conversation_history = []
+     self.governor = QueryGovernor.from_env()
+     # Generated SQL is asked for, parsed and rewritten in the dialect of
+     # the database it runs on.
+     self.dialect, self.dialect_label = SQL_DIALECTS.get(engine.dialect.name, SQL_DIALECTS["sqlite"])
+     self.validator = SQLValidator.from_metadata(Base.metadata, dialect=self.dialect)
+     self.compactor = ResultCompactor.from_env()
+     self.batch_concurrency = int(os.getenv("AI_BATCH_CONCURRENCY", "8"))
+     # Generated SQL, query rows and answers, per data generation.
+     self.cache = make_cache("ai", int(os.getenv("AI_CACHE_SIZE", "512")))
+     # Chat history per company.
+     self.conversation_histories: Dict[Optional[int], List[Dict]] = {}
      self.max_history = 10
      self.db_schema = """
         Table: financial_periods
@@ -38,6 +66,8 @@ class AIService:
         - year: INTEGER (e.g., 2024)
         - month: INTEGER (1-12)
         - quarter: INTEGER (1-4, where Q1=1, Q2=2, Q3=3, Q4=4)
+        - start_date_key: INTEGER (Foreign Key to date_dim.date_key for period_start, e.g. 20240101)
+        - end_date_key: INTEGER (Foreign Key to date_dim.date_key for period_end, e.g. 20240131)
         - total_revenue: REAL (total income/revenue for the period)
         - total_cogs: REAL (cost of goods sold)
         - gross_profit: REAL (revenue - cogs)
@@ -46,15 +76,104 @@ class AIService:
         - other_expenses: REAL
         - net_income: REAL (final profit/loss)
         
-        Table: account_details
+        Table: date_dim (one row per calendar day)
+        Columns:
+        - date_key: INTEGER (Primary Key, YYYYMMDD)
+        - date: DATE
+        - year, month, day, quarter: INTEGER (calendar)
+        - month_name: TEXT
+        - day_of_week: INTEGER (1=Monday ... 7=Sunday)
+        - month_end: DATE
+        - is_month_end: BOOLEAN
+        - fiscal_year: INTEGER (named after the calendar year the fiscal year ends in)
+        - fiscal_quarter: INTEGER (1-4)
+        - fiscal_month: INTEGER (1-12, 1 = first month of the fiscal year)
+        - iso_year, iso_week: INTEGER
+        
+        Table: canonical_periods (one row per calendar month across sources, duplicates removed)
+        Columns: same as financial_periods, plus
+        - period_id: INTEGER (Foreign Key to the financial_periods row that was kept)
+        - source_count: INTEGER (how many sources reported the month)
+        
+        Table: period_variances (differences between sources for months reported by more than one)
+        Columns:
+        - id: INTEGER (Primary Key)
+        - year: INTEGER
+        - month: INTEGER
+        - metric: TEXT ('total_revenue', 'total_cogs', 'gross_profit', 'total_operating_expenses', 'net_income')
+        - primary_source: TEXT (source kept in canonical_periods)
+        - secondary_source: TEXT
+        - primary_value: REAL
+        - secondary_value: REAL
+        - difference: REAL (secondary_value - primary_value)
+        - difference_pct: REAL (difference as a percentage of primary_value)
+        
+        Table: accounts (one row per account in the chart of accounts)
+        Columns:
+        - id: INTEGER (Primary Key)
+        - account_key: TEXT
+        - external_id: TEXT (account id in the source system)
+        - name: TEXT (account name)
+        - parent_id: INTEGER (Foreign Key to accounts.id, NULL for top-level accounts)
+        - level: INTEGER (0 for top-level accounts, 1 for their sub-accounts, ...)
+        - category_id: INTEGER (1=income, 2=cogs, 3=expense)
+        
+        Table: account_closure (every account paired with itself and each of its ancestors)
+        Columns:
+        - ancestor_id: INTEGER (Foreign Key to accounts.id)
+        - descendant_id: INTEGER (Foreign Key to accounts.id)
+        - depth: INTEGER (0 when ancestor_id = descendant_id)
+        
+        Table: account_details (amount per account per period)
         Columns:
         - id: INTEGER (Primary Key)
         - period_id: INTEGER (Foreign Key to financial_periods)
-        - category: TEXT ('income', 'expense', 'cogs')
-        - account_name: TEXT
-        - parent_account: TEXT
-        - amount: REAL
-        - account_id: TEXT
+        - account_id: INTEGER (Foreign Key to accounts.id)
+        - category_id: INTEGER (1=income, 2=cogs, 3=expense)
+        - amount: REAL (reported total for the account, including its sub-accounts)
+        - own_amount: REAL (amount minus the amounts of its direct sub-accounts)
+        
+        Table: quarterly_summary (one row per source, year and quarter)
+        Columns:
+        - id: INTEGER (Primary Key)
+        - source: TEXT ('quickbooks' or 'rootfi')
+        - year: INTEGER
+        - quarter: INTEGER (1-4)
+        - total_revenue: REAL
+        - total_cogs: REAL
+        - gross_profit: REAL
+        - total_operating_expenses: REAL
+        - net_income: REAL
+        - months: INTEGER (monthly periods in the quarter)
+        
+        Table: anomalies (unusual monthly values found at ingestion)
+        Columns:
+        - id: INTEGER (Primary Key)
+        - scope: TEXT ('period' for statement metrics, 'account' for account amounts)
+        - source: TEXT ('quickbooks' or 'rootfi')
+        - metric: TEXT (financial_periods column name, or 'amount' for accounts)
+        - account_id: INTEGER (Foreign Key to accounts.id, NULL when scope = 'period')
+        - year: INTEGER
+        - month: INTEGER
+        - value: REAL
+        - expected: REAL (median of the previous 12 months)
+        - robust_z: REAL (deviation from the rolling median in robust standard deviations)
+        - seasonal_z: REAL (deviation from the same month in earlier years)
+        - method: TEXT ('rolling_mad', 'seasonal' or 'both')
+        - direction: TEXT ('spike' or 'drop')
+        - severity: REAL (largest absolute z-score; higher is more unusual)
+        
+        Table: forecasts (predicted values for the months after the last actual month)
+        Columns:
+        - id: INTEGER (Primary Key)
+        - source: TEXT ('canonical' for reconciled data, or 'quickbooks' / 'rootfi')
+        - metric: TEXT (financial_periods column name, e.g. 'total_revenue')
+        - year: INTEGER
+        - month: INTEGER
+        - quarter: INTEGER (1-4)
+        - forecast: REAL (point forecast)
+        - lower_80, upper_80: REAL (80% prediction interval)
+        - lower_95, upper_95: REAL (95% prediction interval)
         
         Notes:
         - Data spans from 2020 to 2025
@@ -62,38 +181,107 @@ class AIService:
         - Rootfi has 36 monthly records
         - Total: 104 records
         - All monetary values are in USD
+        - QuickBooks and Rootfi overlap in time: use canonical_periods for totals, trends and comparisons
+          unless the question names a source; summing financial_periods across sources double-counts months
+        - quarterly_summary has per-source quarter totals; filter it by source
+        - For fiscal years or quarters, join date_dim ON date_dim.date_key = start_date_key and filter
+          date_dim.fiscal_year / date_dim.fiscal_quarter; "quarter" and "year" are calendar values
+        - Questions about future months or quarters ("what will Q4 revenue be?") are answered from forecasts
+          with source = 'canonical' unless a source is named; a quarter total is SUM(forecast) over its months
+          plus any months of that quarter already in canonical_periods
+        - Every table except date_dim holds one company's rows; queries are limited to the current company
+          automatically, so never filter on or group by company_id
+        - Join account_details to accounts on account_id to get account names
+        - Never SUM(amount) across accounts of different levels; parents already include their sub-accounts
+        - Total under an account across all levels: join account_closure on descendant_id = account_details.account_id,
+          filter ancestor_id to that account and SUM(account_details.own_amount)
         """
-    def add_to_history(self, role: str, content: str):
-        self.conversation_history.append({
+     # The schema above is written with SQLite's type names; PostgreSQL
+     # calls the float columns DOUBLE PRECISION.
+     if self.dialect == "postgres":
+        self.db_schema = self.db_schema.replace(": REAL", ": DOUBLE PRECISION")
+    def add_to_history(self, role: str, content: str, company_id: Optional[int] = None):
+        history = self.conversation_histories.setdefault(company_id, [])
+        history.append({
             "role": role,
             "content": content,
             "timestamp": datetime.now().isoformat()
         })
         
-        if len(self.conversation_history) > self.max_history:
-            self.conversation_history = self.conversation_history[-self.max_history:]
+        if len(history) > self.max_history:
+            self.conversation_histories[company_id] = history[-self.max_history:]
+    
+    def get_history(self, company_id: Optional[int] = None) -> List[Dict]:
+        return self.conversation_histories.get(company_id, [])
     
-    def get_conversation_context(self) -> str:
-        if not self.conversation_history:
+    def get_conversation_context(self, company_id: Optional[int] = None) -> str:
+        history = self.get_history(company_id)
+        if not history:
             return ""
         
         context = "PREVIOUS CONVERSATION:\n"
-        for msg in self.conversation_history[-6:]:  
+        for msg in history[-6:]:  
             role = "User" if msg["role"] == "user" else "Assistant"
             context += f"{role}: {msg['content']}\n"
         
         return context
     
-    def clear_history(self):
-        self.conversation_history = []
+    def clear_history(self, company_id: Optional[int] = None):
+        self.conversation_histories.pop(company_id, None)
     
+    def _complete(self, system: str, prompt: str, temperature: float, max_tokens: int) -> str:
+        
+        with profiling.stage("llm"):
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": system
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+        
+        metrics.record_llm_usage(response)
+        
+        return response.choices[0].message.content.strip()
     
     
-    def generate_sql(self, question: str) -> str:
+    def _round(self, expression: str) -> str:
         
-        conversation_context = self.get_conversation_context()
+        # PostgreSQL has no ROUND(double precision, int); round as NUMERIC
+        # and cast back so rows keep plain floats.
+        if self.dialect == "postgres":
+            return f"CAST(ROUND(CAST({expression} AS NUMERIC), 2) AS DOUBLE PRECISION)"
+        return f"ROUND({expression}, 2)"
+    
+    def _generation(self, company_id: Optional[int]) -> int:
+        
+        # For callers that have no session of their own yet.
+        with company_router.session(company_id) as db:
+            generation, _ = get_generation(db)
+        return generation
+    
+    def generate_sql(self, question: str, use_context: bool = True, company_id: Optional[int] = None,
+                     generation: Optional[int] = None) -> str:
+        
+        conversation_context = self.get_conversation_context(company_id) if use_context else ""
+        if generation is None:
+            generation = self._generation(company_id)
+        
+        # A follow-up only hits when the conversation so far matches too.
+        key = ("sql", company_id, generation, " ".join(question.split()), conversation_context)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
         
-        prompt = f"""You are a SQL expert. Convert the following natural language question to a SQLite SQL query.
+        prompt = f"""You are a SQL expert. Convert the following natural language question to a {self.dialect_label} SQL query.
 
 DATABASE SCHEMA:
 {self.db_schema}
@@ -102,14 +290,14 @@ DATABASE SCHEMA:
 
 IMPORTANT RULES:
 1. Return ONLY the SQL query, no explanations
-2. Use SQLite syntax
+2. Use {self.dialect_label} syntax
 3. For quarters: Q1=1, Q2=2, Q3=3, Q4=4
 4. For profit questions, use net_income column
 5. For revenue questions, use total_revenue column
 6. For expenses, use total_operating_expenses + total_cogs
 7. Always include year in results when relevant
 8. Use SUM() for aggregations across multiple periods
-9. Round monetary values to 2 decimal places using ROUND()
+9. Round monetary values to 2 decimal places using {self._round("x")}
 10. If question asks about "profit", use net_income
 11. If question asks about comparison, use appropriate GROUP BY
 12. If the question refers to previous context (like "and Q2?" or "what about 2023?"), use the context to understand what metric is being asked about
@@ -119,30 +307,21 @@ CURRENT QUESTION: {question}
 SQL QUERY:"""
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a SQL expert. Return only valid SQLite SQL queries, nothing else. Use conversation context to understand follow-up questions."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+            sql = self._complete(
+                f"You are a SQL expert. Return only valid {self.dialect_label} SQL queries, nothing else. Use conversation context to understand follow-up questions.",
+                prompt,
                 temperature=0,
                 max_tokens=500
             )
             
-            sql = response.choices[0].message.content.strip()
-            
             sql = self._clean_sql(sql)
+            if sql:
+                self.cache.set(key, sql)
             
             return sql
             
         except Exception as e:
-            print(f"Error generating SQL: {e}")
+            logger.error("Error generating SQL", extra={"error": str(e)})
             return None
     
     def _clean_sql(self, sql: str) -> str:
@@ -150,66 +329,70 @@ SQL QUERY:"""
         sql = re.sub(r'```sql\s*', '', sql)
         sql = re.sub(r'```\s*', '', sql)
         
-        if 'SELECT' in sql.upper():
-            start = sql.upper().find('SELECT')
-            sql = sql[start:]
+        match = re.search(r'\b(WITH|SELECT)\b', sql, flags=re.IGNORECASE)
+        if match:
+            sql = sql[match.start():]
         
         if ';' in sql:
             sql = sql.split(';')[0] + ';'
         
         return sql.strip()
     
-    def execute_sql(self, sql: str, db: Session) -> List[Dict]:
+    def execute_sql(self, sql: str, db: Session, generation: Optional[int] = None) -> List[Dict]:
         
-        if not self._is_safe_sql(sql):
-            print("Blocked unsafe SQL query!")
-            return None
+        # Sessions opened for a company only see that company's rows.
+        # generation is the one the caller's snapshot reads, when it has one.
+        try:
+            sql = self.validator.rewrite(sql, limit=self.governor.max_rows + 1, company_id=db.info.get("company_id"))
+        except QueryRejected:
+            logger.warning("Blocked unsafe SQL query", extra={"sql": sql})
+            raise
+        
+        if generation is None:
+            generation, _ = get_generation(db)
+        key = ("rows", generation, sql)
+        cached = self.cache.get(key)
+        if cached is not None:
+            data = QueryResult(cached["rows"])
+            data.truncated = cached["truncated"]
+            return data
         
         try:
-            result = db.execute(text(sql))
-            columns = result.keys()
-            rows = result.fetchall()
-            
-            data = []
-            for row in rows:
-                data.append(dict(zip(columns, row)))
-            
+            data = self.governor.execute(sql, db, row_cap_applied=True)
+            self.cache.set(key, {"rows": list(data), "truncated": data.truncated})
             return data
             
+        except QueryRejected:
+            raise
+        
         except Exception as e:
-            print(f"Error executing SQL: {e}")
+            logger.error("Error executing SQL", extra={"error": str(e), "sql": sql})
             return None
     
     def _is_safe_sql(self, sql: str) -> bool:
         
-        sql_clean = sql.replace('\n', ' ').replace('\r', ' ').strip()
-        sql_upper = sql_clean.upper()
-        
-        dangerous_keywords = [
-            'DROP ', 'DELETE ', 'INSERT ', 'UPDATE ', 
-            'ALTER ', 'CREATE ', 'TRUNCATE ', 'REPLACE ',
-            'EXEC ', 'EXECUTE ', 'GRANT ', 'REVOKE ',
-            ' -- ', ';--', '/*', '*/', 'XP_'
-        ]
-        
-        if not sql_upper.startswith('SELECT'):
-            print(f"Query must start with SELECT")
-            return False
-        
-        for keyword in dangerous_keywords:
-            if keyword in sql_upper:
-                print(f"Dangerous keyword detected: {keyword}")
-                return False
-        
-        sql_without_end = sql_clean.rstrip(';')
-        if ';' in sql_without_end:
-            print("Multiple statements not allowed")
+        try:
+            self.validator.validate(sql)
+        except QueryRejected:
             return False
         
-        print("SQL query is safe")
+        logger.debug("SQL query is safe", extra={"sample_every": 100})
         return True
     
-    def generate_answer(self, question: str, sql: str, data: List[Dict]) -> str:
+    def generate_answer(self, question: str, sql: str, data: List[Dict], company_id: Optional[int] = None,
+                        generation: Optional[int] = None) -> str:
+        
+        # The rows follow from the SQL, the company and the generation.
+        if generation is None:
+            generation = self._generation(company_id)
+        key = ("answer", company_id, generation, question, sql)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        data_text, compaction = self.compactor.compact(data)
+        if getattr(data, "truncated", False):
+            data_text += f"\n(Result truncated to the first {len(data)} rows.)"
         
         prompt = f"""Based on the following data, provide a clear and concise answer to the user's question.
 
@@ -218,7 +401,7 @@ QUESTION: {question}
 SQL QUERY USED: {sql}
 
 DATA RESULTS:
-{data}
+{data_text}
 
 INSTRUCTIONS:
 1. Provide a direct, clear answer
@@ -231,33 +414,25 @@ INSTRUCTIONS:
 ANSWER:"""
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a financial analyst providing clear, data-driven insights. Be concise and professional."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+            answer = self._complete(
+                "You are a financial analyst providing clear, data-driven insights. Be concise and professional.",
+                prompt,
                 temperature=0.3,
                 max_tokens=500
             )
-            
-            return response.choices[0].message.content.strip()
+            self.cache.set(key, answer)
+            return answer
             
         except Exception as e:
-            print(f"Error generating answer: {e}")
-            return f"The query returned: {data}"
+            logger.error("Error generating answer", extra={"error": str(e)})
+            return f"The query returned: {data_text}"
     
        
     
-    def comparative_analysis(self, period1: str, period2: str, year: int = None) -> Dict[str, Any]:
+    def comparative_analysis(self, period1: str, period2: str, year: int = None,
+                             company_id: Optional[int] = None) -> Dict[str, Any]:
         
-        db = SessionLocal()
+        db = company_router.session(company_id)
         
         try:
            
@@ -272,11 +447,11 @@ ANSWER:"""
                 sql = f"""
                 SELECT 
                     quarter,
-                    ROUND(SUM(total_revenue), 2) as revenue,
-                    ROUND(SUM(total_operating_expenses + total_cogs), 2) as expenses,
-                    ROUND(SUM(gross_profit), 2) as gross_profit,
-                    ROUND(SUM(net_income), 2) as net_income
-                FROM financial_periods
+                    {self._round('SUM(total_revenue)')} as revenue,
+                    {self._round('SUM(total_operating_expenses + total_cogs)')} as expenses,
+                    {self._round('SUM(gross_profit)')} as gross_profit,
+                    {self._round('SUM(net_income)')} as net_income
+                FROM canonical_periods
                 WHERE year = {year} AND quarter IN ({q1}, {q2})
                 GROUP BY quarter
                 ORDER BY quarter
@@ -291,11 +466,11 @@ ANSWER:"""
                 sql = f"""
                 SELECT 
                     year,
-                    ROUND(SUM(total_revenue), 2) as revenue,
-                    ROUND(SUM(total_operating_expenses + total_cogs), 2) as expenses,
-                    ROUND(SUM(gross_profit), 2) as gross_profit,
-                    ROUND(SUM(net_income), 2) as net_income
-                FROM financial_periods
+                    {self._round('SUM(total_revenue)')} as revenue,
+                    {self._round('SUM(total_operating_expenses + total_cogs)')} as expenses,
+                    {self._round('SUM(gross_profit)')} as gross_profit,
+                    {self._round('SUM(net_income)')} as net_income
+                FROM canonical_periods
                 WHERE year IN ({year1}, {year2})
                 GROUP BY year
                 ORDER BY year
@@ -330,9 +505,10 @@ ANSWER:"""
                     "change_percentage": round(change_pct, 2)
                 }
             
-            analysis = self._generate_comparative_insight(
-                period1, period2, changes, comparison_type, year
-            )
+            with metrics.ai_stage_seconds.time(stage="comparative_insight"):
+                analysis = self._generate_comparative_insight(
+                    period1, period2, changes, comparison_type, year
+                )
             
             return {
                 "success": True,
@@ -377,98 +553,190 @@ Provide a brief, insightful analysis (3-4 sentences) highlighting:
 3. Any concerns or positive trends"""
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a financial analyst providing clear, concise insights."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+            return self._complete(
+                "You are a financial analyst providing clear, concise insights.",
+                prompt,
                 temperature=0.3,
                 max_tokens=300
             )
             
-            return response.choices[0].message.content.strip()
-            
         except Exception as e:
             return f"Revenue changed by {changes['revenue']['change_percentage']:+.1f}%, Net Income changed by {changes['net_income']['change_percentage']:+.1f}%"
     
-    def query(self, question: str) -> Dict[str, Any]:
+    def _error_response(self, question: str, code: str, error: str, answer: str,
+                        sql: Optional[str] = None) -> Dict[str, Any]:
+        
+        response = {
+            "success": False,
+            "question": question,
+            "error": error,
+            "error_code": code,
+            "answer": answer
+        }
+        if sql:
+            response["sql_query"] = sql
+        return response
+    
+    def _success_response(self, question: str, sql: str, data: List[Dict], answer: str) -> Dict[str, Any]:
+        
+        return {
+            "success": True,
+            "question": question,
+            "sql_query": sql,
+            "data": data,
+            "answer": answer,
+            "rows_returned": len(data),
+            "truncated": getattr(data, "truncated", False)
+        }
+    
+    def _execute_for_question(self, question: str, sql: str, db: Session, generation: Optional[int] = None):
         
-        print(f"\n{'='*50}")
-        print(f"Question ? {question}")
-        print('='*50)
+        try:
+            data = self.execute_sql(sql, db, generation)
+        except QueryRejected as e:
+            return None, self._error_response(
+                question, e.code, e.message, f"The query was stopped: {e.message}", sql
+            )
         
-        self.add_to_history("user", question)
+        if data is None:
+            return None, self._error_response(
+                question,
+                "sql_execution_failed",
+                "Failed to execute SQL query",
+                "There was an error executing the query. The SQL might be invalid.",
+                sql
+            )
         
-        print(" Generation Loading SQL...")
-        sql = self.generate_sql(question)
+        return data, None
+    
+    def query(self, question: str, company_id: Optional[int] = None) -> Dict[str, Any]:
         
-        if not sql:
-            error_response = {
-                "success": False,
-                "question": question,
-                "error": "Failed to generate SQL query",
-                "answer": "I couldn't understand the question. Please try rephrasing."
-            }
-            return error_response
+        logger.info("AI query received", extra={"question": question, "company_id": company_id})
         
-        print(f"SQL: {sql}")
+        self.add_to_history("user", question, company_id)
         
+        # Read once, before anything runs: rows of a newer ingestion cached
+        # under it are never served, as lookups have moved on by then.
+        generation = self._generation(company_id)
         
-        print("Query Loading...")
-        db = SessionLocal()
+        with metrics.ai_stage_seconds.time(stage="generate_sql"):
+            sql = self.generate_sql(question, company_id=company_id, generation=generation)
+        
+        if not sql:
+            return self._error_response(
+                question,
+                "sql_generation_failed",
+                "Failed to generate SQL query",
+                "I couldn't understand the question. Please try rephrasing."
+            )
+        
+        logger.debug("Generated SQL", extra={"sql": sql})
+        
+        db = company_router.session(company_id)
         
         try:
-            data = self.execute_sql(sql, db)
+            with metrics.ai_stage_seconds.time(stage="execute_sql"):
+                data, error_response = self._execute_for_question(question, sql, db, generation)
             
-            if data is None:
-                error_response = {
-                    "success": False,
-                    "question": question,
-                    "sql_query": sql,
-                    "error": "Failed to execute SQL query",
-                    "answer": "There was an error executing the query. The SQL might be invalid."
-                }
+            if error_response:
                 return error_response
             
-            print(f" Results {len(data)} ")
+            logger.debug("SQL executed", extra={"rows": len(data)})
             
-            print("Generation Loading result...")
-            answer = self.generate_answer(question, sql, data)
+            with metrics.ai_stage_seconds.time(stage="generate_answer"):
+                answer = self.generate_answer(question, sql, data, company_id, generation)
             
-            self.add_to_history("assistant", answer)
+            self.add_to_history("assistant", answer, company_id)
             
-            print(f"Result {answer[:100]}...")
+            logger.info("AI query answered", extra={"rows": len(data)})
             
-            return {
-                "success": True,
-                "question": question,
-                "sql_query": sql,
-                "data": data,
-                "answer": answer,
-                "rows_returned": len(data)
-            }
+            return self._success_response(question, sql, data, answer)
             
         except Exception as e:
-            error_response = {
-                "success": False,
-                "question": question,
-                "sql_query": sql,
-                "error": str(e),
-                "answer": f"An error occurred: {str(e)}"
-            }
-            return error_response
+            return self._error_response(
+                question, "internal_error", str(e), f"An error occurred: {str(e)}", sql
+            )
         
         finally:
             db.close()
     
-    def get_sample_questions(self) -> List[str]:
+    def query_batch(self, questions: List[str], company_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        
+        # Dashboard questions are independent of each other and of the chat,
+        # so no conversation context is used or recorded for them.
+        keys = [" ".join(q.split()) for q in questions]
+        unique = list(dict.fromkeys(keys))
+        
+        logger.info("AI batch query received", extra={"questions": len(questions), "unique": len(unique)})
+        
+        results = {}
+        workers = max(1, min(self.batch_concurrency, len(unique)))
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-batch") as pool:
+            
+            with metrics.ai_stage_seconds.time(stage="batch_generate_sql"):
+                sql_generation = self._generation(company_id)
+                sqls = dict(zip(unique, pool.map(
+                    lambda q: self.generate_sql(q, use_context=False, company_id=company_id, generation=sql_generation),
+                    unique
+                )))
+            
+            pending = {}
+            generation = None
+            db = company_router.session(company_id)
+            
+            try:
+                with metrics.ai_stage_seconds.time(stage="batch_execute_sql"):
+                    # Every query runs inside one read transaction and under
+                    # one generation, so all answers see the same data.
+                    begin_read_snapshot(db)
+                    generation, _ = get_generation(db)
+                    savepoints = db.get_bind().dialect.name == "postgresql"
+                    for question in unique:
+                        sql = sqls[question]
+                        if not sql:
+                            results[question] = self._error_response(
+                                question,
+                                "sql_generation_failed",
+                                "Failed to generate SQL query",
+                                "I couldn't understand the question. Please try rephrasing."
+                            )
+                            continue
+                        
+                        # On PostgreSQL a failed statement aborts the whole
+                        # transaction; a savepoint keeps it to one question.
+                        savepoint = db.begin_nested() if savepoints else None
+                        data, error_response = self._execute_for_question(question, sql, db, generation)
+                        if savepoint is not None and error_response:
+                            savepoint.rollback()
+                        elif savepoint is not None:
+                            savepoint.commit()
+                        if error_response:
+                            results[question] = error_response
+                        else:
+                            pending[question] = (sql, data)
+            
+            except Exception as e:
+                for question in unique:
+                    if question not in results:
+                        results[question] = self._error_response(
+                            question, "internal_error", str(e), f"An error occurred: {str(e)}", sqls.get(question)
+                        )
+                pending = {}
+            
+            finally:
+                db.close()
+            
+            with metrics.ai_stage_seconds.time(stage="batch_generate_answer"):
+                answers = pool.map(lambda q: self.generate_answer(q, *pending[q], company_id, generation), list(pending))
+                for question, answer in zip(list(pending), answers):
+                    sql, data = pending[question]
+                    results[question] = self._success_response(question, sql, data, answer)
+        
+        return [dict(results[key], question=question) for key, question in zip(keys, questions)]
+    
+    @staticmethod
+    def get_sample_questions() -> List[str]:
         
         return [
             "What was the total profit in Q1 2024?",
@@ -484,11 +752,28 @@ Provide a brief, insightful analysis (3-4 sentences) highlighting:
         ]
 
 
+_ai_service = None
+_ai_service_lock = threading.Lock()
+
+
+def get_ai_service() -> AIService:
+    
+    global _ai_service
+    
+    if _ai_service is None:
+        with _ai_service_lock:
+            if _ai_service is None:
+                _ai_service = AIService()
+    
+    return _ai_service
+
+
 if __name__ == "__main__":
     print("\n" + "-"*25)
     print(" Kudwa Financial AI - Test Mode")
     print("-"*25)
     
+    configure_logging(fmt="text")
    
     ai = AIService()
     
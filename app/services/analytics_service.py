@@ -0,0 +1,222 @@
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import FinancialPeriod, CanonicalPeriod
+from app.money import CENTS, MINOR_UNITS, minor
+from app.services.cache_service import ResponseCache, get_generation
+
+
+METRIC_COLUMNS = (
+    "total_revenue",
+    "total_cogs",
+    "gross_profit",
+    "total_operating_expenses",
+    "other_income",
+    "other_expenses",
+    "net_income"
+)
+
+# Pandas period frequency and periods per year for each granularity.
+GRANULARITIES = {"month": ("M", 12), "quarter": ("Q", 4), "year": ("Y", 1)}
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+class NoAnalyticsData(AnalyticsError):
+    pass
+
+
+class AnalyticsService:
+
+    def __init__(self, cache_size: int = 16):
+        self._cache = ResponseCache("analytics", cache_size)
+
+    def monthly(self, db: Session, source: Optional[str] = None) -> pd.DataFrame:
+
+        # The monthly frame only changes when the data generation does, so
+        # every analytics request of a generation shares one load per company.
+        generation, _ = get_generation(db)
+        key = (db.info.get("company_id"), generation, source)
+
+        frame = self._cache.get(key)
+        if frame is None:
+            frame = load_monthly(db, source, minor_units=True)
+            self._cache.set(key, frame)
+        return frame
+
+    def growth(self, db: Session, granularity: str = "month", source: Optional[str] = None,
+               metric: Optional[str] = None, year: Optional[int] = None) -> Dict[str, Any]:
+
+        frame, months = self._aggregate(db, granularity, source, metric)
+        per_year = GRANULARITIES[granularity][1]
+
+        result = {
+            "values": frame,
+            "change": frame - frame.shift(1),
+            "change_pct": _pct_change(frame, 1)
+        }
+        if per_year > 1:
+            result["yoy_pct"] = _pct_change(frame, per_year)
+
+        return self._response(granularity, source, months, result, year)
+
+    def rolling(self, db: Session, window: int = 3, granularity: str = "month",
+                source: Optional[str] = None, metric: Optional[str] = None,
+                year: Optional[int] = None) -> Dict[str, Any]:
+
+        if window < 2:
+            raise AnalyticsError("window must be at least 2")
+
+        frame, months = self._aggregate(db, granularity, source, metric)
+        windowed = frame.rolling(window, min_periods=window)
+
+        result = {"values": frame, "rolling_mean": windowed.mean(), "rolling_sum": windowed.sum()}
+        return {**self._response(granularity, source, months, result, year), "window": window}
+
+    def year_to_date(self, db: Session, source: Optional[str] = None, metric: Optional[str] = None,
+                     year: Optional[int] = None) -> Dict[str, Any]:
+
+        frame, months = self._aggregate(db, "month", source, metric)
+        ytd = frame.groupby(frame.index.year).cumsum()
+
+        return self._response("month", source, months, {"values": frame, "ytd": ytd}, year)
+
+    def margins(self, db: Session, granularity: str = "month", source: Optional[str] = None,
+                year: Optional[int] = None) -> Dict[str, Any]:
+
+        frame, months = self._aggregate(db, granularity, source, None)
+        revenue = frame["total_revenue"].where(frame["total_revenue"] != 0)
+
+        margins = pd.DataFrame({
+            "gross_margin_pct": frame["gross_profit"] / revenue * 100,
+            "operating_margin_pct": (frame["gross_profit"] - frame["total_operating_expenses"]) / revenue * 100,
+            "net_margin_pct": frame["net_income"] / revenue * 100,
+            "cogs_ratio_pct": frame["total_cogs"] / revenue * 100,
+            "opex_ratio_pct": frame["total_operating_expenses"] / revenue * 100
+        }, index=frame.index)
+
+        return self._response(granularity, source, months, {"margins": margins}, year)
+
+    def cagr(self, db: Session, source: Optional[str] = None, metric: Optional[str] = None,
+             start_year: Optional[int] = None, end_year: Optional[int] = None) -> Dict[str, Any]:
+
+        annual, months = self._aggregate(db, "year", source, metric)
+
+        # Only complete years give a like-for-like compound rate.
+        full_years = annual[months == 12]
+        if start_year:
+            full_years = full_years[full_years.index.year >= start_year]
+        if end_year:
+            full_years = full_years[full_years.index.year <= end_year]
+
+        if len(full_years) < 2:
+            raise NoAnalyticsData("CAGR needs at least two complete years of data")
+
+        first, last = full_years.iloc[0], full_years.iloc[-1]
+        years = int(full_years.index[-1].year - full_years.index[0].year)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rates = np.where((first > 0) & (last > 0), (last / first) ** (1 / years) - 1, np.nan) * 100
+
+        return {
+            "source": source or "canonical",
+            "start_year": int(full_years.index[0].year),
+            "end_year": int(full_years.index[-1].year),
+            "years": years,
+            "start": _values(first),
+            "end": _values(last),
+            "cagr_pct": dict(zip(full_years.columns, _list(rates)))
+        }
+
+    def _aggregate(self, db: Session, granularity: str, source: Optional[str], metric: Optional[str]):
+
+        if granularity not in GRANULARITIES:
+            raise AnalyticsError(f"granularity must be one of: {', '.join(GRANULARITIES)}")
+        if metric and metric not in METRIC_COLUMNS:
+            raise AnalyticsError(f"metric must be one of: {', '.join(METRIC_COLUMNS)}")
+
+        frame = self.monthly(db, source)
+        if frame.empty:
+            raise NoAnalyticsData("No data found")
+
+        months = frame.notna().all(axis=1).astype(int)
+        freq = GRANULARITIES[granularity][0]
+        if freq != "M":
+            groups = frame.index.asfreq(freq)
+            frame = frame.groupby(groups).sum(min_count=1)
+            months = months.groupby(groups).sum()
+        if CENTS:
+            # Sums above ran on whole cents; changes and ratios use amounts.
+            frame = frame / MINOR_UNITS
+
+        if metric:
+            frame = frame[[metric]]
+        return frame, months
+
+    def _response(self, granularity: str, source: Optional[str], months: pd.Series,
+                  frames: Dict[str, pd.DataFrame], year: Optional[int]) -> Dict[str, Any]:
+
+        # Filters apply after the calculation so the first period of a year
+        # still has its previous period to compare against.
+        index = next(iter(frames.values())).index
+        mask = np.ones(len(index), dtype=bool) if year is None else np.asarray(index.year == year)
+
+        return {
+            "source": source or "canonical",
+            "granularity": granularity,
+            "periods": [str(p) for p in index[mask]],
+            "months": [int(m) for m in months.to_numpy()[mask]],
+            **{name: {col: _list(frame[col].to_numpy()[mask]) for col in frame.columns}
+               for name, frame in frames.items()}
+        }
+
+
+def load_monthly(db: Session, source: Optional[str] = None, minor_units: bool = False) -> pd.DataFrame:
+
+    # Cross-source questions use the reconciled periods so overlapping
+    # months are not counted twice. minor_units=True keeps cents columns in
+    # cents: float64 holds whole numbers exactly up to 2**53, NaN included.
+    model = FinancialPeriod if source else CanonicalPeriod
+    statement = select(
+        model.year, model.month,
+        *(minor(getattr(model, c)) if minor_units else getattr(model, c) for c in METRIC_COLUMNS)
+    )
+    if source:
+        statement = statement.where(FinancialPeriod.source == source)
+
+    frame = pd.DataFrame(db.execute(statement).all(), columns=["year", "month", *METRIC_COLUMNS])
+    if frame.empty:
+        return frame.set_index(pd.PeriodIndex([], freq="M"))[list(METRIC_COLUMNS)]
+
+    index = pd.PeriodIndex(
+        pd.to_datetime({"year": frame["year"], "month": frame["month"], "day": 1}), freq="M"
+    )
+    frame = frame[list(METRIC_COLUMNS)].astype("float64").groupby(index).sum()
+
+    # A gap-free monthly index makes every shift a calendar offset.
+    full = pd.period_range(frame.index.min(), frame.index.max(), freq="M")
+    return frame.reindex(full)
+
+
+def _pct_change(frame: pd.DataFrame, periods: int) -> pd.DataFrame:
+
+    # Relative to the absolute previous value, so a loss shrinking from -100
+    # to -50 reads as +50% rather than -50%.
+    previous = frame.shift(periods)
+    change = (frame - previous) / previous.abs() * 100
+    return change.replace([np.inf, -np.inf], np.nan)
+
+
+def _list(values) -> List[Optional[float]]:
+    rounded = np.round(np.asarray(values, dtype="float64"), 2)
+    return [None if not np.isfinite(v) else float(v) for v in rounded]
+
+
+def _values(row: pd.Series) -> Dict[str, Optional[float]]:
+    return dict(zip(row.index, _list(row.to_numpy())))
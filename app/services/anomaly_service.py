@@ -0,0 +1,242 @@
+import os
+import warnings
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app.models import AccountDetail, Anomaly, FinancialPeriod
+from app.services.analytics_service import METRIC_COLUMNS
+from app.logging_config import get_logger
+
+
+logger = get_logger("anomaly_service")
+
+# Scales a median absolute deviation to a standard deviation for normal data.
+MAD_SCALE = 0.6745
+
+
+class AnomalyDetector:
+
+    def __init__(self, window: int = 12, threshold: float = 3.5, seasonal_threshold: float = 3.5,
+                 seasonal_years: int = 3, min_history: int = 6, chunk_size: int = 512,
+                 relative_scale: float = 0.01, magnitude_scale: float = 0.05, min_scale: float = 1.0):
+        self.window = window
+        self.threshold = threshold
+        self.seasonal_threshold = seasonal_threshold
+        self.seasonal_years = seasonal_years
+        self.min_history = min_history
+        self.chunk_size = chunk_size
+        # Floors for the MAD: a share of the series' level, a share of its
+        # typical magnitude, and an amount.
+        self.relative_scale = relative_scale
+        self.magnitude_scale = magnitude_scale
+        self.min_scale = min_scale
+
+    @classmethod
+    def from_env(cls) -> "AnomalyDetector":
+        return cls(
+            window=int(os.getenv("ANOMALY_WINDOW", "12")),
+            threshold=float(os.getenv("ANOMALY_THRESHOLD", "3.5")),
+            seasonal_threshold=float(os.getenv("ANOMALY_SEASONAL_THRESHOLD", "3.5")),
+            relative_scale=float(os.getenv("ANOMALY_RELATIVE_SCALE", "0.01")),
+            magnitude_scale=float(os.getenv("ANOMALY_MAGNITUDE_SCALE", "0.05")),
+            min_scale=float(os.getenv("ANOMALY_MIN_SCALE", "1"))
+        )
+
+    def build(self, db: Session, company_id: int) -> int:
+
+        # db is a session opened for company_id, so it only reads and
+        # deletes that company's rows.
+        db.query(Anomaly).delete()
+
+        rows = []
+        for scope, frames in (("period", self._period_series(db)), ("account", self._account_series(db))):
+            for source, frame in frames.items():
+                rows.extend({"company_id": company_id, **row} for row in self._flagged_rows(scope, source, frame))
+
+        if rows:
+            db.execute(insert(Anomaly), rows)
+        db.commit()
+        logger.info("Anomalies detected", extra={"count": len(rows)})
+        return len(rows)
+
+    def score(self, values: np.ndarray) -> Dict[str, np.ndarray]:
+
+        # values is months x series with NaN for missing months. Columns are
+        # scored in chunks so the sliding windows stay a bounded size.
+        scores = {name: np.full(values.shape, np.nan) for name in ("expected", "robust_z", "seasonal_z")}
+        flagged = np.zeros(values.shape, dtype=bool)
+
+        with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+            # All-NaN windows are expected for new accounts and score as NaN.
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for start in range(0, values.shape[1], self.chunk_size):
+                columns = slice(start, start + self.chunk_size)
+                chunk = self._score_chunk(values[:, columns])
+                for name in scores:
+                    scores[name][:, columns] = chunk[name]
+                flagged[:, columns] = chunk["flagged"]
+
+        scores["flagged"] = flagged
+        return scores
+
+    def _score_chunk(self, values: np.ndarray) -> Dict[str, np.ndarray]:
+
+        # Typical size of the series when it is not zero, over its whole
+        # history. A series that sits at zero has a level of zero, so this is
+        # what keeps its first real amount from scoring in the millions.
+        magnitude = np.nanmedian(np.where(values != 0, np.abs(values), np.nan), axis=0)
+        expected, robust_z = self._rolling_z(values, magnitude=magnitude)
+
+        # Seasonal baseline is the median of the same calendar month in
+        # earlier years, so one past spike does not move it. The difference
+        # from it is scored the same way, which absorbs trend and seasonality.
+        months = values.shape[0]
+        lagged = np.full((self.seasonal_years, *values.shape), np.nan)
+        for year in range(1, self.seasonal_years + 1):
+            lag = 12 * year
+            if lag < months:
+                lagged[year - 1, lag:] = values[:-lag]
+        baseline = np.nanmedian(lagged, axis=0)
+        baseline[np.count_nonzero(~np.isnan(lagged), axis=0) < 2] = np.nan
+        _, seasonal_z = self._rolling_z(values - baseline, level=expected, magnitude=magnitude)
+
+        flagged = (np.abs(robust_z) >= self.threshold) | (np.abs(seasonal_z) >= self.seasonal_threshold)
+        return {"expected": expected, "robust_z": robust_z, "seasonal_z": seasonal_z, "flagged": flagged}
+
+    def _rolling_z(self, values: np.ndarray, level: Optional[np.ndarray] = None,
+                   magnitude: Optional[np.ndarray] = None):
+
+        # Trailing window of the previous `window` months, never the month
+        # being scored, so a spike cannot hide itself by inflating the MAD.
+        months = values.shape[0]
+        padded = np.vstack([np.full((self.window, values.shape[1]), np.nan), values])
+        windows = sliding_window_view(padded, self.window, axis=0)[:months]
+        history = np.count_nonzero(~np.isnan(windows), axis=2)
+
+        median = _window_median(windows, history)
+        mad = _window_median(np.abs(windows - median[..., None]), history)
+
+        # A MAD of a dozen points is often far too small by chance, so each
+        # window's scale is floored at the MAD of the series' residuals over
+        # its whole history. Batch detection can afford the look-ahead. A
+        # flat series has a MAD near zero all the same, so the scale is also
+        # floored at a share of the level (the rolling median of the series
+        # itself; values may be differences), at a share of the series'
+        # typical magnitude and at min_scale.
+        residual = values - median
+        pooled = np.nanmedian(np.abs(residual - np.nanmedian(residual, axis=0)), axis=0)
+        level = median if level is None else level
+        floor = np.fmax(self.relative_scale * np.abs(level), self.min_scale)
+        if magnitude is not None:
+            floor = np.fmax(floor, self.magnitude_scale * magnitude)
+        scale = np.fmax(np.fmax(mad, pooled), floor)
+
+        z = MAD_SCALE * residual / np.where(scale > 0, scale, np.nan)
+        z[history < self.min_history] = np.nan
+        return median, z
+
+    def _flagged_rows(self, scope: str, source: str, frame: pd.DataFrame) -> List[Dict]:
+
+        if frame.empty:
+            return []
+
+        values = frame.to_numpy(dtype="float64")
+        scores = self.score(values)
+        month_index, column_index = np.nonzero(scores["flagged"])
+        if not len(month_index):
+            return []
+
+        periods = frame.index[month_index]
+        robust_z = scores["robust_z"][month_index, column_index]
+        seasonal_z = scores["seasonal_z"][month_index, column_index]
+        robust_hit = np.abs(robust_z) >= self.threshold
+        seasonal_hit = np.abs(seasonal_z) >= self.seasonal_threshold
+        method = np.where(robust_hit & seasonal_hit, "both", np.where(robust_hit, "rolling_mad", "seasonal"))
+        severity = np.fmax(np.abs(robust_z), np.abs(seasonal_z))
+        signed = np.where(robust_hit, robust_z, seasonal_z)
+
+        keys = frame.columns[column_index]
+        return [
+            {
+                "scope": scope,
+                "source": source,
+                "metric": key if scope == "period" else "amount",
+                "account_id": int(key) if scope == "account" else None,
+                "year": int(period.year),
+                "month": int(period.month),
+                "value": float(value),
+                "expected": _optional(expected),
+                "robust_z": _optional(robust),
+                "seasonal_z": _optional(seasonal),
+                "method": str(how),
+                "direction": "spike" if sign > 0 else "drop",
+                "severity": round(float(sev), 4)
+            }
+            for key, period, value, expected, robust, seasonal, how, sign, sev in zip(
+                keys, periods, values[month_index, column_index],
+                scores["expected"][month_index, column_index], robust_z, seasonal_z,
+                method, signed, severity
+            )
+        ]
+
+    def _period_series(self, db: Session) -> Dict[str, pd.DataFrame]:
+
+        statement = select(
+            FinancialPeriod.source, FinancialPeriod.year, FinancialPeriod.month,
+            *(getattr(FinancialPeriod, c) for c in METRIC_COLUMNS)
+        )
+        frame = pd.DataFrame(db.execute(statement).all(), columns=["source", "year", "month", *METRIC_COLUMNS])
+        return {
+            source: _monthly(group, list(METRIC_COLUMNS))
+            for source, group in frame.groupby("source")
+        }
+
+    def _account_series(self, db: Session) -> Dict[str, pd.DataFrame]:
+
+        statement = (
+            select(FinancialPeriod.source, FinancialPeriod.year, FinancialPeriod.month,
+                   AccountDetail.account_id, AccountDetail.amount)
+            .join(FinancialPeriod, FinancialPeriod.id == AccountDetail.period_id)
+        )
+        frame = pd.DataFrame(db.execute(statement).all(), columns=["source", "year", "month", "account_id", "amount"])
+
+        # One column per account; a month the account was not reported in
+        # stays NaN rather than counting as zero.
+        series = {}
+        for source, group in frame.groupby("source"):
+            wide = group.pivot_table(index=["year", "month"], columns="account_id", values="amount", aggfunc="sum")
+            series[source] = _monthly(wide.reset_index(), list(wide.columns))
+        return series
+
+
+def _monthly(frame: pd.DataFrame, columns: List) -> pd.DataFrame:
+
+    # A gap-free monthly index so row offsets are calendar offsets.
+    index = pd.PeriodIndex(
+        pd.to_datetime({"year": frame["year"], "month": frame["month"], "day": 1}), freq="M"
+    )
+    monthly = frame[columns].astype("float64").groupby(index).sum(min_count=1)
+    if monthly.empty:
+        return monthly
+    return monthly.reindex(pd.period_range(monthly.index.min(), monthly.index.max(), freq="M"))
+
+
+def _window_median(windows: np.ndarray, counts: np.ndarray) -> np.ndarray:
+
+    # np.nanmedian falls back to a slow path on NaN-heavy 3-D input. NaN
+    # sorts last, so the median of each short window is read off a sort.
+    ordered = np.sort(windows, axis=-1)
+    low = np.take_along_axis(ordered, np.maximum((counts - 1) // 2, 0)[..., None], axis=-1)[..., 0]
+    high = np.take_along_axis(ordered, (counts // 2).clip(max=windows.shape[-1] - 1)[..., None], axis=-1)[..., 0]
+    median = (low + high) / 2
+    median[counts == 0] = np.nan
+    return median
+
+
+def _optional(value: float) -> Optional[float]:
+    return round(float(value), 4) if np.isfinite(value) else None
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional, Tuple, Any
+
+from sqlalchemy.orm import Session
+
+from app.logging_config import get_logger
+from app.models import DataGeneration
+from app.services import metrics
+
+
+logger = get_logger("cache")
+
+
+def get_generation(db: Session) -> Tuple[int, Optional[datetime]]:
+
+    state = db.get(DataGeneration, 1)
+    if state is None:
+        return 0, None
+
+    updated_at = state.updated_at
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return state.generation, updated_at
+
+
+def bump_generation(db: Session) -> int:
+
+    state = db.get(DataGeneration, 1)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    if state is None:
+        state = DataGeneration(id=1, generation=1, updated_at=now)
+        db.add(state)
+    else:
+        state.generation += 1
+        state.updated_at = now
+
+    db.commit()
+    return state.generation
+
+
+def make_etag(generation: int, path: str, query: str) -> str:
+
+    digest = hashlib.sha1(f"{generation}:{path}?{query}".encode("utf-8")).hexdigest()
+    return f'"{generation}-{digest[:16]}"'
+
+
+class ResponseCache:
+
+    # Serialized response bodies keyed on (path, query, generation). Entries
+    # from an older generation are never hit again and age out of the LRU.
+
+    def __init__(self, name: str, max_entries: int = 256):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: Tuple) -> Optional[Any]:
+
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        metrics.cache_requests.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def set(self, key: Tuple, value: Any):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedCache:
+
+    # Same interface as ResponseCache, but the entries live in a SQLite file
+    # that every worker process opens, so what one worker builds is a hit
+    # for all of them. Keys carry the data generation and every worker reads
+    # the generation from the database, so an ingestion invalidates the
+    # cache for all workers at once. Eviction is oldest-first, which keeps
+    # reads free of writes.
+
+    PRUNE_EVERY = 64
+
+    def __init__(self, name: str, path: str, max_entries: int = 256):
+        self.name = name
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _connection(self) -> sqlite3.Connection:
+
+        # One connection per thread; WAL lets readers in every process run
+        # alongside the single writer.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "name TEXT NOT NULL, key TEXT NOT NULL, codec TEXT NOT NULL, value BLOB NOT NULL, "
+                "UNIQUE (name, key))"
+            )
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _digest(key: Tuple) -> str:
+        return hashlib.sha1(json.dumps(key, default=str, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _encode(value: Any) -> Tuple[str, bytes]:
+
+        # JSON where it round-trips; rows with dates or Decimals are
+        # pickled, so a hit returns the same types the query did. The file
+        # is only written by this app's own processes.
+        if isinstance(value, bytes):
+            return "bytes", value
+        try:
+            return "json", json.dumps(value, separators=(",", ":")).encode("utf-8")
+        except (TypeError, ValueError):
+            return "pickle", pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _decode(codec: str, value: bytes) -> Any:
+        if codec == "bytes":
+            return value
+        if codec == "pickle":
+            return pickle.loads(value)
+        return json.loads(value)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+
+        if not self.enabled:
+            return None
+
+        try:
+            row = self._connection().execute(
+                "SELECT codec, value FROM cache_entries WHERE name = ? AND key = ?",
+                (self.name, self._digest(key))
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Shared cache read failed", extra={"cache": self.name, "error": str(e)})
+            row = None
+
+        value = None if row is None else self._decode(*row)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        metrics.cache_requests.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def set(self, key: Tuple, value: Any):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+
+        try:
+            codec, blob = self._encode(value)
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entries (name, key, codec, value) VALUES (?, ?, ?, ?)",
+                (self.name, self._digest(key), codec, blob)
+            )
+            if prune:
+                # A replaced entry gets a new rowid, so rowid order is write
+                # order.
+                connection.execute(
+                    "DELETE FROM cache_entries WHERE name = ? AND rowid <= ("
+                    "SELECT rowid FROM cache_entries WHERE name = ? ORDER BY rowid DESC LIMIT 1 OFFSET ?)",
+                    (self.name, self.name, self.max_entries)
+                )
+        except (sqlite3.Error, pickle.PicklingError, TypeError, ValueError) as e:
+            logger.warning("Shared cache write failed", extra={"cache": self.name, "error": str(e)})
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache_entries WHERE name = ?", (self.name,))
+
+
+def make_cache(name: str, max_entries: int):
+
+    # CACHE_BACKEND=shared keeps the cache in SHARED_CACHE_PATH, for
+    # deployments that run several worker processes.
+    if os.getenv("CACHE_BACKEND", "memory").lower() == "shared":
+        return SharedCache(name, os.getenv("SHARED_CACHE_PATH", "kudwa_cache.sqlite"), max_entries)
+    return ResponseCache(name, max_entries)
+
+
+response_cache = make_cache("response", int(os.getenv("RESPONSE_CACHE_SIZE", "256")))
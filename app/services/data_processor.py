@@ -1,28 +1,145 @@
 
+import calendar
+import hashlib
 import json
-from datetime import datetime, date
+import os
+import threading
+import time
+from datetime import datetime, date, timedelta
 from pathlib import Path
 from typing import List, Dict, Any, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy import Float, case, cast, func, insert, literal, select
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.schema import CreateTable
 
-from app.models import FinancialPeriod, AccountDetail
-from app.database import SessionLocal, init_db
+from app.models import (
+    FinancialPeriod,
+    Account,
+    AccountCategory,
+    AccountClosure,
+    AccountDetail,
+    Anomaly,
+    CanonicalPeriod,
+    Company,
+    DateDimension,
+    Forecast,
+    ForecastModel,
+    PeriodVariance,
+    QuarterlySummary,
+    date_key
+)
+from app.database import (
+    Base,
+    SessionLocal,
+    bulk_insert,
+    company_router,
+    stale_tables,
+    init_db,
+    ingestion_lock,
+    sqlite_file_path,
+    create_bulk_load_engine,
+    swap_database_file
+)
+from app.money import parse_amount, parse_float, stored
+from app.services.anomaly_service import AnomalyDetector
+from app.services.cache_service import bump_generation
+from app.services.forecast_service import ForecastService
+from app.services import metrics
+from app.logging_config import get_logger, configure_logging
+
+
+logger = get_logger("data_processor")
+
+# Tables kept across a snapshot rebuild instead of being reloaded from the
+# source files. Only ingestion writes the generation, and it has to change
+# together with the data, so it moves with the file; jobs and the company
+# registry live in the state database instead.
+PRESERVED_TABLES = ("data_generation",)
+
+VARIANCE_METRICS = ("total_revenue", "total_cogs", "gross_profit", "total_operating_expenses", "net_income")
+
+
+class IngestionProgress:
+    
+    # Shared between the ingestion thread and the /ready endpoint.
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {
+            "ready": True,
+            "status": "idle",
+            "stage": None,
+            "started_at": None,
+            "finished_at": None,
+            "records": {},
+            "error": None
+        }
+    
+    def start(self):
+        with self._lock:
+            self._state.update(
+                ready=False,
+                status="running",
+                stage="loading",
+                started_at=datetime.now().isoformat(),
+                finished_at=None,
+                records={},
+                error=None
+            )
+    
+    def stage(self, stage: str, **records):
+        with self._lock:
+            self._state["stage"] = stage
+            self._state["records"].update(records)
+    
+    def finish(self, error: Optional[str] = None):
+        with self._lock:
+            self._state.update(
+                ready=error is None,
+                status="failed" if error else "complete",
+                stage=None,
+                finished_at=datetime.now().isoformat(),
+                error=error
+            )
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            state = dict(self._state)
+            state["records"] = dict(state["records"])
+            return state
+
+
+ingestion_progress = IngestionProgress()
 
 
 class DataProcessor:
   
-    def __init__(self):
+    def __init__(self, source_precedence: Optional[List[str]] = None,
+                 fiscal_year_start_month: Optional[int] = None):
         self.quickbooks_data = None
         self.rootfi_data = None
+        self.source_precedence = source_precedence or [
+            s.strip() for s in os.getenv("SOURCE_PRECEDENCE", "quickbooks,rootfi").split(",") if s.strip()
+        ]
+        self.fiscal_year_start_month = fiscal_year_start_month or int(os.getenv("FISCAL_YEAR_START_MONTH", "1"))
+        if not 1 <= self.fiscal_year_start_month <= 12:
+            raise ValueError("FISCAL_YEAR_START_MONTH must be between 1 and 12")
+        self.company_id: Optional[int] = None
+        self._accounts: Dict[str, int] = {}
+        self._account_parents: Dict[int, Optional[int]] = {}
+        self._account_base = 0
+        self._new_accounts: List[Dict] = []
+        self._details: List[Dict] = []
+        self._last_period_id = 0
     
     def load_json(self, file_path: str) -> Optional[Dict]:
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-            print(f"Downloaded: {file_path}")
+            logger.info("Loaded data file", extra={"path": str(file_path)})
             return data
         except Exception as e:
-            print(f"Loading error{file_path}: {e}")
+            logger.error("Error loading data file", extra={"path": str(file_path), "error": str(e)})
             return None
     
     def load_all_data(self, data_dir: str = "data"):
@@ -33,10 +150,27 @@ class DataProcessor:
         
         return self.quickbooks_data is not None and self.rootfi_data is not None
     
+    def company_from_data(self) -> int:
+        
+        # QuickBooks exports carry no company; Rootfi records do.
+        for record in (self.rootfi_data or {}).get('data', []):
+            if record.get('rootfi_company_id') is not None:
+                return int(record['rootfi_company_id'])
+        return company_router.default_company_id or 1
+    
     def get_quarter(self, month: int) -> int:
     
         return (month - 1) // 3 + 1
     
+    def get_fiscal_period(self, year: int, month: int) -> tuple:
+        
+        # Fiscal years are named after the calendar year they end in, so with
+        # a July start, July 2023 - June 2024 is fiscal 2024.
+        start = self.fiscal_year_start_month
+        fiscal_month = (month - start) % 12 + 1
+        fiscal_year = year + 1 if start > 1 and month >= start else year
+        return fiscal_year, (fiscal_month - 1) // 3 + 1, fiscal_month
+    
     def parse_month_year(self, col_title: str) -> Optional[tuple]:
        
         try:
@@ -56,22 +190,20 @@ class DataProcessor:
         return None
     
     def safe_float(self, value: Any) -> float:
+        return parse_float(value)
     
-        if value is None or value == "" or value == " ":
-            return 0.0
-        try:
-            return float(str(value).replace(",", ""))
-        except:
-            return 0.0
+    def parse_amount(self, value: Any):
+        
+        # Whole cents with MONEY_STORAGE=cents, so totals derived here
+        # (gross profit, own amounts) are exact too; floats otherwise.
+        return parse_amount(value)
     
     def process_quickbooks(self, db: Session) -> int:
         
         if not self.quickbooks_data:
-            print("No QuickBooks data")
+            logger.warning("No QuickBooks data")
             return 0
         
-        print("\n QuickBooks processing...")
-        
         data = self.quickbooks_data.get('data', {})
         columns = data.get('Columns', {}).get('Column', [])
         rows = data.get('Rows', {}).get('Row', [])
@@ -89,14 +221,15 @@ class DataProcessor:
                     'title': title
                 })
         
-        print(f"Number of months: {len(months_info)}")
+        logger.info("Processing QuickBooks data", extra={"months": len(months_info)})
         
         sections_data = self._extract_quickbooks_sections(rows)
         
-        records_created = 0
+        periods = []
         
         for month_info in months_info:
-            idx = month_info['index']
+            # Section values start after the account column.
+            idx = month_info['index'] - 1
             month = month_info['month']
             year = month_info['year']
             
@@ -111,28 +244,33 @@ class DataProcessor:
             if net_income == 0 and (gross_profit != 0 or total_expenses != 0):
                 net_income = gross_profit - total_expenses + other_income - other_expenses
             
-            period = FinancialPeriod(
+            period_start = date(year, month, 1)
+            period_end = date(year, month, calendar.monthrange(year, month)[1])
+            
+            periods.append(dict(
+                id=self._next_period_id(),
+                company_id=self.company_id,
                 source="quickbooks",
-                period_start=date(year, month, 1),
-                period_end=date(year, month, 28),  
+                period_start=period_start,
+                period_end=period_end,
                 year=year,
                 month=month,
                 quarter=self.get_quarter(month),
-                total_revenue=total_income,
-                total_cogs=total_cogs,
-                gross_profit=gross_profit,
-                total_operating_expenses=total_expenses,
-                other_income=other_income,
-                other_expenses=other_expenses,
-                net_income=net_income
-            )
-            
-            db.add(period)
-            records_created += 1
-        
+                start_date_key=date_key(period_start),
+                end_date_key=date_key(period_end),
+                total_revenue=stored(total_income),
+                total_cogs=stored(total_cogs),
+                gross_profit=stored(gross_profit),
+                total_operating_expenses=stored(total_expenses),
+                other_income=stored(other_income),
+                other_expenses=stored(other_expenses),
+                net_income=stored(net_income)
+            ))
+        
+        bulk_insert(db, FinancialPeriod, periods)
         db.commit()
-        print(f" Created {records_created}")
-        return records_created
+        logger.info("QuickBooks periods created", extra={"records": len(periods)})
+        return len(periods)
     
     def _extract_quickbooks_sections(self, rows: List) -> Dict:
     
@@ -144,7 +282,7 @@ class DataProcessor:
                     col_data = row['Summary'].get('ColData', [])
                     if col_data:
                         name = col_data[0].get('value', '')
-                        values = [self.safe_float(c.get('value', 0)) for c in col_data[1:]]
+                        values = [self.parse_amount(c.get('value', 0)) for c in col_data[1:]]
                         sections[name] = values
                 
                 if 'Rows' in row:
@@ -154,7 +292,7 @@ class DataProcessor:
                     col_data = row['Summary'].get('ColData', [])
                     if col_data:
                         name = col_data[0].get('value', '')
-                        values = [self.safe_float(c.get('value', 0)) for c in col_data[1:]]
+                        values = [self.parse_amount(c.get('value', 0)) for c in col_data[1:]]
                         sections[name] = values
         
         extract_summaries(rows)
@@ -164,7 +302,7 @@ class DataProcessor:
                 col_data = row['Summary'].get('ColData', [])
                 if col_data:
                     name = col_data[0].get('value', '')
-                    values = [self.safe_float(c.get('value', 0)) for c in col_data[1:]]
+                    values = [self.parse_amount(c.get('value', 0)) for c in col_data[1:]]
                     sections[name] = values
             
             if 'ColData' in row and row.get('type') != 'Section':
@@ -172,31 +310,31 @@ class DataProcessor:
                 if col_data:
                     name = col_data[0].get('value', '')
                     if 'Gross Profit' in name or 'Net Income' in name or 'Net Operating' in name:
-                        values = [self.safe_float(c.get('value', 0)) for c in col_data[1:]]
+                        values = [self.parse_amount(c.get('value', 0)) for c in col_data[1:]]
                         sections[name] = values
         
         return sections
     
-    def _get_section_value(self, sections: Dict, name: str, index: int) -> float:
+    def _get_section_value(self, sections: Dict, name: str, index: int):
         
         for key, values in sections.items():
             if name in key:
                 if index < len(values):
                     return values[index]
-        return 0.0
+        return 0
     
     def process_rootfi(self, db: Session) -> int:
        
         if not self.rootfi_data:
-            print("No Rootfi data")
+            logger.warning("No Rootfi data")
             return 0
         
-        print("\n Rootfi processing in progress...")
-        
         records = self.rootfi_data.get('data', [])
-        print(f" Number of periods:{len(records)}")
+        logger.info("Processing Rootfi data", extra={"periods": len(records)})
         
-        records_created = 0
+        periods = []
+        self._new_accounts = []
+        self._details = []
         
         for record in records:
             period_start_str = record.get('period_start', '')
@@ -215,7 +353,8 @@ class DataProcessor:
             
             total_cogs = self._extract_rootfi_total(record.get('cost_of_goods_sold', []))
             
-            gross_profit = record.get('gross_profit', 0) or (total_revenue - total_cogs)
+            gross_profit = record.get('gross_profit', 0)
+            gross_profit = self.parse_amount(gross_profit) if gross_profit else total_revenue - total_cogs
             
             total_expenses = self._extract_rootfi_total(record.get('operating_expenses', []))
             
@@ -225,121 +364,556 @@ class DataProcessor:
             net_income = record.get('net_income')
             if net_income is None:
                 net_income = gross_profit - total_expenses + other_income - other_expenses
+            else:
+                net_income = self.parse_amount(net_income)
             
-            period = FinancialPeriod(
+            period = dict(
+                id=self._next_period_id(),
+                company_id=self.company_id,
                 source="rootfi",
                 period_start=period_start,
                 period_end=period_end,
                 year=year,
                 month=month,
                 quarter=self.get_quarter(month),
-                total_revenue=self.safe_float(total_revenue),
-                total_cogs=self.safe_float(total_cogs),
-                gross_profit=self.safe_float(gross_profit),
-                total_operating_expenses=self.safe_float(total_expenses),
-                other_income=self.safe_float(other_income),
-                other_expenses=self.safe_float(other_expenses),
-                net_income=self.safe_float(net_income)
+                start_date_key=date_key(period_start),
+                end_date_key=date_key(period_end),
+                total_revenue=stored(total_revenue),
+                total_cogs=stored(total_cogs),
+                gross_profit=stored(gross_profit),
+                total_operating_expenses=stored(total_expenses),
+                other_income=stored(other_income),
+                other_expenses=stored(other_expenses),
+                net_income=stored(net_income)
             )
-            
-            db.add(period)
-            db.flush()  
-            records_created += 1
+            periods.append(period)
             
             self._add_rootfi_account_details(db, period, record)
         
+        # Ids are assigned up front, so each table goes in as one batch.
+        bulk_insert(db, Account, self._new_accounts)
+        bulk_insert(db, FinancialPeriod, periods)
+        bulk_insert(db, AccountDetail, self._details)
         db.commit()
-        print(f" Created {records_created}")
-        return records_created
+        logger.info("Rootfi periods created", extra={"records": len(periods)})
+        return len(periods)
+    
+    def _next_period_id(self) -> int:
+        self._last_period_id += 1
+        return self._last_period_id
     
-    def _extract_rootfi_total(self, items: List) -> float:
-        total = 0.0
-        for item in items:
-            value = item.get('value', 0)
-            total += self.safe_float(value)
-        return total
+    def _extract_rootfi_total(self, items: List):
+        return sum(self.parse_amount(item.get('value', 0)) for item in items)
     
-    def _add_rootfi_account_details(self, db: Session, period: FinancialPeriod, record: Dict):
+    def _add_rootfi_account_details(self, db: Session, period: Dict, record: Dict):
         
         for item in record.get('revenue', []):
-            self._add_account_recursive(db, period, item, 'income', None)
+            self._add_account_recursive(db, period, item, AccountCategory.INCOME, None)
         
         for item in record.get('cost_of_goods_sold', []):
-            self._add_account_recursive(db, period, item, 'cogs', None)
+            self._add_account_recursive(db, period, item, AccountCategory.COGS, None)
         
         for item in record.get('operating_expenses', []):
-            self._add_account_recursive(db, period, item, 'expense', None)
+            self._add_account_recursive(db, period, item, AccountCategory.EXPENSE, None)
     
-    def _add_account_recursive(self, db: Session, period: FinancialPeriod, 
-                                item: Dict, category: str, parent: Optional[str]):
+    def _add_account_recursive(self, db: Session, period: Dict,
+                                item: Dict, category: AccountCategory, parent_id: Optional[int]):
         
         name = item.get('name', 'Unknown')
-        value = self.safe_float(item.get('value', 0))
-        account_id = item.get('account_id')
-        
-        detail = AccountDetail(
-            period_id=period.id,
-            category=category,
-            account_name=name,
-            parent_account=parent,
-            amount=value,
-            account_id=account_id
+        value = self.parse_amount(item.get('value', 0))
+        account_id = self._intern_account(db, name, item.get('account_id'), category, parent_id)
+        
+        detail = dict(
+            company_id=self.company_id,
+            period_id=period["id"],
+            account_id=account_id,
+            category_id=int(category),
+            amount=stored(value)
         )
-        db.add(detail)
+        self._details.append(detail)
         
+        children_total = 0
         for sub_item in item.get('line_items', []):
-            self._add_account_recursive(db, period, sub_item, category, name)
+            children_total += self._add_account_recursive(db, period, sub_item, category, account_id)
+        detail["own_amount"] = stored(value - children_total)
+        
+        return value
     
+    def _intern_account(self, db: Session, name: str, external_id: Optional[str],
+                        category: AccountCategory, parent_id: Optional[int]) -> int:
+        
+        # Every period repeats the same chart of accounts, so after the first
+        # period each line resolves to its integer id with one dict lookup.
+        # Ids continue after other companies' accounts in the same file.
+        if external_id:
+            key = f"rootfi:{external_id}"
+        else:
+            raw = f"{int(category)}|{parent_id or ''}|{name}"
+            key = "hash:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+        
+        account_id = self._accounts.get(key)
+        if account_id is None:
+            account_id = self._account_base + len(self._accounts) + 1
+            self._accounts[key] = account_id
+            self._account_parents[account_id] = parent_id
+            self._new_accounts.append(dict(
+                id=account_id,
+                company_id=self.company_id,
+                account_key=key,
+                external_id=external_id,
+                name=name,
+                parent_id=parent_id,
+                level=self._account_level(account_id),
+                category_id=int(category)
+            ))
+        return account_id
     
-    def process_all(self, data_dir: str = "data") -> Dict:
+    def _account_level(self, account_id: int) -> int:
+        
+        level = 0
+        parent_id = self._account_parents.get(account_id)
+        while parent_id is not None:
+            level += 1
+            parent_id = self._account_parents.get(parent_id)
+        return level
+    
+    def build_account_closure(self, db: Session):
+        
+        # Every account paired with itself and each of its ancestors, so a
+        # subtree total at any depth is one join on ancestor_id.
+        db.query(AccountClosure).delete()
+        
+        parents = dict(db.query(Account.id, Account.parent_id).all())
+        rows = []
+        for account_id in parents:
+            ancestor_id, depth = account_id, 0
+            while ancestor_id is not None:
+                rows.append({
+                    "company_id": self.company_id,
+                    "ancestor_id": ancestor_id,
+                    "descendant_id": account_id,
+                    "depth": depth
+                })
+                ancestor_id, depth = parents.get(ancestor_id), depth + 1
         
-        print("\n" + "="*60)
-        print("Starting data processing")
-        print("="*60)
+        if rows:
+            db.execute(insert(AccountClosure), rows)
+        db.commit()
+    
+    
+    def build_date_dimension(self, db: Session):
         
-        if not self.load_all_data(data_dir):
-            return {"success": False, "error": "Data loading failed"}
+        # Every day of each calendar year the loaded periods touch. The
+        # calendar is shared, so it spans every company's periods.
+        db.query(DateDimension).delete()
         
+        first, last = db.query(
+            func.min(FinancialPeriod.period_start), func.max(FinancialPeriod.period_end)
+        ).execution_options(all_companies=True).one()
+        if first is None:
+            db.commit()
+            return
+        
+        rows = []
+        day = date(first.year, 1, 1)
+        while day <= date(last.year, 12, 31):
+            month_end = date(day.year, day.month, calendar.monthrange(day.year, day.month)[1])
+            fiscal_year, fiscal_quarter, fiscal_month = self.get_fiscal_period(day.year, day.month)
+            iso_year, iso_week, iso_weekday = day.isocalendar()
+            rows.append({
+                "date_key": date_key(day),
+                "date": day,
+                "year": day.year,
+                "month": day.month,
+                "day": day.day,
+                "quarter": self.get_quarter(day.month),
+                "month_name": calendar.month_name[day.month],
+                "day_of_week": iso_weekday,
+                "month_end": month_end,
+                "is_month_end": day == month_end,
+                "fiscal_year": fiscal_year,
+                "fiscal_quarter": fiscal_quarter,
+                "fiscal_month": fiscal_month,
+                "iso_year": iso_year,
+                "iso_week": iso_week
+            })
+            day += timedelta(days=1)
+        
+        db.execute(insert(DateDimension), rows)
+        db.commit()
+    
+    def build_canonical_periods(self, db: Session):
+        
+        # Keep the highest-precedence source for every calendar month, ranked
+        # in SQL so the whole table is one INSERT ... SELECT. The session only
+        # deletes this company's rows; the INSERT ... SELECTs filter on it.
+        db.query(PeriodVariance).delete()
+        db.query(CanonicalPeriod).delete()
+        
+        rank = case(
+            {source: i for i, source in enumerate(self.source_precedence)},
+            value=FinancialPeriod.source,
+            else_=len(self.source_precedence)
+        )
+        partition = (FinancialPeriod.year, FinancialPeriod.month)
+        ranked = select(
+            FinancialPeriod,
+            func.row_number().over(
+                partition_by=partition,
+                order_by=(rank, FinancialPeriod.source, FinancialPeriod.id)
+            ).label("source_rank"),
+            func.count().over(partition_by=partition).label("source_count")
+        ).where(FinancialPeriod.company_id == self.company_id).subquery()
+        
+        columns = [c.name for c in CanonicalPeriod.__table__.columns if c.name not in ("id", "period_id", "source_count")]
+        db.execute(insert(CanonicalPeriod).from_select(
+            ["period_id", *columns, "source_count"],
+            select(
+                ranked.c.id,
+                *(ranked.c[name] for name in columns),
+                ranked.c.source_count
+            ).where(ranked.c.source_rank == 1)
+        ))
+        
+        other = aliased(FinancialPeriod)
+        for metric in VARIANCE_METRICS:
+            primary_value = getattr(CanonicalPeriod, metric)
+            secondary_value = getattr(other, metric)
+            difference = secondary_value - primary_value
+            db.execute(insert(PeriodVariance).from_select(
+                ["company_id", "year", "month", "metric", "primary_source", "secondary_source",
+                 "primary_value", "secondary_value", "difference", "difference_pct"],
+                select(
+                    CanonicalPeriod.company_id,
+                    CanonicalPeriod.year,
+                    CanonicalPeriod.month,
+                    literal(metric),
+                    CanonicalPeriod.source,
+                    other.source,
+                    primary_value,
+                    secondary_value,
+                    difference,
+                    case(
+                        (primary_value != 0, cast(difference, Float) / func.abs(primary_value) * 100),
+                        else_=None
+                    )
+                ).join(
+                    other,
+                    (other.company_id == CanonicalPeriod.company_id)
+                    & (other.year == CanonicalPeriod.year)
+                    & (other.month == CanonicalPeriod.month)
+                    & (other.id != CanonicalPeriod.period_id)
+                ).where(CanonicalPeriod.company_id == self.company_id, CanonicalPeriod.source_count > 1)
+            ))
         
-        init_db()
+        db.commit()
         
-        db = SessionLocal()
+        overlapping = db.query(func.count(CanonicalPeriod.id)).filter(CanonicalPeriod.source_count > 1).scalar()
+        logger.info("Periods reconciled", extra={
+            "precedence": self.source_precedence,
+            "months": db.query(func.count(CanonicalPeriod.id)).scalar(),
+            "overlapping_months": overlapping
+        })
+    
+    def build_rollups(self, db: Session):
+        
+        db.query(QuarterlySummary).delete()
+        
+        columns = (
+            FinancialPeriod.company_id,
+            FinancialPeriod.source,
+            FinancialPeriod.year,
+            FinancialPeriod.quarter,
+            func.sum(FinancialPeriod.total_revenue),
+            func.sum(FinancialPeriod.total_cogs),
+            func.sum(FinancialPeriod.gross_profit),
+            func.sum(FinancialPeriod.total_operating_expenses),
+            func.sum(FinancialPeriod.net_income),
+            func.count(FinancialPeriod.id)
+        )
+        rollup = select(*columns).where(FinancialPeriod.company_id == self.company_id).group_by(
+            FinancialPeriod.company_id, FinancialPeriod.source, FinancialPeriod.year, FinancialPeriod.quarter
+        )
+        db.execute(insert(QuarterlySummary).from_select(
+            ["company_id", "source", "year", "quarter", "total_revenue", "total_cogs", "gross_profit",
+             "total_operating_expenses", "net_income", "months"],
+            rollup
+        ))
+        db.commit()
+    
+    def backfill_derived_tables(self, db: Session, company_id: int):
+        
+        # Tables derived from financial_periods that were added after the
+        # data was loaded are built from what is already there. db must be
+        # a session opened for company_id.
+        self.company_id = company_id
+        builders = (
+            (DateDimension, self.build_date_dimension),
+            (CanonicalPeriod, self.build_canonical_periods),
+            (QuarterlySummary, self.build_rollups),
+            (Anomaly, lambda db: AnomalyDetector.from_env().build(db, company_id)),
+            (ForecastModel, lambda db: ForecastService.from_env().build(db, company_id)),
+        )
+        for model, build in builders:
+            if db.query(model).first() is None:
+                logger.info("Backfilling derived table", extra={"table": model.__tablename__})
+                build(db)
+    
+    def _ingest(self, db: Session) -> Dict:
+        
+        self._accounts = {}
+        self._account_parents = {}
+        self._account_base = db.query(func.max(Account.id)).execution_options(all_companies=True).scalar() or 0
+        self._last_period_id = db.query(func.max(FinancialPeriod.id)).execution_options(all_companies=True).scalar() or 0
+        
+        ingestion_progress.stage("quickbooks")
+        start = time.perf_counter()
+        qb_count = self.process_quickbooks(db)
+        metrics.record_ingestion("quickbooks", qb_count, time.perf_counter() - start)
+        
+        ingestion_progress.stage("rootfi", quickbooks=qb_count)
+        start = time.perf_counter()
+        rootfi_count = self.process_rootfi(db)
+        metrics.record_ingestion("rootfi", rootfi_count, time.perf_counter() - start)
+        
+        ingestion_progress.stage("calendar", rootfi=rootfi_count)
+        self.build_date_dimension(db)
+        
+        ingestion_progress.stage("reconciling")
+        self.build_canonical_periods(db)
+        
+        ingestion_progress.stage("rollups")
+        self.build_account_closure(db)
+        self.build_rollups(db)
+        
+        ingestion_progress.stage("anomalies")
+        start = time.perf_counter()
+        anomaly_count = AnomalyDetector.from_env().build(db, self.company_id)
+        logger.info("Anomaly detection finished", extra={
+            "anomalies": anomaly_count, "seconds": round(time.perf_counter() - start, 3)
+        })
+        
+        ingestion_progress.stage("forecasting")
+        start = time.perf_counter()
+        model_count = ForecastService.from_env().build(db, self.company_id)
+        logger.info("Forecast fitting finished", extra={
+            "models": model_count, "seconds": round(time.perf_counter() - start, 3)
+        })
+        
+        return {
+            "quickbooks_records": qb_count,
+            "rootfi_records": rootfi_count,
+            "total_records": qb_count + rootfi_count
+        }
+    
+    def _register(self, db: Session, periods: int):
         
+        db.merge(Company(id=self.company_id, periods=periods, loaded_at=datetime.now()))
+        db.commit()
+    
+    def _carry_over(self, conn, table: str, where: str = "", params: tuple = (), complete: bool = False) -> bool:
+        
+        # Copy a table from the attached live file into the new one, with
+        # the columns both layouts have. complete=True copies nothing unless
+        # the live table has every column. False when nothing was copied.
+        live_columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA live.table_info({table})")}
+        model_columns = [c.name for c in Base.metadata.tables[table].columns]
+        shared = [name for name in model_columns if name in live_columns]
+        if not shared or (complete and len(shared) < len(model_columns)):
+            return False
+        columns = ", ".join(shared)
+        conn.exec_driver_sql(
+            f"INSERT INTO main.{table} ({columns}) SELECT {columns} FROM live.{table} {where}", params
+        )
+        return True
+    
+    def _process_in_place(self) -> Dict:
+        
+        target = company_router.engine_for(self.company_id)
+        stale = stale_tables(target)
+        if stale:
+            logger.warning("Recreating tables with an outdated layout", extra={"tables": [t.name for t in stale]})
+            Base.metadata.drop_all(bind=target, tables=stale)
+        init_db(target)
+        
+        db = company_router.session(self.company_id)
         try:
+            if stale and not company_router.sharded:
+                # Other companies' rows went with the old tables.
+                db.query(Company).delete()
+            
+            # The session only deletes this company's rows.
+            db.query(Forecast).delete()
+            db.query(ForecastModel).delete()
+            db.query(Anomaly).delete()
+            db.query(QuarterlySummary).delete()
+            db.query(PeriodVariance).delete()
+            db.query(CanonicalPeriod).delete()
             db.query(AccountDetail).delete()
+            db.query(AccountClosure).delete()
+            db.query(Account).delete()
             db.query(FinancialPeriod).delete()
             db.commit()
-            print("\n Old data has been deleted")
+            logger.info("Old data has been deleted", extra={"company_id": self.company_id})
             
-            qb_count = self.process_quickbooks(db)
+            counts = self._ingest(db)
             
-            rootfi_count = self.process_rootfi(db)
+            ingestion_progress.stage("finalizing")
+            if not company_router.sharded:
+                self._register(db, counts["total_records"])
+            counts["generation"] = bump_generation(db)
+            return counts
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    def _process_snapshot(self) -> Dict:
+        
+        # Build a complete database next to the live file and swap it in, so
+        # readers never see a half-loaded dataset or wait on the write lock.
+        # Without sharding the file holds every company, so the others'
+        # rows are copied over first; a company's own shard is rebuilt alone.
+        target = company_router.engine_for(self.company_id)
+        live_path = sqlite_file_path(target)
+        live_exists = os.path.exists(live_path)
+        # One shadow path is enough: process_all holds ingestion_lock, so a
+        # shadow found here is left over from a build that died.
+        shadow_path = f"{live_path}.next"
+        for leftover in (shadow_path, f"{shadow_path}-journal"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        
+        shadow = create_bulk_load_engine(shadow_path)
+        try:
+            # Tables first, indexes after the bulk load.
+            with shadow.begin() as conn:
+                for table in Base.metadata.sorted_tables:
+                    conn.execute(CreateTable(table))
             
-            print("\n" + "="*60)
-            print("Processing complete!")
-            print(f" QuickBooks: {qb_count} ")
-            print(f" Rootfi: {rootfi_count} ")
-            print(f" Sum: {qb_count + rootfi_count} ")
-            print("="*60)
+            others_kept = True
+            if live_exists and not company_router.sharded:
+                ingestion_progress.stage("copying")
+                stale = {table.name for table in stale_tables(target)}
+                with shadow.connect() as conn:
+                    conn.exec_driver_sql("ATTACH DATABASE ? AS live", (live_path,))
+                    for table in Base.metadata.sorted_tables:
+                        if table.name in stale:
+                            others_kept = False
+                        elif "company_id" in table.columns:
+                            others_kept &= self._carry_over(
+                                conn, table.name, "WHERE company_id != ?", (self.company_id,), complete=True
+                            )
+                    conn.commit()
+                    conn.exec_driver_sql("DETACH DATABASE live")
             
-            return {
-                "success": True,
-                "quickbooks_records": qb_count,
-                "rootfi_records": rootfi_count,
-                "total_records": qb_count + rootfi_count
-            }
+            db = Session(bind=shadow, info={"company_id": self.company_id})
+            try:
+                counts = self._ingest(db)
+            finally:
+                db.close()
             
+            ingestion_progress.stage("indexing")
+            with shadow.begin() as conn:
+                for table in Base.metadata.sorted_tables:
+                    for index in table.indexes:
+                        index.create(conn)
+            
+            ingestion_progress.stage("finalizing")
+            with shadow.connect() as conn:
+                # Carry over state that lives in the same file but is not
+                # rebuilt from the source data.
+                if live_exists:
+                    conn.exec_driver_sql("ATTACH DATABASE ? AS live", (live_path,))
+                    for table in PRESERVED_TABLES:
+                        self._carry_over(conn, table)
+                    conn.commit()
+                    conn.exec_driver_sql("DETACH DATABASE live")
+                conn.exec_driver_sql("ANALYZE")
+                conn.exec_driver_sql("PRAGMA journal_mode=DELETE")
+            
+            db = Session(bind=shadow, info={"company_id": self.company_id})
+            try:
+                counts["generation"] = bump_generation(db)
+            finally:
+                db.close()
+        except Exception:
+            shadow.dispose()
+            if os.path.exists(shadow_path):
+                os.remove(shadow_path)
+            raise
+        
+        shadow.dispose()
+        swap_database_file(shadow_path, target)
+        
+        if not company_router.sharded:
+            # Registered once its rows are live.
+            with SessionLocal() as db:
+                if not others_kept:
+                    # Other companies' rows had an older layout and went with the old file.
+                    db.query(Company).delete()
+                self._register(db, counts["total_records"])
+        return counts
+    
+    def process_all(self, data_dir: str = "data", mode: Optional[str] = None,
+                    company_id: Optional[int] = None, if_missing: bool = False) -> Dict:
+        
+        # company_id defaults to the rootfi_company_id in the Rootfi export.
+        # Only that company's rows are replaced. if_missing skips companies
+        # that are already loaded, e.g. by another worker at startup.
+        mode = mode or os.getenv("INGEST_MODE", "snapshot")
+        if mode == "snapshot" and sqlite_file_path() is None:
+            mode = "in_place"
+        
+        logger.info("Starting data processing", extra={"data_dir": str(data_dir), "mode": mode})
+        ingestion_progress.start()
+        
+        if not self.load_all_data(data_dir):
+            ingestion_progress.finish(error="Data loading failed")
+            return {"success": False, "error": "Data loading failed"}
+        
+        self.company_id = company_id if company_id is not None else self.company_from_data()
+        
+        try:
+            with ingestion_lock():
+                init_db()
+                if if_missing and not stale_tables() and self.company_id in company_router.company_ids():
+                    ingestion_progress.finish()
+                    logger.info("Data already loaded; skipped", extra={"company_id": self.company_id})
+                    return {"success": True, "skipped": True, "company_id": self.company_id}
+                
+                if mode == "snapshot":
+                    counts = self._process_snapshot()
+                else:
+                    counts = self._process_in_place()
+                
+                if company_router.sharded:
+                    # Registered only once the shard is complete; the main
+                    # generation moves too, for the job queue.
+                    with SessionLocal() as db:
+                        self._register(db, counts["total_records"])
+                        bump_generation(db)
         except Exception as e:
-            db.rollback()
-            print(f"\n Error {e}")
+            logger.exception("Data processing failed")
+            ingestion_progress.finish(error=str(e))
             return {"success": False, "error": str(e)}
         
-        finally:
-            db.close()
-
-
+        ingestion_progress.finish()
+        logger.info("Processing complete", extra={"mode": mode, "company_id": self.company_id, **counts})
+        
+        return {"success": True, "mode": mode, "company_id": self.company_id, **counts}
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Load one company's QuickBooks and Rootfi exports")
+    parser.add_argument("data_dir", nargs="?", default="data")
+    parser.add_argument("--mode", choices=("snapshot", "in_place"), help="Defaults to INGEST_MODE")
+    parser.add_argument("--company-id", type=int, help="Defaults to rootfi_company_id in data_set_2.json")
+    args = parser.parse_args()
+    
+    configure_logging(fmt="text")
     processor = DataProcessor()
-    result = processor.process_all()
+    result = processor.process_all(args.data_dir, args.mode, args.company_id)
     print(f"\n The Result {result}")
\ No newline at end of file
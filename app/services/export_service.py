@@ -0,0 +1,366 @@
+import csv
+import io
+import os
+from contextlib import nullcontext
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple, Any
+
+from sqlalchemy import select, text, case
+from sqlalchemy.orm import aliased
+from sqlalchemy import Integer, Float, Date, String
+
+from app.database import begin_read_snapshot, company_router
+from app.money import Money
+from app.models import FinancialPeriod, Account, AccountCategory, AccountDetail
+
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class ExportFormatError(ValueError):
+    pass
+
+
+class _ChunkSink:
+
+    # Write-only file object handed to pyarrow writers. Bytes are drained
+    # after every batch so only one chunk is ever held in memory, while
+    # tell() keeps counting so parquet footer offsets stay correct.
+
+    def __init__(self):
+        self._buffer = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._buffer.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def drain(self) -> bytes:
+        data = b"".join(self._buffer)
+        self._buffer = []
+        return data
+
+
+class ExportService:
+
+    def __init__(self, chunk_size: int = 5000, max_sql_rows: int = 100_000):
+        self.chunk_size = chunk_size
+        # Row cap for exports of generated SQL; table exports are unbounded.
+        self.max_sql_rows = max_sql_rows
+
+    @classmethod
+    def from_env(cls) -> "ExportService":
+        return cls(max_sql_rows=int(os.getenv("EXPORT_MAX_ROWS", "100000")))
+
+    def periods_statement(self, source: Optional[str] = None, year: Optional[int] = None,
+                          quarter: Optional[int] = None, company_id: Optional[int] = None):
+
+        statement = select(*FinancialPeriod.__table__.columns)
+
+        # Table columns are not scoped by the session, so filter explicitly.
+        if company_id is not None:
+            statement = statement.where(FinancialPeriod.company_id == company_id)
+        if source:
+            statement = statement.where(FinancialPeriod.source == source)
+        if year:
+            statement = statement.where(FinancialPeriod.year == year)
+        if quarter:
+            statement = statement.where(FinancialPeriod.quarter == quarter)
+
+        return statement.order_by(FinancialPeriod.year, FinancialPeriod.month, FinancialPeriod.id)
+
+    def accounts_statement(self, source: Optional[str] = None, year: Optional[int] = None,
+                           quarter: Optional[int] = None, category: Optional[str] = None,
+                           company_id: Optional[int] = None):
+
+        # Same flat layout as before the accounts dimension: names and the
+        # category label are joined back in.
+        parent = aliased(Account)
+        category_label = case(
+            {int(c): c.label for c in AccountCategory},
+            value=AccountDetail.category_id
+        ).label("category")
+
+        statement = select(
+            AccountDetail.id,
+            AccountDetail.period_id,
+            category_label,
+            Account.name.label("account_name"),
+            parent.name.label("parent_account"),
+            AccountDetail.amount,
+            Account.external_id.label("account_id"),
+            FinancialPeriod.source,
+            FinancialPeriod.year,
+            FinancialPeriod.month,
+            FinancialPeriod.quarter
+        ).join(
+            FinancialPeriod, AccountDetail.period_id == FinancialPeriod.id
+        ).join(
+            Account, AccountDetail.account_id == Account.id
+        ).outerjoin(
+            parent, Account.parent_id == parent.id
+        )
+
+        if company_id is not None:
+            statement = statement.where(AccountDetail.company_id == company_id)
+        if source:
+            statement = statement.where(FinancialPeriod.source == source)
+        if year:
+            statement = statement.where(FinancialPeriod.year == year)
+        if quarter:
+            statement = statement.where(FinancialPeriod.quarter == quarter)
+        if category:
+            try:
+                category_id = int(AccountCategory.from_label(category))
+            except KeyError:
+                # Unknown categories match nothing, as with the old text column.
+                category_id = -1
+            statement = statement.where(AccountDetail.category_id == category_id)
+
+        return statement.order_by(AccountDetail.period_id, AccountDetail.id)
+
+    def sql_statement(self, sql: str):
+        return text(sql)
+
+    def stream(self, statement, fmt: str, company_id: Optional[int] = None, guard=None) -> Iterator[bytes]:
+
+        # guard(db) returns a context manager every database call runs
+        # under, e.g. the query governor's deadline.
+
+        if fmt not in EXPORT_FORMATS:
+            raise ExportFormatError(
+                f"Unsupported export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}"
+            )
+
+        if fmt == "csv":
+            return self._stream_csv(self._iter_chunks(statement, company_id, guard=guard))
+
+        self._require_pyarrow()
+
+        # An Arrow or Parquet schema is fixed once written, so columns
+        # without a declared type (ad-hoc SQL) are typed from every row
+        # before the first byte goes out.
+        declared = self._declared_types(statement)
+        untyped = not declared or None in declared.values()
+        chunks = self._iter_chunks(statement, company_id, infer_types=untyped, guard=guard)
+        if fmt == "arrow":
+            return self._stream_arrow(chunks, declared)
+        return self._stream_parquet(chunks, declared)
+
+    def _require_pyarrow(self):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ExportFormatError("Arrow and Parquet exports require the 'pyarrow' package")
+
+    def _iter_chunks(self, statement, company_id: Optional[int] = None,
+                     infer_types: bool = False, guard=None) -> Iterator[Tuple[List[str], List[tuple], Dict[str, Any]]]:
+
+        # Server-side cursor: rows are pulled from the driver chunk by chunk
+        # instead of being materialized with fetchall(). infer_types runs
+        # the statement twice in one read snapshot: the first pass keeps
+        # only the widest Arrow type seen per column, the second streams.
+        db = company_router.session(company_id)
+        try:
+            inferred = {}
+            if infer_types:
+                begin_read_snapshot(db)
+                kinds = {}
+                for columns, rows in self._partitions(db, statement, guard):
+                    for index, name in enumerate(columns):
+                        for row in rows:
+                            kinds[name] = self._widen(kinds.get(name), row[index])
+                inferred = {name: self._kind_type(kind) for name, kind in kinds.items()}
+
+            for columns, rows in self._partitions(db, statement, guard):
+                yield columns, rows, inferred
+        finally:
+            db.close()
+
+    def _partitions(self, db, statement, guard=None) -> Iterator[Tuple[List[str], List[tuple]]]:
+
+        # The guard is entered per fetch, not around the whole generator,
+        # so time spent waiting on a slow client is not counted.
+        guard = guard or (lambda db: nullcontext())
+        with guard(db):
+            result = db.execute(
+                statement.execution_options(stream_results=True, yield_per=self.chunk_size)
+            )
+        columns = list(result.keys())
+
+        empty = True
+        while True:
+            with guard(db):
+                rows = result.fetchmany(self.chunk_size)
+            if not rows:
+                break
+            empty = False
+            yield columns, [tuple(row) for row in rows]
+
+        if empty:
+            yield columns, []
+
+    def _stream_csv(self, chunks) -> Iterator[bytes]:
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header_written = False
+
+        for columns, rows, _ in chunks:
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            writer.writerows(rows)
+
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    def _stream_arrow(self, chunks, declared: Dict[str, Any]) -> Iterator[bytes]:
+
+        import pyarrow as pa
+
+        sink = _ChunkSink()
+        writer = None
+
+        for columns, rows, inferred in chunks:
+            if writer is None:
+                schema = self._arrow_schema(columns, declared, inferred)
+                writer = pa.ipc.new_stream(sink, schema)
+
+            if rows:
+                writer.write_batch(self._record_batch(schema, rows))
+            yield sink.drain()
+
+        writer.close()
+        yield sink.drain()
+
+    def _stream_parquet(self, chunks, declared: Dict[str, Any]) -> Iterator[bytes]:
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        sink = _ChunkSink()
+        writer = None
+
+        for columns, rows, inferred in chunks:
+            if writer is None:
+                schema = self._arrow_schema(columns, declared, inferred)
+                writer = pq.ParquetWriter(sink, schema)
+
+            # One row group per chunk keeps the writer's memory bounded.
+            if rows:
+                writer.write_table(pa.Table.from_batches([self._record_batch(schema, rows)]))
+            yield sink.drain()
+
+        writer.close()
+        yield sink.drain()
+
+    def _declared_types(self, statement) -> Dict[str, Any]:
+
+        # Arrow type per selected column; None where the column type says
+        # nothing useful. Empty for text() statements.
+        return {
+            column.key: self._arrow_type(column.type)
+            for column in getattr(statement, "selected_columns", [])
+        }
+
+    def _arrow_schema(self, columns: List[str], declared: Dict[str, Any], inferred: Dict[str, Any]):
+
+        import pyarrow as pa
+
+        return pa.schema([
+            pa.field(name, declared.get(name) or inferred.get(name) or pa.string())
+            for name in columns
+        ])
+
+    def _arrow_type(self, column_type):
+
+        import pyarrow as pa
+
+        if isinstance(column_type, Money):
+            # Read back as amounts, whatever the storage.
+            return pa.float64()
+        if isinstance(column_type, Integer):
+            return pa.int64()
+        if isinstance(column_type, Float):
+            return pa.float64()
+        if isinstance(column_type, Date):
+            return pa.date32()
+        if isinstance(column_type, String):
+            return pa.string()
+        return None
+
+    @staticmethod
+    def _widen(kind: Optional[str], value: Any) -> Optional[str]:
+
+        # Narrowest kind that holds both: ints widen to float, any other
+        # mix (and anything unrecognised) to string.
+        if value is None:
+            return kind
+        if isinstance(value, bool):
+            seen = "bool"
+        elif isinstance(value, int):
+            seen = "int"
+        elif isinstance(value, float):
+            seen = "float"
+        elif isinstance(value, datetime):
+            seen = "timestamp"
+        elif isinstance(value, date):
+            seen = "date"
+        else:
+            seen = "string"
+
+        if kind is None or kind == seen:
+            return seen
+        if {kind, seen} == {"int", "float"}:
+            return "float"
+        return "string"
+
+    @staticmethod
+    def _kind_type(kind: Optional[str]):
+
+        import pyarrow as pa
+
+        return {
+            "bool": pa.bool_(),
+            "int": pa.int64(),
+            "float": pa.float64(),
+            "timestamp": pa.timestamp("us"),
+            "date": pa.date32(),
+        }.get(kind, pa.string())
+
+    def _record_batch(self, schema, rows: List[tuple]):
+
+        import pyarrow as pa
+
+        arrays = []
+        for index, field in enumerate(schema):
+            values = [row[index] for row in rows]
+            if pa.types.is_string(field.type):
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(pa.array(values, type=field.type))
+
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
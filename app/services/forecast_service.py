@@ -0,0 +1,321 @@
+import itertools
+import json
+import os
+import warnings
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app.models import FinancialPeriod, Forecast, ForecastModel
+from app.services.analytics_service import METRIC_COLUMNS, AnalyticsError, NoAnalyticsData, load_monthly
+from app.logging_config import get_logger
+
+
+logger = get_logger("forecast_service")
+
+SEASON = 12
+
+# Smoothing grid searched for every series at once. beta is the Holt trend
+# coefficient (applied as alpha * beta), phi damps the trend.
+ALPHAS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9)
+BETAS = (0.0, 0.1, 0.3)
+GAMMAS = (0.0, 0.1, 0.3)
+PHIS = (0.9, 0.98)
+
+Z_SCORES = {80: 1.2816, 95: 1.9600}
+
+
+class ForecastService:
+
+    def __init__(self, horizon: int = 12, min_observations: int = 6):
+        self.horizon = horizon
+        self.min_observations = min_observations
+
+    @classmethod
+    def from_env(cls) -> "ForecastService":
+        return cls(horizon=int(os.getenv("FORECAST_HORIZON", "12")))
+
+    def build(self, db: Session, company_id: int) -> int:
+
+        # Refit every series of the company from scratch; db is a session
+        # opened for company_id. The fitted parameters live in the same
+        # database file as the data, so they are replaced exactly when an
+        # ingestion produces a new generation.
+        db.query(Forecast).delete()
+        db.query(ForecastModel).delete()
+
+        keys, series = self._series(db)
+        models = []
+        for (source, metric), fit in zip(keys, fit_series(series, self.min_observations)):
+            if fit is not None:
+                models.append({"company_id": company_id, "source": source, "metric": metric, **fit})
+
+        forecasts = []
+        for model in models:
+            periods, point, sigmas = project(model, self.horizon)
+            for period, value, sigma in zip(periods, point, sigmas):
+                forecasts.append({
+                    "company_id": company_id,
+                    "source": model["source"],
+                    "metric": model["metric"],
+                    "year": period.year,
+                    "month": period.month,
+                    "quarter": period.quarter,
+                    "forecast": round(float(value), 2),
+                    **{f"{bound}_{level}": round(float(value + sign * z * sigma), 2)
+                       for level, z in Z_SCORES.items() for bound, sign in (("lower", -1), ("upper", 1))}
+                })
+
+        if models:
+            db.execute(insert(ForecastModel), [{**m, "seasonal": json.dumps(m["seasonal"])} for m in models])
+        if forecasts:
+            db.execute(insert(Forecast), forecasts)
+        db.commit()
+
+        logger.info("Forecast models fitted", extra={"models": len(models), "series": len(series)})
+        return len(models)
+
+    def forecast(self, db: Session, source: Optional[str] = None, metric: Optional[str] = None,
+                 horizon: int = 12, granularity: str = "month", level: int = 80) -> Dict[str, Any]:
+
+        if granularity not in ("month", "quarter"):
+            raise AnalyticsError("granularity must be one of: month, quarter")
+        if metric and metric not in METRIC_COLUMNS:
+            raise AnalyticsError(f"metric must be one of: {', '.join(METRIC_COLUMNS)}")
+        if level not in Z_SCORES:
+            raise AnalyticsError(f"level must be one of: {', '.join(str(z) for z in Z_SCORES)}")
+
+        query = db.query(ForecastModel).filter(ForecastModel.source == (source or "canonical"))
+        if metric:
+            query = query.filter(ForecastModel.metric == metric)
+        models = query.all()
+        if not models:
+            raise NoAnalyticsData("No forecast model found; the series may be too short")
+
+        actuals = load_monthly(db, source) if granularity == "quarter" else None
+        z = Z_SCORES[level]
+
+        result = {}
+        for model in sorted(models, key=lambda m: METRIC_COLUMNS.index(m.metric)):
+            params = {column: getattr(model, column) for column in (
+                "method", "alpha", "beta", "gamma", "phi", "level", "trend", "sigma", "last_year", "last_month"
+            )}
+            params["seasonal"] = json.loads(model.seasonal)
+
+            # Quarters are always reported whole, so run on to the end of the
+            # quarter the horizon stops in.
+            months = horizon
+            if granularity == "quarter":
+                months += (-(model.last_month + horizon)) % 3
+            periods, point, sigmas = project(params, months)
+
+            if granularity == "quarter":
+                periods, point, sigmas = _to_quarters(periods, point, sigmas, actuals[model.metric])
+
+            result[model.metric] = {
+                "method": model.method,
+                "observations": model.observations,
+                "last_actual": f"{model.last_year}-{model.last_month:02d}",
+                "periods": [str(p) for p in periods],
+                "forecast": _rounded(point),
+                "lower": _rounded(point - z * sigmas),
+                "upper": _rounded(point + z * sigmas)
+            }
+
+        return {
+            "source": source or "canonical",
+            "granularity": granularity,
+            "horizon_months": horizon,
+            "level": level,
+            "metrics": result
+        }
+
+    def _series(self, db: Session) -> Tuple[List[Tuple[str, str]], List[Tuple[pd.Period, np.ndarray]]]:
+
+        sources = [None, *db.execute(select(FinancialPeriod.source).distinct()).scalars()]
+        keys, series = [], []
+        for source in sources:
+            frame = load_monthly(db, source)
+            for metric in METRIC_COLUMNS:
+                values = frame[metric].to_numpy(dtype="float64") if not frame.empty else np.array([])
+                observed = np.flatnonzero(~np.isnan(values))
+                if not len(observed):
+                    continue
+                keys.append((source or "canonical", metric))
+                series.append((frame.index[observed[0]], values[observed[0]:observed[-1] + 1]))
+        return keys, series
+
+
+def fit_series(series: List[Tuple[pd.Period, np.ndarray]], min_observations: int = 6) -> List[Optional[Dict]]:
+
+    # Additive damped Holt-Winters for every series and every grid point in
+    # one pass: the recursion steps through time, each step is a NumPy
+    # operation over all (series, parameters) lanes. Seasonal naive is
+    # scored alongside and kept when its one-step error is lower.
+    if not series:
+        return []
+
+    lengths = np.array([len(values) for _, values in series])
+    months = lengths.max()
+    count = len(series)
+    phase = np.array([start.month - 1 for start, _ in series])
+
+    # Left-aligned, NaN past the end of each series.
+    y = np.full((months, count), np.nan)
+    for column, (_, values) in enumerate(series):
+        y[:len(values), column] = values
+
+    grid = np.array(list(itertools.product(ALPHAS, BETAS, GAMMAS, PHIS)))
+    alpha, beta, gamma, phi = (grid[:, i][None, :] for i in range(4))
+
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        # nanmean over all-NaN slices is expected for short series.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        first_year = np.nanmean(y[:SEASON], axis=0)
+        second_year = np.nanmean(y[SEASON:2 * SEASON], axis=0) if months > SEASON else np.full(count, np.nan)
+        seasonal = lengths >= 2 * SEASON
+
+        trend0 = np.where(np.isfinite(second_year), (second_year - first_year) / SEASON, 0.0)
+        level0 = first_year
+
+        # Initial seasonal index per calendar month from the first two years,
+        # each year measured against its own mean.
+        season0 = np.zeros((count, SEASON))
+        if months > SEASON:
+            window = y[:2 * SEASON]
+            yearly_mean = np.where(np.arange(len(window))[:, None] < SEASON, first_year, second_year)
+            deviation = window - yearly_mean
+            for position in range(SEASON):
+                calendar_month = (phase + position) % SEASON
+                season0[np.arange(count), calendar_month] = np.nanmean(deviation[position::SEASON], axis=0)
+            season0 = np.nan_to_num(season0)
+            season0 -= season0.mean(axis=1, keepdims=True)
+        season0[~seasonal] = 0.0
+
+    lanes = grid.shape[0]
+    level = np.repeat(level0[:, None], lanes, axis=1)
+    trend = np.repeat(trend0[:, None], lanes, axis=1)
+    season = np.repeat(season0[:, None, :], lanes, axis=1)
+    final_level, final_trend = level.copy(), trend.copy()
+
+    warmup = np.where(seasonal, SEASON, 2)
+    sse = np.zeros((count, lanes))
+    scored = np.zeros(count)
+    rows, columns = np.arange(count)[:, None], np.arange(lanes)[None, :]
+
+    for t in range(months):
+        calendar_month = ((phase + t) % SEASON)[:, None]
+        current = season[rows, columns, calendar_month]
+        expected = level + phi * trend + current
+
+        observed = np.isfinite(y[t])[:, None]
+        error = np.where(observed, y[t][:, None] - expected, 0.0)
+
+        counted = observed[:, 0] & (t >= warmup)
+        sse += np.where(counted[:, None], error ** 2, 0.0)
+        scored += counted
+
+        level = level + phi * trend + alpha * error
+        trend = phi * trend + alpha * beta * error
+        season[rows, columns, calendar_month] = current + gamma * error
+
+        ending = (t == lengths - 1)[:, None]
+        final_level = np.where(ending, level, final_level)
+        final_trend = np.where(ending, trend, final_trend)
+
+    # Seasonal updates are meaningless without two full years to start from.
+    sse[np.ix_(~seasonal, grid[:, 2] > 0)] = np.inf
+    best = np.argmin(sse, axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        holt_rmse = np.sqrt(sse[np.arange(count), best] / scored)
+        naive_error = y[SEASON:] - y[:-SEASON] if months > SEASON else np.empty((0, count))
+        naive_scored = np.count_nonzero(np.isfinite(naive_error), axis=0)
+        naive_rmse = np.sqrt(np.nansum(naive_error ** 2, axis=0) / naive_scored)
+
+    fits = []
+    for column, (start, values) in enumerate(series):
+        if np.count_nonzero(np.isfinite(values)) < min_observations or not np.isfinite(holt_rmse[column]):
+            fits.append(None)
+            continue
+
+        last = start + (lengths[column] - 1)
+        base = {
+            "last_year": last.year,
+            "last_month": last.month,
+            "observations": int(np.count_nonzero(np.isfinite(values)))
+        }
+
+        if seasonal[column] and naive_scored[column] >= SEASON and naive_rmse[column] < holt_rmse[column]:
+            # The last value seen for each calendar month is next year's forecast.
+            by_month = [None] * SEASON
+            for offset, value in enumerate(values):
+                if np.isfinite(value):
+                    by_month[(phase[column] + offset) % SEASON] = float(value)
+            fits.append({
+                **base, "method": "seasonal_naive", "alpha": None, "beta": None, "gamma": None, "phi": None,
+                "level": None, "trend": None, "seasonal": by_month, "sigma": float(naive_rmse[column])
+            })
+            continue
+
+        lane = best[column]
+        fits.append({
+            **base, "method": "holt_winters",
+            "alpha": float(grid[lane, 0]), "beta": float(grid[lane, 1]),
+            "gamma": float(grid[lane, 2]), "phi": float(grid[lane, 3]),
+            "level": float(final_level[column, lane]), "trend": float(final_trend[column, lane]),
+            "seasonal": [float(v) for v in season[column, lane]],
+            "sigma": float(holt_rmse[column])
+        })
+    return fits
+
+
+def project(model: Dict, horizon: int) -> Tuple[pd.PeriodIndex, np.ndarray, np.ndarray]:
+
+    # Point forecasts and their standard errors for the `horizon` months
+    # after the model's last actual month.
+    last = pd.Period(year=model["last_year"], month=model["last_month"], freq="M")
+    periods = pd.period_range(last + 1, periods=horizon, freq="M")
+    steps = np.arange(1, horizon + 1)
+    calendar_month = (model["last_month"] - 1 + steps) % SEASON
+    seasonal = np.array([np.nan if v is None else v for v in model["seasonal"]], dtype="float64")
+
+    if model["method"] == "seasonal_naive":
+        point = seasonal[calendar_month]
+        variance = model["sigma"] ** 2 * ((steps - 1) // SEASON + 1)
+        return periods, point, np.sqrt(variance)
+
+    alpha, beta, gamma, phi = model["alpha"], model["beta"], model["gamma"], model["phi"]
+    damping = np.cumsum(phi ** steps)
+    point = model["level"] + damping * model["trend"] + seasonal[calendar_month]
+
+    # ETS(A,Ad,A) forecast variance: each earlier step j adds c_j^2.
+    c = alpha * (1 + beta * damping) + gamma * (steps % SEASON == 0)
+    variance = model["sigma"] ** 2 * (1 + np.concatenate([[0.0], np.cumsum(c[:-1] ** 2)]))
+    return periods, point, np.sqrt(variance)
+
+
+def _to_quarters(periods: pd.PeriodIndex, point: np.ndarray, sigmas: np.ndarray,
+                 actuals: pd.Series) -> Tuple[pd.PeriodIndex, np.ndarray, np.ndarray]:
+
+    # Months of the current quarter that already have actuals are added in,
+    # so the first quarter is a full-quarter figure. Monthly errors are
+    # positively correlated, so summing the standard errors is the
+    # conservative width.
+    quarters = periods.asfreq("Q")
+    frame = pd.DataFrame({"point": point, "sigma": sigmas}, index=quarters).groupby(level=0).sum()
+
+    observed = actuals.dropna()
+    observed = observed[observed.index.asfreq("Q").isin(frame.index)]
+    if not observed.empty:
+        frame["point"] = frame["point"].add(observed.groupby(observed.index.asfreq("Q")).sum(), fill_value=0)
+
+    return frame.index, frame["point"].to_numpy(), frame["sigma"].to_numpy()
+
+
+def _rounded(values: np.ndarray) -> List[Optional[float]]:
+    return [None if not np.isfinite(v) else round(float(v), 2) for v in values]
+
@@ -0,0 +1,320 @@
+import hashlib
+import itertools
+import json
+import os
+import queue
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import and_, or_
+
+from app.database import SessionLocal
+from app.models import AIJob
+from app.services.cache_service import get_generation
+from app.logging_config import get_logger
+
+
+logger = get_logger("job_queue")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Lower runs first. Single questions are interactive, batches can wait.
+DEFAULT_PRIORITIES = {"insight": 1, "compare": 3, "batch": 5}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobQueue:
+
+    def __init__(self, workers: int = 2, max_pending: int = 100, lease_seconds: float = 60.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self.owner = None
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._running = False
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls) -> "JobQueue":
+        return cls(
+            workers=int(os.getenv("JOB_WORKERS", "2")),
+            max_pending=int(os.getenv("JOB_MAX_PENDING", "100")),
+            lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60"))
+        )
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any]):
+        self.handlers[kind] = handler
+
+    def start(self):
+
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+
+        # Set here rather than in __init__, so forked workers get their own.
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopped.clear()
+
+        # Queued jobs may sit in another live worker's queue as well; the
+        # claim in _run makes sure only one of them runs each job.
+        db = SessionLocal()
+        try:
+            queued = db.query(AIJob.id, AIJob.priority).filter(AIJob.status == QUEUED).all()
+        finally:
+            db.close()
+        for job_id, priority in queued:
+            self._enqueue(priority, job_id)
+        requeued = self._requeue_expired()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ai-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="ai-job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+        logger.info("Job queue started", extra={
+            "workers": self.workers, "owner": self.owner, "queued": len(queued), "requeued": requeued
+        })
+
+    def stop(self, timeout: float = 5.0):
+
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+
+        self._stopped.set()
+        for _ in range(self.workers):
+            self._queue.put((-1, next(self._sequence), None))
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, kind: str, params: Dict[str, Any], priority: Optional[int] = None) -> Dict[str, Any]:
+
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind '{kind}'. Use one of: {', '.join(self.handlers)}")
+
+        priority = DEFAULT_PRIORITIES.get(kind, 5) if priority is None else priority
+        request_key = self._request_key(kind, params)
+
+        db = SessionLocal()
+        try:
+            generation, _ = get_generation(db)
+
+            # Identical requests against the same data share one job.
+            existing = db.query(AIJob).filter(
+                AIJob.request_key == request_key,
+                AIJob.generation == generation,
+                AIJob.status != FAILED
+            ).order_by(AIJob.created_at.desc()).first()
+
+            if existing is not None:
+                return self._to_dict(existing, reused=True)
+
+            if self._queue.qsize() >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs (limit {self.max_pending})")
+
+            job = AIJob(
+                id=uuid.uuid4().hex,
+                kind=kind,
+                request_key=request_key,
+                params=json.dumps(params, sort_keys=True),
+                priority=priority,
+                status=QUEUED,
+                generation=generation,
+                created_at=datetime.now()
+            )
+            db.add(job)
+            db.commit()
+
+            self._enqueue(priority, job.id)
+            return self._to_dict(job, reused=False)
+        finally:
+            db.close()
+
+    def get(self, job_id: str, include_result: bool = False) -> Optional[Dict[str, Any]]:
+
+        db = SessionLocal()
+        try:
+            job = db.get(AIJob, job_id)
+            if job is None:
+                return None
+            return self._to_dict(job, include_result=include_result)
+        finally:
+            db.close()
+
+    def _enqueue(self, priority: int, job_id: str):
+        self._queue.put((priority, next(self._sequence), job_id))
+
+    def _heartbeat(self):
+
+        # Renew the lease on this process's running jobs, and take back jobs
+        # whose owner stopped renewing, e.g. because it was killed.
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                db = SessionLocal()
+                try:
+                    db.query(AIJob).filter(AIJob.owner == self.owner, AIJob.status == RUNNING).update(
+                        {AIJob.heartbeat_at: datetime.now()}, synchronize_session=False
+                    )
+                    db.commit()
+                finally:
+                    db.close()
+                self._requeue_expired()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    def _requeue_expired(self) -> int:
+
+        # Running jobs whose lease ran out go back to QUEUED. Each row is
+        # reset with a conditional UPDATE, so when several processes notice
+        # the same expired job only one requeues it.
+        lease_expired = and_(AIJob.status == RUNNING, or_(
+            AIJob.heartbeat_at.is_(None),
+            AIJob.heartbeat_at < datetime.now() - timedelta(seconds=self.lease_seconds)
+        ))
+        db = SessionLocal()
+        try:
+            expired = db.query(AIJob.id, AIJob.priority, AIJob.owner).filter(lease_expired).all()
+            requeued = 0
+            for job_id, priority, owner in expired:
+                reset = db.query(AIJob).filter(AIJob.id == job_id, lease_expired).update(
+                    {AIJob.status: QUEUED, AIJob.started_at: None, AIJob.owner: None, AIJob.heartbeat_at: None},
+                    synchronize_session=False
+                )
+                db.commit()
+                if reset == 1:
+                    logger.warning("Requeued job with an expired lease", extra={"job_id": job_id, "owner": owner})
+                    self._enqueue(priority, job_id)
+                    requeued += 1
+            return requeued
+        finally:
+            db.close()
+
+    def _work(self):
+
+        while True:
+            _, _, job_id = self._queue.get()
+            if job_id is None:
+                return
+            try:
+                self._run(job_id)
+            except Exception:
+                logger.exception("Job worker failed", extra={"job_id": job_id})
+
+    def _run(self, job_id: str):
+
+        db = SessionLocal()
+        try:
+            # One conditional UPDATE, so of several workers or processes
+            # holding the same id only one gets to run it.
+            now = datetime.now()
+            claimed = db.query(AIJob).filter(AIJob.id == job_id, AIJob.status == QUEUED).update(
+                {AIJob.status: RUNNING, AIJob.started_at: now, AIJob.owner: self.owner, AIJob.heartbeat_at: now},
+                synchronize_session=False
+            )
+            db.commit()
+            if claimed != 1:
+                return
+
+            job = db.get(AIJob, job_id)
+            kind, params = job.kind, json.loads(job.params)
+        finally:
+            db.close()
+
+        logger.info("Job started", extra={"job_id": job_id, "kind": kind})
+
+        try:
+            result = self.handlers[kind](params)
+            status, error = SUCCEEDED, None
+            if isinstance(result, dict) and result.get("success") is False:
+                status, error = FAILED, result.get("error")
+        except Exception as e:
+            logger.exception("Job failed", extra={"job_id": job_id, "kind": kind})
+            result, status, error = None, FAILED, str(e)
+
+        db = SessionLocal()
+        try:
+            # Only while the lease is still ours; a job that was requeued in
+            # the meantime belongs to whoever runs it next.
+            finished = db.query(AIJob).filter(
+                AIJob.id == job_id, AIJob.owner == self.owner, AIJob.status == RUNNING
+            ).update({
+                AIJob.status: status,
+                AIJob.result: json.dumps(result, default=str) if result is not None else None,
+                AIJob.error: error,
+                AIJob.finished_at: datetime.now()
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+        if finished != 1:
+            logger.warning("Job lease lost before it finished", extra={"job_id": job_id, "kind": kind})
+            return
+        logger.info("Job finished", extra={"job_id": job_id, "kind": kind, "status": status})
+
+    def _request_key(self, kind: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps({"kind": kind, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _to_dict(self, job: AIJob, reused: bool = False, include_result: bool = False) -> Dict[str, Any]:
+
+        data = {
+            "job_id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "priority": job.priority,
+            "generation": job.generation,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "error": job.error,
+            "reused": reused
+        }
+        if include_result:
+            data["result"] = json.loads(job.result) if job.result else None
+        return data
+
+
+def _compare(params: Dict[str, Any]) -> Dict[str, Any]:
+    from app.services.ai_service import get_ai_service
+    return get_ai_service().comparative_analysis(
+        params["period1"], params["period2"], params.get("year"), params.get("company_id")
+    )
+
+
+def _insight(params: Dict[str, Any]) -> Dict[str, Any]:
+
+    # The result is shared by every caller with the same request key, so it
+    # must not depend on, or add to, anyone's chat history.
+    from app.services.ai_service import get_ai_service
+    return get_ai_service().query_batch([params["question"]], params.get("company_id"))[0]
+
+
+def _batch(params: Dict[str, Any]) -> Any:
+    from app.services.ai_service import get_ai_service
+    return {"success": True, "results": get_ai_service().query_batch(params["questions"], params.get("company_id"))}
+
+
+job_queue = JobQueue.from_env()
+job_queue.register("compare", _compare)
+job_queue.register("insight", _insight)
+job_queue.register("batch", _batch)
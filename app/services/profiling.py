@@ -0,0 +1,471 @@
+import functools
+import hmac
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.logging_config import get_logger, request_id_var
+
+
+logger = get_logger("profiling")
+
+# The profile of the request being handled, if it asked for one. Worker
+# threads see it because Starlette copies the context into the threadpool.
+_active: ContextVar[Optional["ProfileSession"]] = ContextVar("kudwa_profile", default=None)
+_NO_STAGE = nullcontext()
+
+# A sample is charged to the category of its leaf-most frame that matches
+# (path fragment, function name prefix); anything else is application code.
+CATEGORIES = (
+    ("sql", "sqlalchemy/engine/default.py", "do_execute"),
+    ("sql", "sqlalchemy/engine/cursor.py", "fetch"),
+    ("sql", "sqlalchemy/engine/cursor.py", "_fetch"),
+    ("orm", "/sqlalchemy/", ""),
+    ("llm", "/groq/", ""),
+    ("llm", "/httpx/", ""),
+    ("llm", "/httpcore/", ""),
+    ("serialization", "/json/", ""),
+    ("serialization", "fastapi/encoders.py", ""),
+    ("serialization", "/pydantic/", ""),
+    ("serialization", "starlette/responses.py", ""),
+)
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# While any profile runs, the interpreter switches threads as often as the
+# sampler ticks. Otherwise the sampler only gets the GIL when the request
+# thread releases it, and samples pile up on I/O and SQLite calls.
+_switch_lock = threading.Lock()
+_switch_state = {"sessions": 0, "interval": None}
+
+
+def _push_switch_interval(interval: float):
+    with _switch_lock:
+        if _switch_state["sessions"] == 0:
+            _switch_state["interval"] = sys.getswitchinterval()
+            sys.setswitchinterval(min(interval, _switch_state["interval"]))
+        _switch_state["sessions"] += 1
+
+
+def _pop_switch_interval():
+    with _switch_lock:
+        _switch_state["sessions"] -= 1
+        if _switch_state["sessions"] == 0:
+            sys.setswitchinterval(_switch_state["interval"])
+
+
+def stage(name: str):
+
+    # Times a block against the active profile; a shared no-op otherwise.
+    session = _active.get()
+    if session is None:
+        return _NO_STAGE
+    return session.stage(name)
+
+
+def _category(stack: Tuple) -> str:
+
+    for code in reversed(stack):
+        filename = code.co_filename.replace("\\", "/")
+        for category, fragment, prefix in CATEGORIES:
+            if fragment in filename and code.co_name.startswith(prefix):
+                return category
+    return "app"
+
+
+def _frame(code) -> Dict:
+    return {"name": code.co_qualname, "file": code.co_filename, "line": code.co_firstlineno}
+
+
+class ProfileSession:
+
+    def __init__(self, profile_id: str, interval: float):
+        self.id = profile_id
+        self.interval = interval
+        self.threads = set()
+        self.samples: Dict[int, List[Tuple[Tuple, float]]] = defaultdict(list)
+        self.stages: Dict[str, List[float]] = {}
+        self.duration = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    def start(self):
+        _push_switch_interval(self.interval)
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.id[:8]}", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self._started
+        _pop_switch_interval()
+
+    def add_stage(self, name: str, seconds: float):
+        with self._lock:
+            total = self.stages.setdefault(name, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    @contextmanager
+    def stage(self, name: str):
+        with self.track_thread():
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.add_stage(name, time.perf_counter() - start)
+
+    @contextmanager
+    def track_thread(self):
+
+        # Sample the calling thread while the block runs. Threadpool workers
+        # go back to the pool afterwards, and their idle time is not ours.
+        ident = threading.get_ident()
+        added = ident not in self.threads
+        self.threads.add(ident)
+        try:
+            yield
+        finally:
+            if added:
+                self.threads.discard(ident)
+
+    def _run(self):
+
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            # The gap is what the sample stands for; under a busy GIL it is
+            # longer than the interval.
+            weight, last = now - last, now
+            frames = sys._current_frames()
+            for ident in tuple(self.threads):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                if stack:
+                    self.samples[ident].append((tuple(reversed(stack)), weight))
+            del frames
+
+    def speedscope(self, name: str) -> Dict:
+
+        frames: List[Dict] = []
+        index: Dict = {}
+        profiles = []
+        # A request shorter than one interval still gets a (blank) profile
+        # so the file opens in speedscope.
+        for ident, samples in (self.samples or {threading.get_ident(): []}).items():
+            stacks, weights = [], []
+            for stack, weight in samples:
+                row = []
+                for code in stack:
+                    if code not in index:
+                        index[code] = len(frames)
+                        frames.append(_frame(code))
+                    row.append(index[code])
+                stacks.append(row)
+                weights.append(round(weight * 1000, 3))
+            profiles.append({
+                "type": "sampled",
+                "name": f"{name} (thread {ident})",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": stacks,
+                "weights": weights
+            })
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": name,
+            "activeProfileIndex": 0,
+            "exporter": "kudwa-profiler"
+        }
+
+    def breakdown(self, top: int = 15) -> Dict:
+
+        total_ms = self.duration * 1000
+        stages = {
+            name: {"ms": round(seconds * 1000, 3), "count": count}
+            for name, (seconds, count) in sorted(self.stages.items())
+        }
+        measured = sum(s["ms"] for s in stages.values())
+        stages["other"] = {"ms": round(max(0.0, total_ms - measured), 3), "count": None}
+
+        sampled = defaultdict(float)
+        self_ms = defaultdict(float)
+        total_by_function = defaultdict(float)
+        count = 0
+        for samples in self.samples.values():
+            for stack, weight in samples:
+                count += 1
+                sampled[_category(stack)] += weight * 1000
+                self_ms[stack[-1]] += weight * 1000
+                for code in set(stack):
+                    total_by_function[code] += weight * 1000
+
+        hottest = sorted(self_ms, key=self_ms.get, reverse=True)[:top]
+        return {
+            "duration_ms": round(total_ms, 3),
+            "samples": count,
+            "stages": stages,
+            "sampled_ms": {k: round(v, 3) for k, v in sorted(sampled.items(), key=lambda kv: -kv[1])},
+            "top_functions": [
+                {**_frame(code), "self_ms": round(self_ms[code], 3), "total_ms": round(total_by_function[code], 3)}
+                for code in hottest
+            ]
+        }
+
+
+class Profiler:
+
+    # Opt-in sampling profiles of single requests. Nothing is installed
+    # unless PROFILING_TOKEN is set, and a request is only profiled when it
+    # carries that token in the X-Profile header.
+
+    def __init__(self, token: Optional[str] = None, interval_ms: float = 1.0, directory: str = "profiles",
+                 keep: int = 50):
+        self.token = token or None
+        self.interval = interval_ms / 1000
+        self.directory = Path(directory)
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Profiler":
+        return cls(
+            token=os.getenv("PROFILING_TOKEN"),
+            interval_ms=float(os.getenv("PROFILING_INTERVAL_MS", "1")),
+            directory=os.getenv("PROFILE_DIR", "profiles"),
+            keep=int(os.getenv("PROFILE_KEEP", "50"))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.token is not None
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return self.enabled and token is not None and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def instrument(self, router):
+
+        # Register the threads that run endpoints, for profiled requests
+        # only. Call before the router is included: included routes are
+        # built from each route's endpoint.
+        for route in router.routes:
+            endpoint = getattr(route, "endpoint", None)
+            dependant = getattr(route, "dependant", None)
+            if dependant is None or inspect.iscoroutinefunction(endpoint) or inspect.isgeneratorfunction(endpoint):
+                continue
+            route.endpoint = dependant.call = tracked(endpoint)
+
+    def instrument_engine(self, engine):
+
+        # Time SQL statements of profiled requests.
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            if _active.get() is not None:
+                conn.info.setdefault("kudwa_profile_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            session = _active.get()
+            starts = conn.info.get("kudwa_profile_start")
+            if session is not None and starts:
+                session.add_stage("sql", time.perf_counter() - starts.pop())
+
+        @event.listens_for(engine, "handle_error")
+        def _error(context):
+            # Failed statements skip after_cursor_execute.
+            starts = context.connection.info.get("kudwa_profile_start") if context.connection is not None else None
+            if starts:
+                starts.pop()
+
+    def save(self, session: ProfileSession, meta: Dict) -> Dict:
+
+        name = f"{meta['method']} {meta['path']}"
+        summary = {
+            "id": session.id,
+            **meta,
+            "interval_ms": round(self.interval * 1000, 3),
+            **session.breakdown()
+        }
+
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            (self.directory / f"{session.id}.speedscope.json").write_text(
+                json.dumps(session.speedscope(name)), encoding="utf-8"
+            )
+            (self.directory / f"{session.id}.json").write_text(json.dumps(summary), encoding="utf-8")
+
+            for stale in self._summaries()[self.keep:]:
+                for path in (stale, stale.with_name(stale.name.replace(".json", ".speedscope.json"))):
+                    path.unlink(missing_ok=True)
+        return summary
+
+    def _summaries(self) -> List[Path]:
+
+        # Newest first.
+        if not self.directory.is_dir():
+            return []
+        paths = [p for p in self.directory.glob("*.json") if not p.name.endswith(".speedscope.json")]
+        return sorted(paths, key=lambda p: p.stat().st_mtime, reverse=True)
+
+    def list(self, limit: int = 20) -> List[Dict]:
+
+        rows = []
+        for path in self._summaries()[:limit]:
+            try:
+                summary = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            rows.append({
+                key: summary.get(key)
+                for key in ("id", "created_at", "method", "path", "status", "request_id", "duration_ms", "samples")
+            })
+        return rows
+
+    def _read(self, profile_id: str, suffix: str) -> Optional[Dict]:
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}{suffix}"
+        if not path.is_file():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        return self._read(profile_id, ".json")
+
+    def speedscope(self, profile_id: str) -> Optional[Dict]:
+        return self._read(profile_id, ".speedscope.json")
+
+    def folded(self, profile_id: str) -> Optional[str]:
+
+        # Brendan Gregg's folded stacks, for flamegraph.pl and friends.
+        # Counts are microseconds.
+        document = self.speedscope(profile_id)
+        if document is None:
+            return None
+
+        frames = [
+            f"{f['name']} ({os.path.basename(f['file'])}:{f['line']})" for f in document["shared"]["frames"]
+        ]
+        counts = defaultdict(int)
+        for profile in document["profiles"]:
+            for stack, weight in zip(profile["samples"], profile["weights"]):
+                counts[";".join(frames[i] for i in stack)] += int(round(weight * 1000))
+        return "".join(f"{stack} {count}\n" for stack, count in counts.items() if count)
+
+
+def tracked(call):
+
+    @functools.wraps(call)
+    def endpoint(*args, **kwargs):
+        session = _active.get()
+        if session is None:
+            return call(*args, **kwargs)
+        with session.track_thread():
+            return call(*args, **kwargs)
+
+    return endpoint
+
+
+class ProfilingMiddleware:
+
+    # Plain ASGI middleware. Requests without the profile header pass
+    # straight through. The token is only read from the header, never the
+    # URL, so it stays out of access logs, cache keys and ETags.
+
+    def __init__(self, app, profiler: Optional[Profiler] = None):
+        self.app = app
+        self.profiler = profiler or globals()["profiler"]
+
+    def _requested_token(self, scope) -> Optional[str]:
+
+        for name, value in scope.get("headers", []):
+            if name == b"x-profile":
+                return value.decode("latin-1")
+        return None
+
+    async def __call__(self, scope, receive, send):
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = self._requested_token(scope)
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+        if not self.profiler.authorized(token):
+            logger.warning("Profile requested with an invalid token", extra={"path": scope.get("path")})
+            await self.app(scope, receive, send)
+            return
+
+        session = ProfileSession(uuid.uuid4().hex, self.profiler.interval)
+        meta = {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "method": scope.get("method", ""),
+            "path": scope.get("path", ""),
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "request_id": request_id_var.get(),
+            "status": None
+        }
+        state = {"saved": False}
+
+        def save():
+            session.stop()
+            try:
+                self.profiler.save(session, meta)
+            except Exception:
+                logger.exception("Failed to save profile", extra={"profile_id": session.id})
+
+        async def finish():
+            # Joining the sampler and writing the files block, so they run
+            # in the threadpool rather than on the event loop.
+            if state["saved"]:
+                return
+            state["saved"] = True
+            await run_in_threadpool(save)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                meta["status"] = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", session.id.encode())]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Write the artifact before the client sees the end of the
+                # response, so it can be fetched right away.
+                await finish()
+            await send(message)
+
+        token = _active.set(session)
+        session.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _active.reset(token)
+            await finish()
+
+
+profiler = Profiler.from_env()
@@ -0,0 +1,275 @@
+import json
+import os
+import re
+import time
+from decimal import Decimal
+from typing import Dict
+
+from sqlalchemy import text, inspect
+from sqlalchemy.orm import Session
+
+from app.services import metrics
+from app.logging_config import get_logger
+
+
+logger = get_logger("query_governor")
+
+
+_SQL_KEYWORDS = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "OUTER", "NATURAL", "ON",
+    "USING", "GROUP", "ORDER", "LIMIT", "OFFSET", "HAVING", "UNION", "EXCEPT", "INTERSECT",
+    "WINDOW", "AND", "OR", "AS", "SELECT", "FROM", "INDEXED", "NOT"
+}
+
+# One term of an index condition that only selects the company's rows.
+_COMPANY_TERM = re.compile(r"^\(*\s*(?:\w+\.)?company_id\s*=", re.IGNORECASE)
+
+
+class QueryRejected(Exception):
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"code": self.code, "message": self.message}
+
+
+class QueryResult(list):
+
+    # Plain list of row dicts, plus whether the row cap cut it short.
+    truncated = False
+
+
+class QueryGovernor:
+
+    def __init__(self, timeout_seconds: float = 5.0, max_rows: int = 1000,
+                 max_result_bytes: int = 2_000_000, progress_interval: int = 1000,
+                 max_plan_cost: float = 1_000_000.0):
+        self.timeout_seconds = timeout_seconds
+        self.max_rows = max_rows
+        self.max_result_bytes = max_result_bytes
+        self.progress_interval = progress_interval
+        self.max_plan_cost = max_plan_cost
+
+    @classmethod
+    def from_env(cls) -> "QueryGovernor":
+        return cls(
+            timeout_seconds=float(os.getenv("QUERY_TIMEOUT_SECONDS", "5")),
+            max_rows=int(os.getenv("QUERY_MAX_ROWS", "1000")),
+            max_result_bytes=int(os.getenv("QUERY_MAX_RESULT_BYTES", "2000000")),
+            max_plan_cost=float(os.getenv("QUERY_MAX_PLAN_COST", "1000000"))
+        )
+
+    def execute(self, sql: str, db: Session, row_cap_applied: bool = False) -> QueryResult:
+
+        sql = sql.strip().rstrip(";").strip()
+
+        self.check_plan(sql, db)
+
+        with self.deadline(db):
+            if not row_cap_applied:
+                sql = self._apply_row_cap(sql)
+            result = db.execute(text(sql))
+            columns = list(result.keys())
+            rows = result.fetchmany(self.max_rows + 1)
+
+        data = QueryResult()
+        size = 0
+        for row in rows[:self.max_rows]:
+            # PostgreSQL returns NUMERIC results (AVG, ROUND) as Decimal.
+            record = {c: float(v) if isinstance(v, Decimal) else v for c, v in zip(columns, row)}
+            size += len(repr(record))
+            if size > self.max_result_bytes:
+                self._reject(
+                    "result_too_large",
+                    f"Query result exceeds {self.max_result_bytes} bytes. Narrow the question or aggregate the data."
+                )
+            data.append(record)
+
+        data.truncated = len(rows) > self.max_rows
+        return data
+
+    def check_plan(self, sql: str, db: Session):
+
+        # The plan is inspected before the query runs; other dialects are
+        # only held to the deadline and the caps.
+        dialect = db.get_bind().dialect.name
+        sql = sql.strip().rstrip(";").strip()
+        if dialect == "postgresql":
+            self._check_postgres_plan(sql, db)
+        if dialect != "sqlite":
+            return
+
+        try:
+            plan = db.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+        except Exception as e:
+            self._reject("invalid_sql", f"Query could not be planned: {e}")
+
+        tables = self._base_table_names(sql, db)
+
+        # Full scans of two or more base tables under the same plan node are
+        # nested loops with no usable join key: a cartesian product. Every
+        # SCAN row reads the whole table, over a covering index too; only
+        # SEARCH rows look rows up by a key, and a SEARCH on company_id
+        # alone (as company scoping plans) still reads all the company's rows.
+        scans = {}
+        for node_id, parent, _, detail in plan:
+            match = re.match(r"SCAN (?:TABLE )?(\w+)", detail)
+            if not match:
+                match = re.match(r"SEARCH (?:TABLE )?(\w+) .*\(([^()]*)\)$", detail)
+                if match and not self._company_only(match.group(2)):
+                    continue
+            if not match or match.group(1).lower() not in tables:
+                continue
+            scans.setdefault(parent, []).append(match.group(1))
+
+        for scanned in scans.values():
+            if len(scanned) > 1:
+                self._reject(
+                    "cross_join",
+                    f"Query joins {', '.join(scanned)} without a join condition (full cross join)."
+                )
+
+    def _check_postgres_plan(self, sql: str, db: Session):
+
+        # EXPLAIN without ANALYZE only plans the query. Its cost estimate is
+        # in the planner's arbitrary units, hence QUERY_MAX_PLAN_COST.
+        try:
+            plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+        except Exception as e:
+            self._reject("invalid_sql", f"Query could not be planned: {e}")
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+
+        if root["Total Cost"] > self.max_plan_cost:
+            self._reject(
+                "too_expensive",
+                f"Query is estimated to cost {root['Total Cost']:.0f}, above the {self.max_plan_cost:.0f} limit. "
+                "Narrow the question or aggregate the data."
+            )
+
+        # A nested loop over two sequential scans with no join filter is a
+        # cartesian product, the same shape the SQLite check looks for.
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            children = node.get("Plans", [])
+            nodes.extend(children)
+            if node["Node Type"] != "Nested Loop" or "Join Filter" in node:
+                continue
+            scanned = [self._scanned_relation(child) for child in children]
+            if len(scanned) > 1 and all(scanned):
+                self._reject(
+                    "cross_join",
+                    f"Query joins {', '.join(scanned)} without a join condition (full cross join)."
+                )
+
+    @staticmethod
+    def _scanned_relation(node: dict):
+
+        # A whole-table scan: sequential, or over an index with no condition
+        # but the company.
+        while node["Node Type"] == "Materialize":
+            node = node["Plans"][0]
+        full = node["Node Type"] == "Seq Scan" or (
+            node["Node Type"] in ("Index Scan", "Index Only Scan")
+            and QueryGovernor._company_only(node.get("Index Cond", ""))
+        )
+        return node.get("Alias", node.get("Relation Name")) if full else None
+
+    @staticmethod
+    def _company_only(condition: str) -> bool:
+
+        # True for an empty condition too.
+        terms = [term for term in re.split(r"\s+AND\s+", condition.strip(), flags=re.IGNORECASE) if term]
+        return all(_COMPANY_TERM.match(term) for term in terms)
+
+    def _base_table_names(self, sql: str, db: Session) -> set:
+
+        # The plan names tables by their alias, so collect the aliases given
+        # to real tables as well; CTE and subquery scans are left out.
+        tables = {name.lower() for name in inspect(db.get_bind()).get_table_names()}
+        names = set(tables)
+
+        pattern = r"\b(" + "|".join(re.escape(t) for t in tables) + r")\s+(?:AS\s+)?([A-Za-z_]\w*)"
+        for _, alias in re.findall(pattern, sql, flags=re.IGNORECASE):
+            if alias.upper() not in _SQL_KEYWORDS:
+                names.add(alias.lower())
+
+        return names
+
+    def _apply_row_cap(self, sql: str) -> str:
+        # PostgreSQL needs the derived table to have an alias.
+        return f"SELECT * FROM ({sql}) AS capped LIMIT {self.max_rows + 1}"
+
+    def deadline(self, db: Session):
+        # Aborts what db runs inside the block once timeout_seconds pass.
+        dialect = db.get_bind().dialect.name
+        if dialect == "sqlite":
+            return _SqliteDeadline(db, self.timeout_seconds, self.progress_interval, self)
+        if dialect == "postgresql":
+            return _StatementTimeout(db, self.timeout_seconds, self)
+        return _NoDeadline()
+
+    def _reject(self, code: str, message: str):
+        metrics.sql_rejections.inc(reason=code)
+        logger.warning("Query rejected by governor", extra={"code": code, "reason": message})
+        raise QueryRejected(code, message)
+
+
+class _SqliteDeadline:
+
+    def __init__(self, db: Session, timeout: float, interval: int, governor: QueryGovernor):
+        self.connection = db.connection().connection.driver_connection
+        self.timeout = timeout
+        self.interval = interval
+        self.governor = governor
+        self.expired = False
+
+    def __enter__(self):
+
+        deadline = time.monotonic() + self.timeout
+
+        def handler():
+            if time.monotonic() > deadline:
+                self.expired = True
+                return 1
+            return 0
+
+        self.connection.set_progress_handler(handler, self.interval)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.connection.set_progress_handler(None, self.interval)
+        if self.expired and exc_type is not None:
+            self.governor._reject("timeout", f"Query exceeded the {self.timeout:g}s time limit.")
+        return False
+
+
+class _StatementTimeout:
+
+    def __init__(self, db: Session, timeout: float, governor: QueryGovernor):
+        self.db = db
+        self.timeout = timeout
+        self.governor = governor
+
+    def __enter__(self):
+        self.db.execute(text(f"SET LOCAL statement_timeout = {int(self.timeout * 1000)}"))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and "statement timeout" in str(exc).lower():
+            self.governor._reject("timeout", f"Query exceeded the {self.timeout:g}s time limit.")
+        return False
+
+
+class _NoDeadline:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
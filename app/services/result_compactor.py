@@ -0,0 +1,180 @@
+import json
+import os
+from typing import List, Dict, Any, Tuple
+
+from app.services import metrics
+
+
+PERIOD_COLUMNS = ("year", "quarter", "month", "period_start", "period_end", "period")
+ID_COLUMNS = ("id", "period_id", "account_id")
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text and numbers.
+    return len(text) // 4 + 1
+
+
+class ResultCompactor:
+
+    def __init__(self, token_budget: int = 1500, verbatim_rows: int = 50,
+                 top_n: int = 5, series_points: int = 24):
+        self.token_budget = token_budget
+        self.verbatim_rows = verbatim_rows
+        self.top_n = top_n
+        self.series_points = series_points
+
+    @classmethod
+    def from_env(cls) -> "ResultCompactor":
+        return cls(
+            token_budget=int(os.getenv("ANSWER_TOKEN_BUDGET", "1500")),
+            verbatim_rows=int(os.getenv("ANSWER_VERBATIM_ROWS", "50"))
+        )
+
+    def compact(self, data: List[Dict]) -> Tuple[str, Dict[str, Any]]:
+
+        with metrics.ai_stage_seconds.time(stage="compact_results"):
+            text = str(data) if len(data) <= self.verbatim_rows else None
+            mode = "verbatim"
+
+            if text is None or estimate_tokens(text) > self.token_budget:
+                text = self._digest(data)
+                mode = "digest"
+
+        tokens = estimate_tokens(text)
+        metrics.prompt_compaction.inc(mode=mode)
+        metrics.answer_prompt_data_tokens.observe(tokens, mode=mode)
+
+        return text, {"mode": mode, "rows": len(data), "estimated_tokens": tokens}
+
+    def _digest(self, data: List[Dict]) -> str:
+
+        import numpy as np
+        import pandas as pd
+
+        frame = pd.DataFrame.from_records(data)
+        period_cols = [c for c in PERIOD_COLUMNS if c in frame.columns]
+        if period_cols:
+            frame = frame.sort_values(period_cols, kind="stable").reset_index(drop=True)
+
+        numeric = frame.select_dtypes(include="number")
+        metric_cols = [c for c in numeric.columns if c not in PERIOD_COLUMNS and c not in ID_COLUMNS]
+        label = self._labeler(frame, period_cols, metric_cols)
+
+        summary = {"rows": len(frame), "columns": list(frame.columns), "metrics": {}}
+
+        if metric_cols:
+            values = frame[metric_cols].to_numpy(dtype="float64")
+            totals = np.nansum(values, axis=0)
+            means = np.nanmean(values, axis=0) if len(values) else totals
+            min_idx = np.nanargmin(np.where(np.isnan(values), np.inf, values), axis=0)
+            max_idx = np.nanargmax(np.where(np.isnan(values), -np.inf, values), axis=0)
+
+            first, last = values[0], values[-1]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                overall_growth = np.where(first != 0, (last - first) / np.abs(first) * 100, np.nan)
+                steps = np.diff(values, axis=0) / np.abs(values[:-1]) * 100
+            steps[~np.isfinite(steps)] = np.nan
+            avg_step = np.nanmean(steps, axis=0) if len(steps) and np.isfinite(steps).any() else np.full(len(metric_cols), np.nan)
+
+            for i, col in enumerate(metric_cols):
+                summary["metrics"][col] = {
+                    "total": _round(totals[i]),
+                    "mean": _round(means[i]),
+                    "min": {"value": _round(values[min_idx[i], i]), "at": label(min_idx[i])},
+                    "max": {"value": _round(values[max_idx[i], i]), "at": label(max_idx[i])},
+                    "first_to_last_growth_pct": _round(overall_growth[i]),
+                    "avg_step_growth_pct": _round(avg_step[i])
+                }
+
+        top_rows = self._top_rows(frame, metric_cols, self.top_n)
+        series = self._series(frame, label, metric_cols, self.series_points)
+
+        # Shrink the optional sections until the digest fits the budget.
+        while True:
+            text = self._render(summary, top_rows, series)
+            if estimate_tokens(text) <= self.token_budget:
+                return text
+            if len(series) > 4:
+                series = self._downsample(series, max(4, len(series) // 2))
+            elif len(top_rows) > 1:
+                top_rows = top_rows[: len(top_rows) // 2]
+            elif series:
+                series = []
+            elif top_rows:
+                top_rows = []
+            elif len(summary["metrics"]) > 1:
+                summary["metrics"].pop(next(reversed(summary["metrics"])))
+            else:
+                return text[: self.token_budget * 4]
+
+    def _labeler(self, frame, period_cols: List[str], metric_cols: List[str]):
+
+        # Labels are only needed for the handful of rows that end up in the
+        # digest, so build them on demand instead of for every row.
+        label_cols = period_cols or [c for c in frame.columns if c not in metric_cols][:2]
+        if "source" in frame.columns and label_cols and "source" not in label_cols:
+            label_cols = label_cols + ["source"]
+        if not label_cols:
+            return lambda i: f"row {int(i) + 1}"
+
+        columns = [frame[c].to_numpy() for c in label_cols]
+        return lambda i: " ".join(str(column[i]) for column in columns)
+
+    def _top_rows(self, frame, metric_cols: List[str], n: int) -> List[Dict]:
+
+        if not metric_cols:
+            return _records(frame.head(n))
+        order = frame[metric_cols[0]].abs().sort_values(ascending=False, kind="stable").index[:n]
+        return _records(frame.loc[order])
+
+    def _series(self, frame, label, metric_cols: List[str], points: int) -> List[Dict]:
+
+        if not metric_cols:
+            return []
+        values = frame[metric_cols].to_numpy(dtype="float64")
+        return [
+            {"at": label(i), **{col: _round(value) for col, value in zip(metric_cols, values[i])}}
+            for i in _even_index(len(frame), points)
+        ]
+
+    def _downsample(self, rows: List[Dict], points: int) -> List[Dict]:
+        return [rows[i] for i in _even_index(len(rows), points)]
+
+    def _render(self, summary: Dict, top_rows: List[Dict], series: List[Dict]) -> str:
+
+        parts = [
+            f"The query returned {summary['rows']} rows; a statistical digest is shown instead of every row.",
+            "SUMMARY: " + json.dumps(summary, default=str)
+        ]
+        if top_rows:
+            parts.append(f"TOP {len(top_rows)} ROWS: " + json.dumps(top_rows, default=str))
+        if series:
+            parts.append(f"SERIES ({len(series)} evenly spaced points): " + json.dumps(series, default=str))
+        return "\n".join(parts)
+
+
+def _even_index(length: int, points: int) -> List[int]:
+
+    import numpy as np
+
+    if length <= points:
+        return list(range(length))
+    return np.unique(np.linspace(0, length - 1, points).round().astype(int)).tolist()
+
+
+def _round(value) -> Any:
+
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return value
+    if value != value or value in (float("inf"), float("-inf")):
+        return None
+    return round(value, 2)
+
+
+def _records(frame) -> List[Dict]:
+    return [
+        {key: _round(value) if isinstance(value, float) else value for key, value in row.items()}
+        for row in frame.to_dict(orient="records")
+    ]
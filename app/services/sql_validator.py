@@ -0,0 +1,191 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, OptimizeError
+from sqlglot.optimizer.qualify import qualify
+
+from app.money import CENTS, MINOR_UNITS, Money
+from app.services import metrics
+from app.services.query_governor import QueryRejected
+from app.logging_config import get_logger
+
+
+logger = get_logger("sql_validator")
+
+
+# Tables the text-to-SQL path may read. Internal bookkeeping tables stay out.
+QUERYABLE_TABLES = (
+    "financial_periods", "canonical_periods", "date_dim", "period_variances", "accounts", "account_closure",
+    "account_details", "quarterly_summary", "anomalies",
+    "forecasts"
+)
+
+_STATEMENT_TYPES = (exp.Select, exp.Union, exp.Except, exp.Intersect)
+
+_FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Drop, exp.Create, exp.Alter,
+    exp.Command, exp.Pragma, exp.Into, exp.Merge
+)
+
+_FORBIDDEN_FUNCTIONS = {
+    "LOAD_EXTENSION", "READFILE", "WRITEFILE", "EDIT", "FTS3_TOKENIZER",
+    "SQLITE_COMPILEOPTION_GET", "SQLITE_COMPILEOPTION_USED", "PG_SLEEP", "PG_READ_FILE"
+}
+
+
+class SQLValidator:
+
+    def __init__(self, schema: Dict[str, Dict[str, str]], dialect: str = "sqlite",
+                 cache_size: int = 1024, table_routes: Optional[Dict[str, str]] = None,
+                 money_columns: Optional[Dict[str, Iterable[str]]] = None):
+        self.schema = {table.lower(): columns for table, columns in schema.items()}
+        self.dialect = dialect
+        self.cache_size = cache_size
+        self.table_routes = dict(table_routes or {})
+        # Tables whose rows belong to one company.
+        self.company_tables = {table for table, columns in self.schema.items() if "company_id" in columns}
+        # Columns stored in cents that generated SQL reads as amounts.
+        self.money_columns = {table.lower(): list(columns) for table, columns in (money_columns or {}).items() if columns}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_metadata(cls, metadata, tables: Iterable[str] = QUERYABLE_TABLES, **kwargs) -> "SQLValidator":
+
+        schema = {}
+        money_columns = {}
+        for name in tables:
+            table = metadata.tables[name]
+            schema[name] = {column.name: str(column.type) for column in table.columns}
+            if CENTS:
+                money_columns[name] = [column.name for column in table.columns if isinstance(column.type, Money)]
+        kwargs.setdefault("money_columns", money_columns)
+        return cls(schema, **kwargs)
+
+    def validate(self, sql: str) -> exp.Expression:
+
+        key = hashlib.sha256(sql.strip().encode("utf-8")).hexdigest()
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+
+        if cached is not None:
+            metrics.cache_requests.inc(cache="sql_validation", result="hit")
+            if isinstance(cached, tuple):
+                # Rejections are cached as (code, message); every caller
+                # gets an exception, and a traceback, of its own.
+                metrics.sql_rejections.inc(reason=cached[0])
+                raise QueryRejected(*cached)
+            return cached
+
+        metrics.cache_requests.inc(cache="sql_validation", result="miss")
+
+        try:
+            result = self._validate(sql)
+        except QueryRejected as e:
+            with self._lock:
+                self._store(key, (e.code, e.message))
+            metrics.sql_rejections.inc(reason=e.code)
+            logger.info("SQL rejected by validator", extra={"code": e.code, "reason": e.message})
+            raise
+
+        with self._lock:
+            self._store(key, result)
+        return result
+
+    def _store(self, key: str, entry):
+
+        # Caller holds self._lock.
+        self._cache[key] = entry
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def rewrite(self, sql: str, limit: Optional[int] = None, company_id: Optional[int] = None) -> str:
+
+        tree = self.validate(sql).copy()
+
+        if company_id is not None or self.money_columns:
+            # Every company table is read through a subquery over the
+            # company's rows, under the name the query used, so no
+            # predicate the model writes can reach another company. The
+            # same subquery turns cents columns back into amounts.
+            cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+            for table in list(tree.find_all(exp.Table)):
+                name = table.name.lower()
+                scope = company_id is not None and name in self.company_tables
+                if name in cte_names or not (scope or name in self.money_columns):
+                    continue
+                scoped = exp.select(*self._columns(name)).from_(exp.to_table(table.name))
+                if scope:
+                    scoped = scoped.where(exp.column("company_id").eq(exp.Literal.number(int(company_id))))
+                table.replace(scoped.subquery(table.alias_or_name))
+
+        if self.table_routes:
+            for table in tree.find_all(exp.Table):
+                target = self.table_routes.get(table.name.lower())
+                if target:
+                    table.set("this", exp.to_identifier(target))
+
+        if limit is not None:
+            current = tree.args.get("limit")
+            current_value = None
+            if current is not None and isinstance(current.expression, exp.Literal):
+                current_value = int(current.expression.this)
+            if current_value is None or current_value > limit:
+                tree = tree.limit(limit)
+
+        return tree.sql(dialect=self.dialect)
+
+    def _columns(self, table: str) -> list:
+
+        money = self.money_columns.get(table)
+        if not money:
+            return ["*"]
+        return [
+            exp.alias_(exp.Div(this=exp.column(name), expression=exp.Literal.number(f"{MINOR_UNITS}.0")), name)
+            if name in money else exp.column(name)
+            for name in self.schema[table]
+        ]
+
+    def _validate(self, sql: str) -> exp.Expression:
+
+        try:
+            statements = [s for s in sqlglot.parse(sql, read=self.dialect) if s is not None]
+        except ParseError as e:
+            raise QueryRejected("invalid_sql", f"Query could not be parsed: {e}")
+
+        if len(statements) != 1:
+            raise QueryRejected("multiple_statements", "Exactly one SQL statement is allowed.")
+
+        tree = statements[0]
+        if not isinstance(tree, _STATEMENT_TYPES):
+            raise QueryRejected("not_select", "Only SELECT queries are allowed.")
+
+        for node in tree.walk():
+            if isinstance(node, _FORBIDDEN_NODES):
+                raise QueryRejected("not_select", f"{node.key.upper()} is not allowed in a read-only query.")
+            if isinstance(node, exp.Func):
+                name = node.name.upper() if isinstance(node, exp.Anonymous) else node.sql_name()
+                if name in _FORBIDDEN_FUNCTIONS:
+                    raise QueryRejected("forbidden_function", f"Function {name} is not allowed.")
+
+        cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        for table in tree.find_all(exp.Table):
+            name = table.name.lower()
+            if table.args.get("db") or table.args.get("catalog"):
+                raise QueryRejected("unknown_table", f"Table {table.sql()} is not available.")
+            if name not in self.schema and name not in cte_names:
+                raise QueryRejected("unknown_table", f"Table {table.name} is not available.")
+
+        try:
+            qualify(tree.copy(), schema=self.schema, dialect=self.dialect, validate_qualify_columns=True)
+        except OptimizeError as e:
+            raise QueryRejected("unknown_column", str(e))
+
+        return tree
@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from app.models import Base, AccountCategory
+
+
+# account_details as it was before the accounts dimension.
+LEGACY_DDL = """
+CREATE TABLE account_details (
+    id INTEGER PRIMARY KEY,
+    period_id INTEGER NOT NULL,
+    category VARCHAR NOT NULL,
+    account_name VARCHAR NOT NULL,
+    parent_account VARCHAR,
+    amount FLOAT,
+    account_id VARCHAR
+);
+CREATE INDEX ix_account_details_id ON account_details (id);
+CREATE INDEX ix_account_details_period_category ON account_details (period_id, category);
+"""
+
+LEGACY_QUERY = """
+SELECT account_name, SUM(amount) FROM account_details
+WHERE category = 'expense' GROUP BY account_name
+"""
+
+# Scoped to one company the way the app's queries are; company_id leads the indexes.
+COMPANY_ID = 1
+
+NORMALIZED_QUERY = f"""
+SELECT a.name, t.total FROM (
+    SELECT account_id, SUM(amount) AS total FROM account_details
+    WHERE company_id = {COMPANY_ID} AND category_id = 3 GROUP BY account_id
+) t JOIN accounts a ON a.id = t.account_id
+"""
+
+
+def chart_of_accounts(count: int, seed: int):
+
+    # Three levels deep, names long enough to look like real ledger accounts.
+    rng = random.Random(seed)
+    categories = list(AccountCategory)
+    accounts = []
+    for i in range(count):
+        parent = accounts[rng.randrange(len(accounts))] if accounts and rng.random() < 0.7 else None
+        category = parent["category"] if parent else rng.choice(categories)
+        accounts.append({
+            "id": i + 1,
+            "name": f"{category.label.title()} Account {i:04d} - Operations and Services",
+            "parent": parent,
+            "level": parent["level"] + 1 if parent else 0,
+            "category": category,
+            "external_id": str(3553975000000000000 + i * 7919)
+        })
+    return accounts
+
+
+def build_legacy(path: str, accounts, periods: int):
+
+    con = sqlite3.connect(path)
+    con.executescript(LEGACY_DDL)
+    rows = (
+        (p * len(accounts) + a["id"], p + 1, a["category"].label, a["name"],
+         a["parent"]["name"] if a["parent"] else None, float(p % 97 + a["id"]), a["external_id"])
+        for p in range(periods) for a in accounts
+    )
+    con.executemany("INSERT INTO account_details VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    con.commit()
+    con.execute("ANALYZE")
+    con.execute("VACUUM")
+    con.close()
+
+
+def build_normalized(path: str, accounts, periods: int):
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine, tables=[
+        Base.metadata.tables["accounts"], Base.metadata.tables["account_details"]
+    ])
+    engine.dispose()
+
+    con = sqlite3.connect(path)
+    con.executemany(
+        "INSERT INTO accounts (id, company_id, account_key, external_id, name, parent_id, level, category_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+            (a["id"], COMPANY_ID, "hash:" + hashlib.sha1(a["name"].encode()).hexdigest()[:16], a["external_id"],
+             a["name"], a["parent"]["id"] if a["parent"] else None, a["level"], int(a["category"]))
+            for a in accounts
+        )
+    )
+    rows = (
+        (p * len(accounts) + a["id"], COMPANY_ID, p + 1, a["id"], int(a["category"]), float(p % 97 + a["id"]))
+        for p in range(periods) for a in accounts
+    )
+    con.executemany(
+        "INSERT INTO account_details (id, company_id, period_id, account_id, category_id, amount) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    con.commit()
+    con.execute("ANALYZE")
+    con.execute("VACUUM")
+    con.close()
+
+
+def time_query(path: str, sql: str, repeat: int) -> float:
+
+    con = sqlite3.connect(path)
+    con.execute(sql).fetchall()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        con.execute(sql).fetchall()
+        samples.append(time.perf_counter() - start)
+    con.close()
+    return statistics.median(samples) * 1000
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="account_details size and GROUP BY latency, before and after the accounts dimension")
+    parser.add_argument("--periods", type=int, default=2000)
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    accounts = chart_of_accounts(args.accounts, args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "legacy.db")
+        normalized = os.path.join(tmp, "normalized.db")
+        build_legacy(legacy, accounts, args.periods)
+        build_normalized(normalized, accounts, args.periods)
+
+        results = {
+            "free-text columns": (os.path.getsize(legacy), time_query(legacy, LEGACY_QUERY, args.repeat)),
+            "accounts dimension": (os.path.getsize(normalized), time_query(normalized, NORMALIZED_QUERY, args.repeat))
+        }
+
+    print(f"{args.periods} periods x {args.accounts} accounts = {args.periods * args.accounts} fact rows")
+    print(f"{'layout':<22}{'db size MB':>12}{'group by ms':>14}")
+    for name, (size, latency) in results.items():
+        print(f"{name:<22}{size / 1e6:>12.1f}{latency:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import sys
+import time
+
+from app.logging_config import configure_logging, shutdown_logging, get_logger, request_id_var
+
+
+QUESTION = "What was the total profit in Q1 2024?"
+SQL = "SELECT ROUND(SUM(net_income), 2) FROM financial_periods WHERE year = 2024 AND quarter = 1;"
+ANSWER = "The total profit in Q1 2024 was $861,638.51, driven mainly by higher revenue in March."
+
+
+def request_with_print():
+
+    # The output AIService.query and _is_safe_sql produced per request
+    # before the move to structured logging.
+    print(f"\n{'='*50}")
+    print(f"Question ? {QUESTION}")
+    print('='*50)
+    print(" Generation Loading SQL...")
+    print(f"SQL: {SQL}")
+    print("Query Loading...")
+    print("SQL query is safe")
+    print(f" Results {1} ")
+    print("Generation Loading result...")
+    print(f"Result {ANSWER[:100]}...")
+
+
+def request_with_logging(logger):
+
+    logger.info("AI query received", extra={"question": QUESTION})
+    logger.debug("Generated SQL", extra={"sql": SQL})
+    logger.debug("SQL query is safe", extra={"sample_every": 100})
+    logger.debug("SQL executed", extra={"rows": 1})
+    logger.info("AI query answered", extra={"rows": 1})
+
+
+class SlowSink:
+
+    # Stand-in for stdout attached to a pipe or log collector: every write
+    # blocks the writer for a short while, the way a congested pipe does.
+
+    def __init__(self, latency_us: float):
+        self.latency = latency_us / 1e6
+        self.writes = 0
+
+    def write(self, data: str) -> int:
+        self.writes += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def measure(fn, iterations: int) -> float:
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Per-request logging overhead")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--write-latency-us", type=float, default=20.0,
+                        help="Simulated blocking time of each write to stdout")
+    args = parser.parse_args()
+
+    request_id_var.set("bench")
+    results = {}
+
+    with contextlib.redirect_stdout(SlowSink(args.write_latency_us)):
+        results["print (baseline)"] = measure(request_with_print, args.iterations)
+
+    original_stdout = sys.stdout
+    for level in ("INFO", "DEBUG"):
+        # The stream handler binds sys.stdout when logging is configured.
+        sys.stdout = SlowSink(args.write_latency_us)
+        configure_logging(level=level, fmt="json")
+        logger = get_logger("bench")
+        results[f"logging level={level}"] = measure(lambda: request_with_logging(logger), args.iterations)
+        shutdown_logging()
+        sys.stdout = original_stdout
+
+    print(f"Caller-side cost per simulated AIService.query, "
+          f"{args.iterations} iterations, {args.write_latency_us:g}us per stdout write")
+
+    baseline = results["print (baseline)"]
+    print(f"{'variant':<24}{'us/request':>12}{'vs print':>12}")
+    for name, value in results.items():
+        print(f"{name:<24}{value:>12.2f}{value / baseline:>11.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from decimal import Decimal
+
+import numpy as np
+
+from app.money import parse_cents, parse_float
+
+
+def amounts(count: int, seed: int):
+
+    # Ledger-like amounts: mostly two decimals, some with thousands
+    # separators, whole numbers and blanks. Returns the source strings and
+    # their exact values in cents.
+    rng = random.Random(seed)
+    texts, cents = [], []
+    for _ in range(count):
+        value = int(rng.lognormvariate(10, 2.5)) * rng.choice((1, 1, 1, -1))
+        kind = rng.random()
+        if kind < 0.05:
+            texts.append("")
+            cents.append(0)
+            continue
+        if kind < 0.15:
+            value -= value % 100
+            texts.append(str(value // 100))
+        elif kind < 0.35:
+            texts.append(f"{value / 100:,.2f}")
+        else:
+            texts.append(f"{value / 100:.2f}")
+        cents.append(value)
+    return texts, cents
+
+
+def rate(run, items: int, repeat: int) -> float:
+
+    # Best of `repeat`, in items per second.
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return items / best
+
+
+def parse_benchmarks(texts, cents, repeat: int):
+
+    floats = [c / 100 for c in cents]
+    parsed = [parse_cents(t) for t in texts]
+    if parsed != cents:
+        raise RuntimeError("parse_cents disagrees with the generated values")
+
+    return [
+        ("parse_float, strings", rate(lambda: [parse_float(t) for t in texts], len(texts), repeat)),
+        ("parse_cents, strings", rate(lambda: [parse_cents(t) for t in texts], len(texts), repeat)),
+        ("parse_float, JSON numbers", rate(lambda: [parse_float(f) for f in floats], len(floats), repeat)),
+        ("parse_cents, JSON numbers", rate(lambda: [parse_cents(f) for f in floats], len(floats), repeat)),
+    ]
+
+
+def sql_benchmarks(cents, groups: int, repeat: int, path: str):
+
+    # The same values in a REAL and an INTEGER column, summed in total and
+    # per group the way the quarterly and breakdown endpoints do.
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE ledger (bucket INTEGER, amount_float REAL, amount_cents INTEGER)")
+    con.executemany(
+        "INSERT INTO ledger VALUES (?, ?, ?)", ((i % groups, c / 100, c) for i, c in enumerate(cents))
+    )
+    con.commit()
+
+    exact = Decimal(sum(cents)) / 100
+    float_total = con.execute("SELECT SUM(amount_float) FROM ledger").fetchone()[0]
+    cents_total = con.execute("SELECT SUM(amount_cents) FROM ledger").fetchone()[0]
+
+    def query(sql):
+        return lambda: con.execute(sql).fetchall()
+
+    rows = [
+        ("SUM, float", rate(query("SELECT SUM(amount_float) FROM ledger"), len(cents), repeat)),
+        ("SUM, cents", rate(query("SELECT SUM(amount_cents) FROM ledger"), len(cents), repeat)),
+        ("GROUP BY SUM, float",
+         rate(query("SELECT bucket, SUM(amount_float) FROM ledger GROUP BY bucket"), len(cents), repeat)),
+        ("GROUP BY SUM, cents",
+         rate(query("SELECT bucket, SUM(amount_cents) FROM ledger GROUP BY bucket"), len(cents), repeat)),
+    ]
+    con.close()
+    return rows, (Decimal(repr(float_total)) - exact, Decimal(cents_total) / 100 - exact)
+
+
+def numpy_benchmarks(cents, repeat: int):
+
+    as_cents = np.asarray(cents, dtype=np.int64)
+    as_float = as_cents / 100
+    exact = Decimal(int(as_cents.sum())) / 100
+
+    rows = [
+        ("NumPy sum, float64", rate(as_float.sum, len(cents), repeat)),
+        ("NumPy sum, int64 cents", rate(as_cents.sum, len(cents), repeat)),
+    ]
+    return rows, (Decimal(repr(float(as_float.sum()))) - exact, Decimal(int(as_cents.sum())) / 100 - exact)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Parse and aggregate throughput of float and integer-cents amounts")
+    parser.add_argument("--values", type=int, default=1_000_000)
+    parser.add_argument("--groups", type=int, default=100, help="Buckets for the GROUP BY aggregate")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    texts, cents = amounts(args.values, args.seed)
+
+    print(f"{args.values} amounts, total {Decimal(sum(cents)) / 100:,}")
+    print(f"\n{'benchmark':<30}{'M values/s':>12}")
+    for name, per_second in parse_benchmarks(texts, cents, args.repeat):
+        print(f"{name:<30}{per_second / 1e6:>12.2f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sql_rows, sql_error = sql_benchmarks(cents, args.groups, args.repeat, os.path.join(tmp, "ledger.db"))
+    numpy_rows, numpy_error = numpy_benchmarks(cents, args.repeat)
+    for name, per_second in sql_rows + numpy_rows:
+        print(f"{name:<30}{per_second / 1e6:>12.2f}")
+
+    print("\nError of the total against the exact sum:")
+    print(f"  SQLite  float {sql_error[0]:.2E}, cents {sql_error[1]}")
+    print(f"  NumPy   float {numpy_error[0]:.2E}, cents {numpy_error[1]}")
+
+
+if __name__ == "__main__":
+    main()
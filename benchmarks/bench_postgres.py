@@ -0,0 +1,164 @@
+import argparse
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import write_dataset
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PATHS = [
+    "/api/v1/summary",
+    "/api/v1/summary?source=quickbooks",
+    "/api/v1/periods",
+    "/api/v1/trends/revenue",
+    "/api/v1/expenses/breakdown",
+    "/api/v1/expenses/breakdown?level=0",
+    "/api/v1/reconciliation/variances",
+    "/api/v1/analytics/growth?granularity=year",
+    "/api/v1/anomalies",
+    "/api/v1/forecast?horizon=3",
+]
+
+# One query the governor must plan and pass, one it must reject.
+PLANNED_SQL = "SELECT year, SUM(total_revenue) FROM canonical_periods GROUP BY year"
+CROSS_JOIN_SQL = "SELECT d.amount, p.year FROM account_details d, financial_periods p"
+
+
+def postgres_url(url):
+
+    return url if url and url.split(":", 1)[0].split("+", 1)[0] == "postgresql" else None
+
+
+def worker(data_dir: str, repeat: int):
+
+    # Runs under one DATABASE_URL and prints what it saw as JSON: the
+    # ingestion time, each endpoint's body and median time, and the
+    # governor's verdicts.
+    from fastapi.testclient import TestClient
+    from app.database import Base, StateBase, company_router, engine, init_db, state_engine
+    from app.main import app
+    from app.services.data_processor import DataProcessor
+    from app.services.query_governor import QueryGovernor, QueryRejected
+
+    Base.metadata.drop_all(bind=engine)
+    StateBase.metadata.drop_all(bind=state_engine)
+    init_db()
+
+    start = time.perf_counter()
+    result = DataProcessor().process_all(data_dir, mode="in_place")
+    ingest_ms = (time.perf_counter() - start) * 1000
+    if not result["success"]:
+        raise RuntimeError(result["error"])
+
+    client = TestClient(app)
+    endpoints = {}
+    for path in PATHS:
+        samples, body = [], None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get(path)
+            samples.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}: {response.text}")
+            body = response.json()
+        endpoints[path] = {"median_ms": statistics.median(samples), "body": body}
+
+    governor = QueryGovernor.from_env()
+    verdicts = {}
+    with company_router.session(company_router.company_ids()[0]) as db:
+        for name, sql in (("planned", PLANNED_SQL), ("cross_join", CROSS_JOIN_SQL)):
+            try:
+                governor.check_plan(sql, db)
+                verdicts[name] = "ok"
+            except QueryRejected as e:
+                verdicts[name] = e.code
+
+    print(json.dumps({"ingest_ms": ingest_ms, "endpoints": endpoints, "governor": verdicts}, default=str))
+
+
+def run_worker(database_url: str, data_dir: str, repeat: int) -> dict:
+
+    env = dict(os.environ)
+    env.update({"DATABASE_URL": database_url, "RESPONSE_CACHE_SIZE": "0", "LOG_LEVEL": "WARNING"})
+    env.pop("STATE_DATABASE_URL", None)
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_postgres", "--worker", data_dir, "--repeat", str(repeat)],
+        cwd=ROOT, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def differences(left, right, path: str = ""):
+
+    # Float sums may differ in the last bits between engines; anything
+    # beyond half a cent is a real difference.
+    if isinstance(left, dict) and isinstance(right, dict):
+        if left.keys() != right.keys():
+            return [f"{path}: keys {sorted(left.keys() ^ right.keys())}"]
+        return [d for key in left for d in differences(left[key], right[key], f"{path}.{key}")]
+    if isinstance(left, list) and isinstance(right, list):
+        if len(left) != len(right):
+            return [f"{path}: {len(left)} vs {len(right)} items"]
+        return [d for i, (a, b) in enumerate(zip(left, right)) for d in differences(a, b, f"{path}[{i}]")]
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)) and not isinstance(left, bool):
+        return [] if math.isclose(left, right, rel_tol=1e-9, abs_tol=0.005) else [f"{path}: {left} vs {right}"]
+    return [] if left == right else [f"{path}: {left!r} vs {right!r}"]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="PostgreSQL profile check: ingestion and read endpoints against SQLite on the same data. "
+                    "Skipped unless BENCH_DATABASE_URL or DATABASE_URL points at PostgreSQL."
+    )
+    parser.add_argument("--database-url", default=postgres_url(os.getenv("BENCH_DATABASE_URL"))
+                        or postgres_url(os.getenv("DATABASE_URL")),
+                        help="Scratch PostgreSQL database; its tables are dropped")
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--accounts", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.repeat)
+        return
+
+    if not postgres_url(args.database_url):
+        print("Skipped: set BENCH_DATABASE_URL (or DATABASE_URL) to a scratch postgresql+psycopg:// database")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = str(write_dataset(os.path.join(tmp, "data"), args.years, args.accounts, 3, 1)[0])
+        sqlite = run_worker(f"sqlite:///{tmp}/bench.db", data_dir, args.repeat)
+        postgres = run_worker(args.database_url, data_dir, args.repeat)
+
+    failures = []
+    print(f"{'':<44}{'sqlite ms':>12}{'postgres ms':>12}")
+    print(f"{'ingest.in_place':<44}{sqlite['ingest_ms']:>12.1f}{postgres['ingest_ms']:>12.1f}")
+    for path in PATHS:
+        lite, pg = sqlite["endpoints"][path], postgres["endpoints"][path]
+        print(f"{path:<44}{lite['median_ms']:>12.2f}{pg['median_ms']:>12.2f}")
+        failures += [f"{path} {d}" for d in differences(lite["body"], pg["body"])]
+
+    if postgres["governor"] != {"planned": "ok", "cross_join": "cross_join"}:
+        failures.append(f"governor verdicts on PostgreSQL: {postgres['governor']}")
+
+    if failures:
+        print(f"\n{len(failures)} differences from SQLite:")
+        for failure in failures[:50]:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nPostgreSQL responses match SQLite")
+
+
+if __name__ == "__main__":
+    main()
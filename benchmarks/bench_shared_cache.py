@@ -0,0 +1,104 @@
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from typing import List, Tuple
+
+from app.services.cache_service import ResponseCache, SharedCache
+
+
+def request_stream(requests: int, distinct: int, skew: float, ingestions: int, seed: int) -> List[Tuple[int, int]]:
+
+    # (generation, key) per request. Keys follow a Zipf-like popularity, the
+    # way a handful of dashboard questions dominate, and each ingestion
+    # bumps the generation partway through.
+    rng = random.Random(seed)
+    weights = [1 / (k + 1) ** skew for k in range(distinct)]
+    keys = rng.choices(range(distinct), weights, k=requests)
+    every = requests // (ingestions + 1)
+    return [(i // every if every else 0, key) for i, key in enumerate(keys)]
+
+
+def serve(backend: str, path: str, capacity: int, items: List[Tuple[int, int]], build_ms: float,
+          value_bytes: int, results):
+
+    # One worker process: look every request up, build and store it on a miss.
+    cache = ResponseCache("bench", capacity) if backend == "memory" else SharedCache("bench", path, capacity)
+    value = os.urandom(value_bytes)
+    hits = 0
+    lookup = 0.0
+    for generation, key in items:
+        start = time.perf_counter()
+        cached = cache.get((generation, key))
+        lookup += time.perf_counter() - start
+        if cached is None:
+            time.sleep(build_ms / 1000)
+            cache.set((generation, key), value)
+        else:
+            hits += 1
+    results.put((hits, len(items), lookup))
+
+
+def run(backend: str, capacity: int, stream: List[Tuple[int, int]], workers: int, build_ms: float,
+        value_bytes: int, seed: int):
+
+    # Requests are spread over the workers at random, like a load balancer.
+    rng = random.Random(seed)
+    shares = [[] for _ in range(workers)]
+    for item in stream:
+        shares[rng.randrange(workers)].append(item)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite")
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=serve, args=(backend, path, capacity, share, build_ms, value_bytes, results))
+            for share in shares
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+    hits = sum(t[0] for t in totals)
+    lookups = sum(t[1] for t in totals)
+    return hits / lookups, sum(t[2] for t in totals) / lookups * 1e6, elapsed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Cache hit rate of per-worker caches against one shared cache")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--distinct", type=int, default=1000, help="Distinct cacheable requests")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of request popularity")
+    parser.add_argument("--capacity", type=int, default=256, help="Entries per cache (RESPONSE_CACHE_SIZE)")
+    parser.add_argument("--ingestions", type=int, default=2, help="Generation bumps during the run")
+    parser.add_argument("--build-ms", type=float, default=1.0, help="Cost of building a missed entry")
+    parser.add_argument("--value-bytes", type=int, default=4096)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    stream = request_stream(args.requests, args.distinct, args.skew, args.ingestions, args.seed)
+    setups = (
+        (f"memory, {args.capacity} per worker", "memory", args.capacity),
+        (f"shared, {args.capacity}", "shared", args.capacity),
+        (f"shared, {args.capacity * args.workers}", "shared", args.capacity * args.workers),
+    )
+
+    print(f"{args.requests} requests over {args.distinct} keys across {args.workers} workers, "
+          f"{args.ingestions} ingestions")
+    print(f"\n{'cache':<28}{'hit rate':>10}{'lookup us':>11}{'wall s':>9}")
+    for label, backend, capacity in setups:
+        hit_rate, lookup_us, elapsed = run(backend, capacity, stream, args.workers, args.build_ms,
+                                           args.value_bytes, args.seed)
+        print(f"{label:<28}{hit_rate:>10.1%}{lookup_us:>11.1f}{elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
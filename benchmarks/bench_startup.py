@@ -0,0 +1,85 @@
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, deadline: float, expect_status: int = 200) -> float:
+
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == expect_status:
+                    return time.perf_counter()
+        except Exception:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"{url} did not answer in time")
+
+
+def run_once(empty_db: bool, timeout: float) -> dict:
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}/api/v1"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+        env.pop("GROQ_API_KEY", None)
+        env["LOG_LEVEL"] = "WARNING"
+
+        if not empty_db:
+            subprocess.run(
+                [sys.executable, "-m", "app.services.data_processor"],
+                cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL
+            )
+
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        try:
+            deadline = start + timeout
+            health = wait_for(f"{base}/health", deadline) - start
+            ready = wait_for(f"{base}/ready", deadline) - start
+        finally:
+            process.terminate()
+            process.wait()
+
+    return {"health": health, "ready": ready}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Cold start to first /health and /ready response")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    print(f"{'database':<12}{'first /health (ms)':>20}{'first /ready (ms)':>20}")
+    for empty_db in (True, False):
+        runs = [run_once(empty_db, args.timeout) for _ in range(args.runs)]
+        health = statistics.median(r["health"] for r in runs) * 1000
+        ready = statistics.median(r["ready"] for r in runs) * 1000
+        print(f"{'empty' if empty_db else 'loaded':<12}{health:>20.1f}{ready:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.bench_startup import free_port, wait_for
+from benchmarks.stub_llm import StubSettings, start_stub
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+QUESTIONS = (
+    "What was the total profit in Q1 2024?",
+    "Show me revenue trends for 2024",
+    "Which quarter had the highest revenue?",
+    "What were the total expenses in 2023?",
+    "What was the net income by quarter in 2024?",
+)
+
+COMPARISONS = (
+    {"period1": "Q1", "period2": "Q2", "year": 2024},
+    {"period1": "Q3", "period2": "Q4", "year": 2023},
+    {"period1": "2023", "period2": "2024"},
+)
+
+READS = (
+    "/summary",
+    "/quarterly/2024",
+    "/periods?year=2024",
+    "/trends/revenue",
+    "/expenses/breakdown",
+    "/analytics/growth?metric=total_revenue",
+)
+
+# Default share of each kind of request.
+DEFAULT_MIX = "ai_query=2,compare=1,read=7"
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in ("ai_query", "compare", "read"):
+            raise ValueError(f"Unknown request kind: {kind}")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def next_request(kind: str, rng: random.Random) -> Tuple[str, str, str, Optional[bytes]]:
+
+    # (route label, method, path, body)
+    if kind == "ai_query":
+        body = json.dumps({"question": rng.choice(QUESTIONS)}).encode("utf-8")
+        return "POST /ai/query", "POST", "/ai/query", body
+    if kind == "compare":
+        params = rng.choice(COMPARISONS)
+        query = "&".join(f"{k}={v}" for k, v in params.items())
+        return "GET /ai/compare", "GET", f"/ai/compare?{query}", None
+    path = rng.choice(READS)
+    return f"GET {path.split('?')[0]}", "GET", path, None
+
+
+def send(base: str, method: str, path: str, body: Optional[bytes], timeout: float) -> Tuple[int, bool]:
+
+    # Returns the status and whether the request failed. AI endpoints answer
+    # 200 with an error object when the LLM step fails, so those count too.
+    request = urllib.request.Request(base + path, data=body, method=method)
+    if body is not None:
+        request.add_header("Content-Type", "application/json")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        return e.code, True
+    except Exception:
+        return 0, True
+
+    try:
+        failed = bool(json.loads(payload).get("error"))
+    except (ValueError, AttributeError):
+        failed = False
+    return status, failed
+
+
+def drive(base: str, mix: Dict[str, float], concurrency: int, duration: float, timeout: float,
+          seed: int) -> Dict[str, List[Tuple[float, bool]]]:
+
+    # Closed loop: each worker sends its next request as soon as the
+    # previous one finishes, for `duration` seconds.
+    samples: Dict[str, List[Tuple[float, bool]]] = defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    kinds, weights = zip(*mix.items())
+
+    def worker(index: int):
+        rng = random.Random(seed + index)
+        while time.perf_counter() < deadline:
+            route, method, path, body = next_request(rng.choices(kinds, weights)[0], rng)
+            start = time.perf_counter()
+            status, failed = send(base, method, path, body, timeout)
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[route].append((elapsed, failed or status >= 400 or status == 0))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: Dict[str, List[Tuple[float, bool]]], duration: float) -> Dict[str, Dict]:
+
+    report = {}
+    everything = []
+    for route in sorted(samples):
+        latencies = sorted(s[0] for s in samples[route])
+        errors = sum(1 for s in samples[route] if s[1])
+        everything.extend(samples[route])
+        report[route] = _stats(latencies, errors, duration)
+    report["ALL"] = _stats(sorted(s[0] for s in everything), sum(1 for s in everything if s[1]), duration)
+    return report
+
+
+def _stats(latencies: List[float], errors: int, duration: float) -> Dict:
+    count = len(latencies)
+    return {
+        "requests": count,
+        "throughput_rps": round(count / duration, 2),
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1)
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Load-test the API offline against a stub LLM server")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Relative weights of ai_query, compare and read")
+    parser.add_argument("--data", default=str(ROOT / "data"), help="Directory with data_set_1.json and data_set_2.json")
+    parser.add_argument("--app-workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Stub LLM time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--tokens-per-second", type=float, default=250.0, help="Stub LLM generation speed")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of LLM calls that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--sql-file", help="JSON object of question keyword to canned SQL")
+    parser.add_argument("--json", type=Path, help="Also write the report here")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    sql = json.loads(Path(args.sql_file).read_text()) if args.sql_file else None
+    settings = StubSettings(args.latency_ms, args.jitter_ms, args.tokens_per_second, args.answer_tokens,
+                            args.error_rate, args.error_status, sql, args.seed)
+    stub, stub_stats = start_stub(settings)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": f"sqlite:///{tmp}/loadtest.db",
+            "GROQ_API_KEY": "stub",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{stub.server_port}",
+            "LOG_LEVEL": "WARNING",
+        })
+
+        subprocess.run(
+            [sys.executable, "-c",
+             "import sys\nfrom app.services.data_processor import DataProcessor\n"
+             "sys.exit(0 if DataProcessor().process_all(sys.argv[1])['success'] else 1)",
+             args.data],
+            cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL
+        )
+
+        port = free_port()
+        base = f"http://127.0.0.1:{port}/api/v1"
+        app = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+             "--workers", str(args.app_workers), "--log-level", "warning"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        try:
+            wait_for(f"{base}/ready", time.perf_counter() + 60)
+            print(f"Driving {args.concurrency} clients for {args.duration:.0f}s, mix {args.mix}, "
+                  f"stub latency {args.latency_ms:.0f}ms at {args.tokens_per_second:.0f} tok/s, "
+                  f"error rate {args.error_rate:.0%}")
+            samples = drive(base, mix, args.concurrency, args.duration, args.timeout, args.seed)
+        finally:
+            app.terminate()
+            app.wait()
+            stub.shutdown()
+
+    report = summarize(samples, args.duration)
+    llm = stub_stats.snapshot()
+
+    print(f"\n{'route':<30}{'requests':>9}{'req/s':>8}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for route, row in report.items():
+        print(f"{route:<30}{row['requests']:>9}{row['throughput_rps']:>8.1f}{row['error_rate']:>8.1%}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}")
+    print(f"\nLLM calls {llm['requests']} (injected failures {llm['errors']}), "
+          f"tokens {llm['prompt_tokens']} prompt / {llm['completion_tokens']} completion")
+
+    if args.json:
+        args.json.write_text(json.dumps({
+            "params": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+            "routes": report,
+            "llm": llm
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+# Canned text-to-SQL output keyed on a word in the question. Every query
+# passes the SQL validator and runs against the real schema.
+DEFAULT_SQL = {
+    "profit": "SELECT year, quarter, ROUND(SUM(net_income), 2) AS net_income FROM canonical_periods "
+              "WHERE year = 2024 GROUP BY year, quarter;",
+    "revenue": "SELECT year, month, ROUND(SUM(total_revenue), 2) AS revenue FROM canonical_periods "
+               "WHERE year = 2024 GROUP BY year, month;",
+    "expense": "SELECT year, ROUND(SUM(total_operating_expenses + total_cogs), 2) AS expenses "
+               "FROM canonical_periods GROUP BY year;",
+    "quarter": "SELECT year, quarter, ROUND(SUM(total_revenue), 2) AS revenue FROM canonical_periods "
+               "GROUP BY year, quarter ORDER BY revenue DESC LIMIT 1;",
+    "*": "SELECT year, ROUND(SUM(total_revenue), 2) AS revenue FROM canonical_periods GROUP BY year;",
+}
+
+ANSWER_WORDS = (
+    "Revenue grew steadily through the period while operating expenses stayed broadly flat, "
+    "which lifted net income and improved the margin compared with the previous quarter."
+).split()
+
+
+class StubSettings:
+
+    def __init__(self, latency_ms: float = 300.0, jitter_ms: float = 50.0, tokens_per_second: float = 250.0,
+                 answer_tokens: int = 60, error_rate: float = 0.0, error_status: int = 503,
+                 sql: Optional[Dict[str, str]] = None, seed: int = 7):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.sql = {**sql, "*": sql.get("*", DEFAULT_SQL["*"])} if sql else DEFAULT_SQL
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+
+class StubStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, error: bool = False, prompt_tokens: int = 0, completion_tokens: int = 0):
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens
+            }
+
+
+def _tokens(text: str) -> int:
+    # Close enough to a BPE count for English prose and SQL.
+    return max(1, len(text) // 4)
+
+
+def _reply(settings: StubSettings, messages) -> str:
+
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    prompt = " ".join(m.get("content", "") for m in messages if m.get("role") == "user")
+
+    if "SQL" in system:
+        match = re.search(r"CURRENT QUESTION:\s*(.+)", prompt)
+        question = (match.group(1) if match else prompt).lower()
+        for keyword, sql in settings.sql.items():
+            if keyword != "*" and keyword in question:
+                return sql
+        return settings.sql["*"]
+
+    words = [ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(settings.answer_tokens)]
+    return " ".join(words) + "."
+
+
+def make_handler(settings: StubSettings, stats: StubStats):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: Dict):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send(200, stats.snapshot())
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+
+            # Groq's SDK posts to /openai/v1/chat/completions, OpenAI's to
+            # /v1/chat/completions.
+            if not self.path.endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            messages = request.get("messages", [])
+            prompt_tokens = sum(_tokens(m.get("content", "")) for m in messages)
+
+            with settings.lock:
+                failed = settings.rng.random() < settings.error_rate
+                jitter = settings.rng.gauss(0, settings.jitter_ms) if settings.jitter_ms else 0.0
+
+            if failed:
+                time.sleep(max(0.0, settings.latency_ms + jitter) / 1000)
+                stats.record(error=True, prompt_tokens=prompt_tokens)
+                self._send(settings.error_status, {"error": {"message": "Injected failure", "type": "server_error"}})
+                return
+
+            content = _reply(settings, messages)
+            completion_tokens = _tokens(content)
+            time.sleep(max(0.0, settings.latency_ms + jitter) / 1000
+                       + completion_tokens / settings.tokens_per_second)
+
+            stats.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            self._send(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "logprobs": None,
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+
+    return Handler
+
+
+def start_stub(settings: StubSettings, port: int = 0):
+
+    # Returns the running server and its stats; server.server_port has the
+    # port when 0 was asked for.
+    stats = StubStats()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(settings, stats))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server, stats
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Offline OpenAI/Groq-compatible chat completions server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--tokens-per-second", type=float, default=250.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--sql-file", help="JSON object of question keyword to SQL; '*' is the fallback")
+    args = parser.parse_args()
+
+    sql = None
+    if args.sql_file:
+        with open(args.sql_file, encoding="utf-8") as f:
+            sql = json.load(f)
+
+    settings = StubSettings(args.latency_ms, args.jitter_ms, args.tokens_per_second, args.answer_tokens,
+                            args.error_rate, args.error_status, sql)
+    server, _ = start_stub(settings, args.port)
+    print(f"Stub LLM on http://127.0.0.1:{server.server_port} (set GROQ_BASE_URL to this)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
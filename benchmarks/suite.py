@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.synthetic import write_dataset
+
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS = ROOT / "benchmarks" / "results"
+
+# Representative text-to-SQL output: a source-level aggregate, an account
+# join, a closure rollup, and a statement the validator has to reject.
+SQL_QUERIES = {
+    "revenue_by_year": "SELECT year, SUM(total_revenue) FROM canonical_periods GROUP BY year ORDER BY year",
+    "net_income_by_quarter": (
+        "SELECT year, quarter, SUM(net_income) FROM financial_periods "
+        "WHERE source = 'quickbooks' GROUP BY year, quarter"
+    ),
+    "top_expense_accounts": (
+        "SELECT a.name, SUM(d.amount) AS total FROM account_details d JOIN accounts a ON a.id = d.account_id "
+        "WHERE d.category_id = 3 AND a.level = 0 GROUP BY a.name ORDER BY total DESC LIMIT 10"
+    ),
+    "subtree_rollup": (
+        "SELECT c.ancestor_id, SUM(d.own_amount) FROM account_details d "
+        "JOIN account_closure c ON c.descendant_id = d.account_id GROUP BY c.ancestor_id"
+    ),
+}
+UNSAFE_SQL = "DROP TABLE financial_periods"
+
+
+def timed(run: Callable[[], object], repeat: int, warmup: int = 1) -> Dict[str, float]:
+
+    for _ in range(warmup):
+        run()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "min_ms": round(samples[0], 3),
+        "runs": repeat
+    }
+
+
+def ingestion_benchmarks(data_dirs: List[Path]) -> Dict[str, Callable[[], object]]:
+
+    from app.services.data_processor import DataProcessor
+
+    def ingest(mode: str):
+        def run():
+            for data_dir in data_dirs:
+                result = DataProcessor().process_all(str(data_dir), mode=mode)
+                if not result["success"]:
+                    raise RuntimeError(result["error"])
+        return run
+
+    benchmarks = {"ingest.in_place": ingest("in_place")}
+    if os.environ["DATABASE_URL"].startswith("sqlite"):
+        # Snapshots swap SQLite files; elsewhere they run in place.
+        benchmarks["ingest.snapshot"] = ingest("snapshot")
+    return benchmarks
+
+
+def api_benchmarks() -> Dict[str, Callable[[], object]]:
+
+    # No lifespan: the database is already loaded and the job workers are
+    # not part of what is measured. RESPONSE_CACHE_SIZE=0 makes every call
+    # build its response. With several companies every call reads the first.
+    from fastapi.testclient import TestClient
+    from app.database import company_router
+    from app.main import app
+    from app.models import Account, CanonicalPeriod
+
+    client = TestClient(app)
+    company_id = company_router.company_ids()[0]
+    with company_router.session(company_id) as db:
+        year = db.query(CanonicalPeriod.year).order_by(CanonicalPeriod.year.desc()).first()[0]
+        root = db.query(Account.name).filter(Account.level == 0, Account.category_id == 3).first()[0]
+
+    paths = {
+        "api.summary": "/api/v1/summary",
+        "api.summary_by_source": "/api/v1/summary?source=quickbooks",
+        "api.periods": "/api/v1/periods",
+        "api.quarterly": f"/api/v1/quarterly/{year}",
+        "api.revenue_trends": "/api/v1/trends/revenue",
+        "api.expenses_breakdown": "/api/v1/expenses/breakdown",
+        "api.expenses_level0": "/api/v1/expenses/breakdown?level=0",
+        "api.expenses_rollup": f"/api/v1/expenses/breakdown?rollup={root}",
+        "api.variances": "/api/v1/reconciliation/variances",
+        "api.analytics_growth": "/api/v1/analytics/growth",
+        "api.anomalies": "/api/v1/anomalies",
+        "api.forecast": "/api/v1/forecast",
+    }
+
+    def get(path: str):
+        def run():
+            response = client.get(path, params={"company_id": company_id})
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+        return run
+
+    return {name: get(path) for name, path in paths.items()}
+
+
+def sql_benchmarks() -> Dict[str, Callable[[], object]]:
+
+    from app.database import company_router
+    from app.services.ai_service import AIService
+
+    service = AIService()
+    company_id = company_router.company_ids()[0]
+
+    def validate():
+        for sql in SQL_QUERIES.values():
+            if not service._is_safe_sql(sql):
+                raise RuntimeError(f"Rejected: {sql}")
+        if service._is_safe_sql(UNSAFE_SQL):
+            raise RuntimeError("Unsafe SQL was accepted")
+
+    def execute(sql: str):
+        def run():
+            with company_router.session(company_id) as db:
+                if service.execute_sql(sql, db) is None:
+                    raise RuntimeError(f"Failed: {sql}")
+        return run
+
+    benchmarks = {"sql.is_safe": validate}
+    benchmarks.update({f"sql.execute.{name}": execute(sql) for name, sql in SQL_QUERIES.items()})
+    return benchmarks
+
+
+def pick_database(url: Optional[str], tmp: str) -> str:
+    
+    # A server database (say a throwaway local PostgreSQL) is used when it
+    # answers; otherwise the run falls back to a temporary SQLite file.
+    if url:
+        from sqlalchemy import create_engine, make_url
+        
+        probe = None
+        try:
+            probe = create_engine(url)
+            with probe.connect():
+                return url
+        except Exception as e:
+            # A missing driver lands here too.
+            shown = make_url(url).render_as_string(hide_password=True)
+            print(f"{shown} is not reachable ({type(e).__name__}); falling back to SQLite")
+        finally:
+            if probe is not None:
+                probe.dispose()
+    return f"sqlite:///{tmp}/bench.db"
+
+
+def reset_database():
+    
+    # Server databases outlive the run; start from empty tables.
+    from app.database import Base, StateBase, engine, state_engine
+    
+    Base.metadata.drop_all(bind=engine)
+    StateBase.metadata.drop_all(bind=state_engine)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[tuple]:
+
+    rows = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            rows.append((name, None, result["median_ms"], None, "new"))
+            continue
+        ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else float("inf")
+        status = "REGRESSION" if ratio > 1 + threshold else "faster" if ratio < 1 - threshold else "ok"
+        rows.append((name, before["median_ms"], result["median_ms"], ratio, status))
+    return rows
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Ingestion, API aggregation and SQL validation micro-benchmarks")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--accounts", type=int, default=60)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--companies", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per benchmark (ingestion uses a fifth)")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--history", type=Path, default=RESULTS / "history.json")
+    parser.add_argument("--baseline", type=Path, default=RESULTS / "baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative slowdown reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="Scratch database to run against (its tables are dropped); SQLite when unset or unreachable")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dirs = write_dataset(
+            os.path.join(tmp, "data"), args.years, args.accounts, args.depth, args.companies
+        )
+
+        # The app reads these when it is imported.
+        os.environ["DATABASE_URL"] = pick_database(args.database_url, tmp)
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+        os.environ["LOG_LEVEL"] = "WARNING"
+        os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+        backend = os.environ["DATABASE_URL"].split(":", 1)[0].split("+", 1)[0]
+        if backend != "sqlite":
+            reset_database()
+        
+        results = {}
+
+        def run_all(benchmarks: Dict[str, Callable[[], object]], repeat: int):
+            for name, run in benchmarks.items():
+                if args.filter in name:
+                    results[name] = timed(run, repeat)
+                    print(f"{name:<36}{results[name]['median_ms']:>12.2f} ms")
+
+        ingestion = ingestion_benchmarks(data_dirs)
+        run_all(ingestion, max(1, args.repeat // 5))
+        if not results:
+            # The API and SQL benchmarks read what ingestion loaded.
+            ingestion["ingest.in_place"]()
+
+        run_all(api_benchmarks(), args.repeat)
+        run_all(sql_benchmarks(), args.repeat)
+
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": {
+            "years": args.years, "accounts": args.accounts, "depth": args.depth,
+            "companies": args.companies, "repeat": args.repeat, "backend": backend
+        },
+        "results": results
+    }
+
+    args.history.parent.mkdir(parents=True, exist_ok=True)
+    history = json.loads(args.history.read_text()) if args.history.exists() else []
+    history.append(run)
+    args.history.write_text(json.dumps(history, indent=2))
+
+    regressions = 0
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        if baseline["params"] != {**run["params"], "repeat": baseline["params"]["repeat"]}:
+            print("\nBaseline was recorded with different data parameters; comparison skipped")
+        else:
+            print(f"\n{'benchmark':<36}{'baseline ms':>12}{'now ms':>12}{'ratio':>8}  status")
+            for name, before, now, ratio, status in compare(results, baseline["results"], args.threshold):
+                regressions += status == "REGRESSION"
+                before_text = f"{before:>12.2f}" if before is not None else f"{'-':>12}"
+                ratio_text = f"{ratio:>8.2f}" if ratio is not None else f"{'-':>8}"
+                print(f"{name:<36}{before_text}{now:>12.2f}{ratio_text}  {status}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(run, indent=2))
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
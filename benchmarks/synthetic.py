@@ -0,0 +1,248 @@
+import argparse
+import calendar
+import json
+import math
+import random
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# QuickBooks section headers and the Rootfi list each category lands in.
+CATEGORIES = (
+    ("Income", "revenue", "Business Revenue", 400000),
+    ("Cost of Goods Sold", "cost_of_goods_sold", "Cost of Goods Sold", 500000),
+    ("Expenses", "operating_expenses", "Operating Expenses", 600000),
+)
+
+# Share of the chart of accounts per category, and how large a typical
+# monthly amount is.
+WEIGHTS = {"revenue": 0.3, "cost_of_goods_sold": 0.2, "operating_expenses": 0.5}
+SCALES = {"revenue": 60_000.0, "cost_of_goods_sold": 20_000.0, "operating_expenses": 15_000.0}
+
+
+class Account:
+
+    def __init__(self, account_id: int, name: str, level: int):
+        self.account_id = account_id
+        self.name = name
+        self.level = level
+        self.children: List["Account"] = []
+        self.own: List[float] = []
+        self._totals: Optional[List[float]] = None
+
+    def totals(self) -> List[float]:
+
+        # Own amount plus every descendant's, the way the reports nest them.
+        if self._totals is None:
+            totals = list(self.own)
+            for child in self.children:
+                totals = [a + b for a, b in zip(totals, child.totals())]
+            self._totals = [round(v, 2) for v in totals]
+        return self._totals
+
+
+def months_between(start_year: int, years: int) -> List[date]:
+    return [date(start_year + y, m, 1) for y in range(years) for m in range(1, 13)]
+
+
+def chart_of_accounts(accounts: int, depth: int, months: int, rng: random.Random) -> Dict[str, List[Account]]:
+
+    # One tree per category, at most `depth` levels, with a trending and
+    # seasonal own amount per month on every account.
+    charts = {}
+    next_id = 1
+    for _, key, _, code in CATEGORIES:
+        count = max(1, round(accounts * WEIGHTS[key]))
+        nodes: List[Account] = []
+        roots: List[Account] = []
+        for i in range(count):
+            parents = [n for n in nodes if n.level < depth - 1]
+            parent = rng.choice(parents) if parents and rng.random() < 0.7 else None
+            level = parent.level + 1 if parent else 0
+            account = Account(next_id, f"{code + i * 10} {key.replace('_', ' ').title()} Account {i}", level)
+            next_id += 1
+
+            base = SCALES[key] * rng.uniform(0.2, 2.0) / (level + 1)
+            growth = rng.uniform(-0.002, 0.01)
+            amplitude = rng.uniform(0.0, 0.3)
+            phase = rng.uniform(0, 2 * math.pi)
+            account.own = [
+                round(max(0.0, base * (1 + growth * t) * (1 + amplitude * math.sin(2 * math.pi * t / 12 + phase))
+                          * rng.gauss(1, 0.05)), 2)
+                for t in range(months)
+            ]
+
+            (parent.children if parent else roots).append(account)
+            nodes.append(account)
+        charts[key] = roots
+    return charts
+
+
+def _money(value: float) -> str:
+    return f"{value:.2f}"
+
+
+def _quickbooks_rows(accounts: List[Account], offset: int, months: int) -> List[Dict]:
+
+    rows = []
+    for account in accounts:
+        own = [{"value": _money(v)} for v in account.own[offset:offset + months]]
+        if not account.children:
+            rows.append({"ColData": [{"value": account.name, "id": str(account.account_id)}, *own], "type": "Data"})
+            continue
+
+        blank = [{"value": ""} for _ in range(months)]
+        totals = account.totals()[offset:offset + months]
+        rows.append({
+            "Header": {"ColData": [{"value": account.name, "id": str(account.account_id)}, *blank]},
+            "Rows": {"Row": [
+                {"ColData": [{"value": account.name, "id": str(account.account_id)}, *own], "type": "Data"},
+                *_quickbooks_rows(account.children, offset, months)
+            ]},
+            "Summary": {"ColData": [{"value": f"Total {account.name}"}, *({"value": _money(v)} for v in totals)]},
+            "type": "Section"
+        })
+    return rows
+
+
+def quickbooks_report(charts: Dict[str, List[Account]], periods: List[date], offset: int = 0) -> Dict:
+
+    months = len(periods)
+    columns = [{"ColTitle": "", "ColType": "Account", "MetaData": [{"Name": "ColKey", "Value": "account"}]}]
+    for period in periods:
+        end = period.replace(day=calendar.monthrange(period.year, period.month)[1])
+        title = period.strftime("%b %Y")
+        columns.append({"ColTitle": title, "ColType": "Money", "MetaData": [
+            {"Name": "StartDate", "Value": period.isoformat()},
+            {"Name": "EndDate", "Value": end.isoformat()},
+            {"Name": "ColKey", "Value": title}
+        ]})
+
+    def section_total(key: str) -> List[float]:
+        totals = [0.0] * months
+        for account in charts[key]:
+            totals = [a + b for a, b in zip(totals, account.totals()[offset:offset + months])]
+        return totals
+
+    income, cogs, expenses = (section_total(key) for _, key, _, _ in CATEGORIES)
+    gross = [a - b for a, b in zip(income, cogs)]
+    net = [a - b for a, b in zip(gross, expenses)]
+
+    def summary(name: str, values: List[float]) -> Dict:
+        return {"ColData": [{"value": name}, *({"value": _money(v)} for v in values)]}
+
+    blank = [{"value": ""} for _ in range(months)]
+    rows = []
+    for (header, key, _, _), totals in zip(CATEGORIES, (income, cogs, expenses)):
+        rows.append({
+            "Header": {"ColData": [{"value": header}, *blank]},
+            "Rows": {"Row": _quickbooks_rows(charts[key], offset, months)},
+            "Summary": summary(f"Total {header}", totals),
+            "type": "Section",
+            "group": key
+        })
+        if key == "cost_of_goods_sold":
+            rows.append({"Summary": summary("Gross Profit", gross), "type": "Section", "group": "GrossProfit"})
+    rows.append({"Summary": summary("Net Operating Income", net), "type": "Section", "group": "NetOperatingIncome"})
+    rows.append({"Summary": summary("Net Income", net), "type": "Section", "group": "NetIncome"})
+
+    return {"data": {
+        "Header": {
+            "ReportName": "ProfitAndLoss",
+            "ReportBasis": "Accrual",
+            "StartPeriod": periods[0].isoformat(),
+            "EndPeriod": periods[-1].replace(day=calendar.monthrange(periods[-1].year, periods[-1].month)[1]).isoformat(),
+            "SummarizeColumnsBy": "Month",
+            "Currency": "USD"
+        },
+        "Columns": {"Column": columns},
+        "Rows": {"Row": rows}
+    }}
+
+
+def _rootfi_items(accounts: List[Account], index: int, external_base: int) -> List[Dict]:
+    items = []
+    for account in accounts:
+        item = {
+            "name": account.name,
+            "value": round(account.totals()[index], 2),
+            "account_id": str(external_base + account.account_id)
+        }
+        if account.children:
+            item["line_items"] = _rootfi_items(account.children, index, external_base)
+        items.append(item)
+    return items
+
+
+def rootfi_report(charts: Dict[str, List[Account]], periods: List[date], offset: int, company_id: int) -> Dict:
+
+    external_base = 3553975000000000000 + company_id * 1_000_000
+    records = []
+    for i, period in enumerate(periods):
+        index = offset + i
+        end = period.replace(day=calendar.monthrange(period.year, period.month)[1])
+        record = {
+            "rootfi_id": company_id * 100_000 + index,
+            "rootfi_company_id": company_id,
+            "platform_id": f"{period.isoformat()}_{end.isoformat()}",
+            "period_start": period.isoformat(),
+            "period_end": end.isoformat(),
+            "non_operating_revenue": [],
+            "non_operating_expenses": []
+        }
+        totals = {}
+        for _, key, group, _ in CATEGORIES:
+            items = _rootfi_items(charts[key], index, external_base)
+            record[key] = [{"name": group, "value": round(sum(item["value"] for item in items), 2), "line_items": items}]
+            totals[key] = record[key][0]["value"]
+        record["gross_profit"] = round(totals["revenue"] - totals["cost_of_goods_sold"], 2)
+        record["operating_profit"] = round(record["gross_profit"] - totals["operating_expenses"], 2)
+        record["net_profit"] = record["operating_profit"]
+        records.append(record)
+    return {"data": records}
+
+
+def write_dataset(out_dir: str, years: int = 5, accounts: int = 60, depth: int = 3, companies: int = 1,
+                  start_year: int = 2020, seed: int = 7) -> List[Path]:
+
+    # One directory per company with data_set_1.json (QuickBooks, every
+    # month) and data_set_2.json (Rootfi, the later half, so the two
+    # sources overlap the way the real exports do). A single company is
+    # written straight into out_dir.
+    periods = months_between(start_year, years)
+    rootfi_offset = len(periods) // 2
+    written = []
+    for company in range(1, companies + 1):
+        rng = random.Random(seed * 1000 + company)
+        charts = chart_of_accounts(accounts, depth, len(periods), rng)
+
+        target = Path(out_dir) if companies == 1 else Path(out_dir) / f"company_{company}"
+        target.mkdir(parents=True, exist_ok=True)
+        with open(target / "data_set_1.json", "w", encoding="utf-8") as f:
+            json.dump(quickbooks_report(charts, periods), f)
+        with open(target / "data_set_2.json", "w", encoding="utf-8") as f:
+            json.dump(rootfi_report(charts, periods[rootfi_offset:], rootfi_offset, company), f)
+        written.append(target)
+    return written
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Write QuickBooks- and Rootfi-shaped exports at a chosen scale")
+    parser.add_argument("out_dir")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--accounts", type=int, default=60)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--companies", type=int, default=1)
+    parser.add_argument("--start-year", type=int, default=2020)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    for path in write_dataset(args.out_dir, args.years, args.accounts, args.depth, args.companies,
+                              args.start_year, args.seed):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()